@@ -1,3 +1,18 @@
 from django.contrib import admin
+from .models import SafeLocation, Observation
 
 # Register your models here.
+@admin.register(SafeLocation)
+class SafeLocationAdmin(admin.ModelAdmin):
+    list_display = ('name', 'category', 'city', 'latitude', 'longitude', 'is_active')
+    list_filter = ('category', 'city', 'is_active')
+    search_fields = ('name', 'city')
+
+
+@admin.register(Observation)
+class ObservationAdmin(admin.ModelAdmin):
+    list_display = ('cell', 'observed_at', 'source', 'aqi', 'pm2_5', 'temp_c', 'humidity', 'wind_kph')
+    list_filter = ('source',)
+    search_fields = ('cell',)
+    date_hierarchy = 'observed_at'
+    show_full_result_count = False  # الجدول كبير، وتجنب COUNT(*) الكامل
@@ -0,0 +1,470 @@
+import json
+import asyncio
+import logging
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .cache import acached_fetch, location_cell
+from .concurrency import agather
+from .http_client import async_upstream_request, provider_for_url, upstream_url
+from .circuit import CircuitOpenError, QuotaExceededError
+from . import quota
+from .metrics import record_fallback, fallback_cause
+from .timing import timed
+from .gemini import gemini_available
+from .observations import record_observation
+from .forecast import get_cached_forecast, build_forecast, utc_today
+from .conditional import cell_conditional
+from .renderers import dumps, parse_fields, select_fields
+from .lst import surface_temperature
+from .views import (
+    get_fallback_weather_data,
+    get_fallback_nasa_data,
+    get_fallback_route_data,
+    parse_air_quality,
+    parse_route_data,
+    tomtom_route_params,
+    nasa_search_params,
+    NASA_CMR_GRANULES_PATH,
+    nasa_tile,
+    nasa_granule_ttl,
+    nasa_latest_granule,
+    group_points_by_cell,
+    expand_cell_results,
+    route_sample_cells,
+    pick_best_route,
+    get_safe_location_candidates,
+    rank_safe_locations,
+    describe_safe_location,
+    format_air_quality_forecast,
+    validate_forecast_fields,
+    slice_forecast_days,
+    build_advice_context,
+    gemini_model_candidates,
+    remember_gemini_model,
+    forget_gemini_model,
+    advice_cache_key,
+    wants_advice_stream,
+    advice_stream_response,
+    get_cached_advice,
+    cache_advice,
+    calculate_safety_score_from_aqi,
+    get_safety_level,
+    FutureWeatherAPIView,
+    AIAdviceAPIView,
+)
+
+logger = logging.getLogger(__name__)
+
+# مسار غير متزامن (ASGI) لنفس الـ endpoints: نفس المنطق والردود مع عميل HTTP غير حاجب
+
+
+async def async_safe_request(url, params=None, headers=None, provider=None, auth=None):
+    try:
+        return await async_upstream_request(provider or provider_for_url(url), url, params=params, headers=headers, auth=auth)
+    except CircuitOpenError as e:
+        logger.debug(f"Skipping {url}: {e}")
+        return {'error': str(e), 'cause': fallback_cause(e)}
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error(f"Request failed for {url}: {e}")
+        return {'error': str(e), 'cause': fallback_cause(e)}
+
+
+@timed('get_weather_api_data')
+async def aget_weather_api_data(lat, lon):
+    try:
+        api_key = settings.WEATHER_API_KEY
+        if not api_key:
+            logger.warning("WEATHER_API_KEY not configured")
+            record_fallback('weatherapi', 'missing_key')
+            return get_fallback_weather_data()
+
+        url = upstream_url('weatherapi', f"current.json?key={api_key}&q={lat},{lon}")
+        data = await acached_fetch('current', lat, lon, lambda: async_safe_request(url, provider='weatherapi'),
+                                   on_store=lambda data: record_observation(lat, lon, 'current', data))
+
+        if 'error' in data:
+            logger.warning(f"WeatherAPI failed, using fallback: {data['error']}")
+            record_fallback('weatherapi', data.get('cause', 'error'))
+            return get_fallback_weather_data()
+
+        return data
+
+    except Exception as e:
+        logger.error(f"WeatherAPI error: {e}")
+        record_fallback('weatherapi', 'error')
+        return get_fallback_weather_data()
+
+
+@timed('get_combined_air_quality')
+async def aget_combined_air_quality(lat, lon):
+    try:
+        api_key = settings.WEATHER_API_KEY
+        if not api_key:
+            record_fallback('weatherapi_aqi', 'missing_key')
+            return {'aqi': 3}
+
+        url = upstream_url('weatherapi', f"current.json?key={api_key}&q={lat},{lon}&aqi=yes")
+        data = await acached_fetch('current_aqi', lat, lon, lambda: async_safe_request(url, provider='weatherapi'),
+                                   on_store=lambda data: record_observation(lat, lon, 'current_aqi', data))
+
+        if 'error' in data:
+            logger.warning(f"WeatherAPI air quality failed: {data['error']}")
+            record_fallback('weatherapi_aqi', data.get('cause', 'error'))
+            return {'aqi': 3}
+
+        return parse_air_quality(data)
+
+    except Exception as e:
+        logger.error(f"Combined air quality error: {e}")
+        record_fallback('weatherapi_aqi', 'error')
+        return {'aqi': 3}
+
+
+@timed('get_forecast_data')
+async def aget_forecast_data(lat, lon):
+    api_key = settings.WEATHER_API_KEY
+    if not api_key:
+        record_fallback('weatherapi_forecast', 'missing_key')
+        return {'error': 'WEATHER_API_KEY not configured'}
+    url = upstream_url('weatherapi', f"forecast.json?key={api_key}&q={lat},{lon}&days=7&aqi=yes")
+    data = await acached_fetch('forecast', lat, lon, lambda: async_safe_request(url, provider='weatherapi'),
+                               on_store=lambda data: record_observation(lat, lon, 'current_aqi', data))
+    if 'error' in data:
+        record_fallback('weatherapi_forecast', data.get('cause', 'error'))
+    return data
+
+
+async def aget_air_quality_many(points, timeout=None):
+    """النسخة غير المتزامنة من get_air_quality_many"""
+    if timeout is None:
+        timeout = settings.ROUTE_SCORING['DEADLINE']
+
+    cells = group_points_by_cell(points)
+    if not cells:
+        return {}
+    tasks = {cell: asyncio.ensure_future(aget_combined_air_quality(*point)) for cell, point in cells.items()}
+    # المهام التي تتجاوز المهلة تكمل في الخلفية وتملأ الذاكرة المؤقتة
+    await asyncio.wait(tasks.values(), timeout=timeout)
+
+    results = {cell: task.result() for cell, task in tasks.items() if task.done() and not task.exception()}
+    if len(results) < len(tasks):
+        logger.warning(f"Air quality lookups timed out for {len(tasks) - len(results)}/{len(tasks)} cells, using estimates")
+    return expand_cell_results(points, cells, results)
+
+
+@timed('get_nasa_earth_data')
+async def aget_nasa_earth_data(lat, lon):
+    try:
+        username = settings.NASA_EARTHDATA_USERNAME
+        password = settings.NASA_EARTHDATA_PASSWORD
+
+        if not username or not password:
+            record_fallback('nasa', 'missing_key')
+            return get_fallback_nasa_data(lat, lon)
+
+        tile, (tile_lat, tile_lon) = nasa_tile(lat, lon)
+        url = upstream_url('nasa', NASA_CMR_GRANULES_PATH)
+        data = await acached_fetch(
+            'nasa_granule', lat, lon,
+            lambda: async_safe_request(url, params=nasa_search_params(tile_lat, tile_lon), provider='nasa', auth=(username, password)),
+            ttl_for=nasa_granule_ttl, cell=f"{tile}:{utc_today().isoformat()}", track=False,
+        )
+
+        if 'error' in data:
+            record_fallback('nasa', data.get('cause', 'error'))
+            return get_fallback_nasa_data(lat, lon)
+
+        return nasa_latest_granule(data) or get_fallback_nasa_data(lat, lon)
+
+    except Exception as e:
+        logger.error(f"NASA EarthData error: {e}")
+        record_fallback('nasa', 'error')
+        return get_fallback_nasa_data(lat, lon)
+
+
+@timed('get_list_of_ways')
+async def aget_list_of_ways(lat1, lon1, lat2, lon2):
+    try:
+        api_key = settings.TOMTOM_API_KEY
+        if not api_key:
+            record_fallback('tomtom', 'missing_key')
+            return get_fallback_route_data(lat1, lon1, lat2, lon2)
+
+        url = upstream_url('tomtom', f"routing/1/calculateRoute/{lat1},{lon1}:{lat2},{lon2}/json")
+        data = await async_safe_request(url, params=tomtom_route_params(api_key), provider='tomtom')
+
+        if 'error' in data:
+            logger.warning(f"TomTom failed, using fallback: {data['error']}")
+            record_fallback('tomtom', data.get('cause', 'error'))
+            return get_fallback_route_data(lat1, lon1, lat2, lon2)
+
+        return parse_route_data(data)
+
+    except Exception as e:
+        logger.error(f"TomTom routing error: {e}")
+        record_fallback('tomtom', 'error')
+        return get_fallback_route_data(lat1, lon1, lat2, lon2)
+
+
+@timed('generate_content')
+async def agenerate_advice(full_prompt):
+    """النسخة غير المتزامنة من generate_advice"""
+    # قد تستورد مكتبة Gemini عند أول استخدام، فتبنى النماذج خارج event loop
+    candidates = await sync_to_async(list)(gemini_model_candidates())
+    for name, model in candidates:
+        try:
+            await quota.aacquire('gemini')
+            response = await model.generate_content_async(full_prompt)
+            if response.text:
+                remember_gemini_model(name, model)
+                return response.text
+        except QuotaExceededError:
+            raise
+        except Exception as model_error:
+            logger.warning(f"Model {name} failed, trying alternatives: {model_error}")
+        forget_gemini_model(name)
+    raise Exception("All Gemini models failed")
+
+
+def json_response(data, status=200, request=None):
+    """رد JSON عبر orjson؛ مع request يطبق ?fields= على الردود الناجحة كما في FastJSONRenderer"""
+    if request is not None and status < 400:
+        data = select_fields(data, parse_fields(request.GET.get('fields')))
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+def parse_location(params, *names):
+    """قراءة الإحداثيات من المعاملات، ترفع LookupError إذا كانت ناقصة و ValueError إذا كانت غير صالحة"""
+    values = [params.get(name) for name in names]
+    if not all(values):
+        raise LookupError
+    return [float(value) for value in values]
+
+
+class AsyncLocationView(View):
+    """أساس مشترك للـ views غير المتزامنة التي تتطلب lat/lon"""
+
+    async def get(self, request):
+        try:
+            lat, lon = parse_location(request.GET, 'lat', 'lon')
+        except LookupError:
+            return json_response({'error': 'Latitude and Longitude are required.'}, status=400)
+        except ValueError:
+            return json_response({'error': 'Invalid Latitude or Longitude.'}, status=400)
+        return await self.handle(request, lat, lon)
+
+
+class AsyncAirQualityView(AsyncLocationView):
+    @cell_conditional('current_aqi')
+    async def handle(self, request, lat, lon):
+        return json_response(await aget_combined_air_quality(lat, lon), request=request)
+
+
+class AsyncSafetyScoreView(AsyncLocationView):
+    @cell_conditional('current_aqi')
+    async def handle(self, request, lat, lon):
+        air_quality = (await aget_combined_air_quality(lat, lon)).get('aqi', 3)
+        safety_score = calculate_safety_score_from_aqi(air_quality)
+        return json_response({
+            'safety_score': safety_score,
+            'safety_level': get_safety_level(safety_score),
+            'air_quality_index': air_quality
+        }, request=request)
+
+
+class AsyncWeatherView(AsyncLocationView):
+    @cell_conditional('current')
+    async def handle(self, request, lat, lon):
+        return json_response(await aget_weather_api_data(lat, lon), request=request)
+
+
+class AsyncComprehensiveSafetyView(AsyncLocationView):
+    async def handle(self, request, lat, lon):
+        results, pending = await agather({
+            'air_quality': aget_combined_air_quality(lat, lon),
+            'nasa': aget_nasa_earth_data(lat, lon),
+        }, settings.COMPREHENSIVE_SAFETY['DEADLINE'])
+        if pending:
+            logger.warning(f"Comprehensive safety lookups timed out: {', '.join(sorted(pending))}")
+            if 'nasa' in pending:
+                record_fallback('nasa', 'timeout')
+
+        air_quality = results.get('air_quality', {}).get('aqi', 3)
+        safety_score = calculate_safety_score_from_aqi(air_quality)
+        return json_response({
+            'air_quality_index': air_quality,
+            'safety_score': safety_score,
+            'safety_level': get_safety_level(safety_score),
+            'nasa_earth_data': results.get('nasa') or get_fallback_nasa_data(lat, lon),
+            'surface_temperature': surface_temperature(lat, lon),
+            'location': {'lat': lat, 'lon': lon}
+        }, request=request)
+
+
+class AsyncNearestSafeLocationView(AsyncLocationView):
+    async def handle(self, request, lat, lon):
+        # الفهرس المكاني قد يحتاج قاعدة البيانات عند أول تحميل
+        candidates, safe_locations = await sync_to_async(get_safe_location_candidates)(lat, lon)
+        air_quality = await aget_air_quality_many(safe_locations)
+        nearest_location = rank_safe_locations(lat, lon, safe_locations, air_quality)
+
+        if not nearest_location:
+            return json_response({'error': 'No safe locations found.'}, status=404)
+
+        loc_air_quality = air_quality[nearest_location]['aqi']
+        return json_response({'nearest_safe_location': describe_safe_location(nearest_location, loc_air_quality, candidates)}, request=request)
+
+
+class AsyncBestRouteView(View):
+    async def get(self, request):
+        try:
+            start_lat, start_lon, end_lat, end_lon = parse_location(
+                request.GET, 'start_lat', 'start_lon', 'end_lat', 'end_lon'
+            )
+        except LookupError:
+            return json_response({'error': 'Start and End Latitude and Longitude are required.'}, status=400)
+        except ValueError:
+            return json_response({'error': 'Invalid Latitude or Longitude.'}, status=400)
+
+        ways = await aget_list_of_ways(start_lat, start_lon, end_lat, end_lon)
+        best_way = None
+        if ways:
+            weights, all_points = route_sample_cells(ways)
+            best_way = pick_best_route(ways, weights, await aget_air_quality_many(all_points))
+
+        if not best_way:
+            return json_response({'error': 'No routes found.'}, status=404)
+        return json_response(best_way, request=request)
+
+
+class AsyncForecastView(View):
+    async def get(self, request):
+        try:
+            lat, lon = parse_location(request.GET, 'lat', 'lon')
+            days = int(request.GET.get('days', 3))
+            if days < 1 or days > 7:
+                raise ValueError
+        except LookupError:
+            return json_response({'error': 'Latitude and Longitude are required.'}, status=400)
+        except ValueError:
+            return json_response({'error': 'Invalid Latitude, Longitude, or Days (1-7).'}, status=400)
+        return await self.handle(request, lat, lon, days)
+
+
+class AsyncFutureAirQualityView(AsyncForecastView):
+    @cell_conditional('forecast', extra=lambda request: utc_today())
+    async def handle(self, request, lat, lon, days):
+        cell = location_cell(lat, lon)
+        forecast = await sync_to_async(get_cached_forecast)(cell)
+        if forecast is None:
+            forecast = await sync_to_async(build_forecast)(cell, await aget_forecast_data(lat, lon))
+        return json_response(format_air_quality_forecast(forecast, days), request=request)
+
+
+class AsyncFutureWeatherView(AsyncForecastView):
+    @cell_conditional('forecast')
+    async def handle(self, request, lat, lon, days):
+        fallback = FutureWeatherAPIView().get_fallback_weather_forecast
+        try:
+            validate_forecast_fields(request.GET.get('fields'))
+        except ValueError as e:
+            return json_response({'error': str(e)}, status=400)
+
+        try:
+            weather_data = await aget_forecast_data(lat, lon)
+
+            if 'error' in weather_data:
+                return json_response(fallback(days).data, request=request)
+
+            return json_response(slice_forecast_days(weather_data, days), request=request)
+
+        except Exception as e:
+            logger.error(f"Future weather error: {e}")
+            record_fallback('weatherapi_forecast', 'error')
+            return json_response(fallback(days).data, request=request)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAIAdviceView(View):
+    async def post(self, request):
+        fallback_advice = AIAdviceAPIView().get_fallback_advice()
+        if not await sync_to_async(gemini_available)():
+            record_fallback('gemini', 'missing_key')
+            return json_response({
+                'error': 'Gemini API is not configured or unavailable.',
+                'advice': fallback_advice
+            }, status=503)
+
+        try:
+            data = json.loads(request.body or b'{}') if request.content_type == 'application/json' else request.POST
+        except ValueError:
+            data = {}
+        prompt = data.get('prompt', 'قدم نصائح حول السلامة البيئية')
+
+        if data.get('lat') is None or data.get('lon') is None:
+            return json_response({
+                'error': 'Latitude and longitude are required.',
+                'advice': fallback_advice
+            }, status=400)
+
+        try:
+            lat = float(data.get('lat'))
+            lon = float(data.get('lon'))
+        except (TypeError, ValueError):
+            return json_response({
+                'error': 'Invalid Latitude or Longitude.',
+                'advice': fallback_advice
+            }, status=400)
+
+        # وضع البث (stream=true) كما في AIAdviceAPIView، كل حدث يرسل فور توفره
+        if wants_advice_stream(data, request.GET):
+            return advice_stream_response(request, lat, lon, prompt, fallback_advice)
+
+        try:
+            results, pending = await agather({
+                'air_quality': aget_combined_air_quality(lat, lon),
+                'weather': aget_weather_api_data(lat, lon),
+            }, settings.COMPREHENSIVE_SAFETY['DEADLINE'])
+            if pending:
+                logger.warning(f"AI advice lookups timed out: {', '.join(sorted(pending))}")
+                if 'air_quality' in pending:
+                    record_fallback('weatherapi_aqi', 'timeout')
+                if 'weather' in pending:
+                    record_fallback('weatherapi', 'timeout')
+            weather_data = results.get('weather') or get_fallback_weather_data()
+            aqi = results.get('air_quality', {}).get('aqi', 3)
+            safety_score = calculate_safety_score_from_aqi(aqi)
+            safety_level = get_safety_level(safety_score)
+            cache_key = advice_cache_key(prompt, aqi, safety_level, weather_data)
+            advice = get_cached_advice(cache_key)
+            cached = advice is not None
+
+            if not cached:
+                context = build_advice_context(lat, lon, aqi, safety_score, safety_level, weather_data)
+                try:
+                    advice = await agenerate_advice(context + "\n\n" + prompt)
+                    cache_advice(cache_key, advice)
+                except Exception as e:
+                    logger.error(f"Gemini model error: {e}")
+                    record_fallback('gemini', fallback_cause(e))
+                    advice = fallback_advice
+
+            return json_response({
+                'advice': advice,
+                'cached': cached,
+                'safety_score': safety_score,
+                'safety_level': safety_level,
+                'air_quality_index': aqi,
+                'location': {'lat': lat, 'lon': lon}
+            }, request=request)
+
+        except Exception as e:
+            logger.error(f"AI Advice error: {e}")
+            record_fallback('gemini', 'error')
+            return json_response({'error': str(e), 'advice': fallback_advice})
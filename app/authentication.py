@@ -0,0 +1,17 @@
+from rest_framework.authentication import TokenAuthentication, SessionAuthentication
+
+from .timing import phase
+
+
+# نفس أصناف المصادقة في DRF مع قياس زمنها كمرحلة auth في Server-Timing
+
+class TimedTokenAuthentication(TokenAuthentication):
+    def authenticate(self, request):
+        with phase('auth'):
+            return super().authenticate(request)
+
+
+class TimedSessionAuthentication(SessionAuthentication):
+    def authenticate(self, request):
+        with phase('auth'):
+            return super().authenticate(request)
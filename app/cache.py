@@ -0,0 +1,391 @@
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics, quota, refresher
+
+logger = logging.getLogger(__name__)
+
+GEO_CACHE_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'PRECISION': 6,          # geohash بدقة 6 ≈ خلية 1.2 كم × 0.6 كم
+    'UPDATE_INTERVAL': 900,  # WeatherAPI يحدث البيانات الحالية كل 15 دقيقة
+    'MIN_TTL': 60,
+    'MAX_TTL': 900,
+    'LOCK_TIMEOUT': 15,
+    'STALE_TTL': 300,                # مدة خدمة القيمة القديمة بعد انتهاء صلاحيتها أثناء إعادة الجلب
+    'REFRESH_ENABLED': True,         # إعادة جلب الخلايا الأكثر طلباً قبل انتهاء صلاحيتها
+    'REFRESH_INTERVAL': 15,
+    'REFRESH_AHEAD': 60,             # الخلايا التي تنتهي صلاحيتها خلال هذه المدة تعاد
+    'REFRESH_MIN_HITS': 3,
+    'REFRESH_HALF_LIFE': 600,        # تناقص عدد الطلبات المسجلة لكل خلية مع الوقت
+    'REFRESH_BUDGET_PER_MINUTE': 30,
+}
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def get_geo_cache_config():
+    config = dict(GEO_CACHE_DEFAULTS)
+    config.update(getattr(settings, 'GEO_CACHE', {}))
+    return config
+
+
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared_cache(alias):
+    """هل الذاكرة المؤقتة مشتركة بين العمليات (Redis, Memcached, DB, ملفات) وليست خاصة بكل عملية"""
+    backend = settings.CACHES.get(alias, {}).get('BACKEND', '')
+    return backend not in PROCESS_LOCAL_BACKENDS
+
+
+def geohash_encode(lat, lon, precision=6):
+    """ترميز الإحداثيات إلى geohash بالدقة المطلوبة"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def location_cell(lat, lon, precision=None):
+    """الخلية المكانية (geohash) التي يقع فيها الموقع"""
+    if precision is None:
+        precision = get_geo_cache_config()['PRECISION']
+    return geohash_encode(lat, lon, precision)
+
+
+def cell_cache_key(endpoint, cell):
+    return f"geo:{endpoint}:{cell}"
+
+
+def is_cached(endpoint, lat, lon):
+    """هل بيانات هذه الخلية موجودة في الذاكرة المؤقتة (بدون استدعاء المصدر)"""
+    config = get_geo_cache_config()
+    key = cell_cache_key(endpoint, location_cell(lat, lon, config['PRECISION']))
+    return caches[config['CACHE_ALIAS']].has_key(key)
+
+
+def get_entries(endpoint, cells):
+    """المدخلات المخزنة ({'data', 'fetched_at', 'expires_at'}) لعدة خلايا بطلب واحد: cell -> entry"""
+    config = get_geo_cache_config()
+    keys = {cell_cache_key(endpoint, cell): cell for cell in cells}
+    found = caches[config['CACHE_ALIAS']].get_many(list(keys))
+    return {keys[key]: entry for key, entry in found.items()}
+
+
+def weather_api_ttl(data):
+    """مدة التخزين حتى التحديث التالي لـ WeatherAPI بناءً على last_updated_epoch"""
+    config = get_geo_cache_config()
+    last_updated = data.get('current', {}).get('last_updated_epoch')
+    if not last_updated:
+        return config['MAX_TTL']
+    ttl = int(last_updated + config['UPDATE_INTERVAL'] - time.time())
+    return max(config['MIN_TTL'], min(config['MAX_TTL'], ttl))
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'uncached': 0, 'stale': 0, 'refreshed': 0}
+_stats_lock = threading.Lock()
+
+
+def _record(counter):
+    with _stats_lock:
+        _stats[counter] += 1
+    metrics.inc('geo_cache_lookups_total', result=counter)
+
+
+def get_cache_stats():
+    """عدادات الإصابة والإخفاق لذاكرة الخلايا في هذه العملية"""
+    with _stats_lock:
+        stats = dict(_stats)
+    served = stats['hits'] + stats['coalesced'] + stats['stale']
+    lookups = served + stats['misses']
+    stats['hit_ratio'] = round(served / lookups, 4) if lookups else 0.0
+    stats.update(refresher.get_refresher_stats())
+    return stats
+
+
+def _wait_for_entry(cache, key, lock_key, timeout):
+    """
+    انتظار عامل آخر يجلب نفس الخلية (single-flight بين العمليات)
+    يتوقف فور تحرير القفل بدون قيمة، لأن الأخطاء لا تخزن ولا فائدة من الانتظار
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if cache.get(lock_key) is None:
+            return cache.get(key)
+        time.sleep(0.05)
+    return None
+
+
+def _make_entry(data, ttl_for):
+    """المدخل المخزن أو None إذا كان الرد خطأ؛ يبقى في الذاكرة STALE_TTL بعد انتهاء صلاحيته"""
+    if not isinstance(data, dict) or 'error' in data:
+        return None
+    ttl = ttl_for(data)
+    now = time.time()
+    return {'data': data, 'fetched_at': now, 'expires_at': now + ttl}, ttl + get_geo_cache_config()['STALE_TTL']
+
+
+def _stored(data, on_store):
+    """إبلاغ on_store بكل رد جديد من المصدر تم تخزينه"""
+    if on_store is None:
+        return
+    try:
+        on_store(data)
+    except Exception as e:
+        logger.warning(f"on_store callback failed: {e}")
+
+
+def _recently_refreshed(entry, config):
+    """المدخل ما زال بعيداً عن انتهاء صلاحيته أو جلب خلال آخر دورة للمجدول"""
+    now = time.time()
+    return (entry['expires_at'] - now > config['REFRESH_AHEAD']
+            or now - entry['fetched_at'] < config['REFRESH_INTERVAL'])
+
+
+def _refresh(cache, key, fetch, ttl_for, lock_timeout, on_store=None):
+    """إعادة جلب خلية في الخلفية، تعيد expires_at الجديد أو None"""
+    lock_key = f"{key}:lock"
+    if not cache.add(lock_key, 1, lock_timeout):
+        return None
+    try:
+        # مع ذاكرة مشتركة قد يكون عامل آخر أعاد الخلية في نفس الدورة، فلا تستدعى مرة ثانية
+        current = cache.get(key)
+        if current is not None and _recently_refreshed(current, get_geo_cache_config()):
+            return current['expires_at']
+        stored = _make_entry(fetch(), ttl_for)
+        if stored is not None:
+            cache.set(key, *stored)
+    finally:
+        cache.delete(lock_key)
+    if stored is None:
+        _record('uncached')
+        return None
+    entry = stored[0]
+    _record('refreshed')
+    _stored(entry['data'], on_store)
+    return entry['expires_at']
+
+
+def _serve_entry(key, entry, refresh):
+    """القيمة المخزنة مع تسجيل الشعبية، والقيمة المنتهية تُخدم فوراً وتعاد في الخلفية"""
+    if refresh is not None:
+        refresher.track(key, entry['expires_at'], refresh)
+    if entry['expires_at'] > time.time():
+        _record('hits')
+    else:
+        _record('stale')
+        if refresh is not None:
+            refresher.refresh_soon(key, refresh)
+    return entry['data']
+
+
+def cached_fetch(endpoint, lat, lon, fetch, ttl_for=weather_api_ttl, on_store=None, cell=None, track=True):
+    """
+    قراءة من الذاكرة المؤقتة حسب الخلية المكانية والـ endpoint، وإلا استدعاء fetch
+    الطلبات المتزامنة لنفس الخلية تنتظر استدعاءً واحداً فقط للمصدر
+    الردود التي تحتوي على 'error' لا يتم تخزينها
+    القيم المنتهية منذ أقل من STALE_TTL تُخدم فوراً بينما تعاد في الخلفية
+    on_store(data) تستدعى مرة لكل رد جديد يخزن (بما فيها إعادة الجلب في الخلفية)
+    cell: مفتاح مكاني بديل عن geohash (مثل خلية NASA لليوم)
+    track=False: لا تعاد الخلية في الخلفية، للمفاتيح التي تتغير مع الوقت
+    """
+    config = get_geo_cache_config()
+    cache = caches[config['CACHE_ALIAS']]
+    key = cell_cache_key(endpoint, cell or location_cell(lat, lon, config['PRECISION']))
+
+    def refresh():
+        # إعادة الجلب في الخلفية لا تستهلك الجزء المحجوز من الميزانية للطلبات التفاعلية
+        with quota.priority(quota.BACKGROUND):
+            return _refresh(cache, key, fetch, ttl_for, config['LOCK_TIMEOUT'], on_store)
+
+    if not track:
+        refresh = None
+
+    entry = cache.get(key)
+    if entry is not None:
+        return _serve_entry(key, entry, refresh)
+
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            _inflight[key] = flight
+
+    if not leader:
+        if flight.event.wait(config['LOCK_TIMEOUT']) and flight.result is not None:
+            _record('coalesced')
+            return flight.result
+        _record('misses')
+        return fetch()
+
+    _record('misses')
+    lock_key = f"{key}:lock"
+    try:
+        acquired = cache.add(lock_key, 1, config['LOCK_TIMEOUT'])
+        if not acquired:
+            entry = _wait_for_entry(cache, key, lock_key, config['LOCK_TIMEOUT'])
+            if entry is not None:
+                flight.result = entry['data']
+                return flight.result
+        try:
+            data = fetch()
+            # التخزين قبل تحرير القفل حتى يجد المنتظرون القيمة عند تحريره
+            stored = _make_entry(data, ttl_for)
+            if stored is not None:
+                cache.set(key, *stored)
+        finally:
+            if acquired:
+                cache.delete(lock_key)
+
+        if stored is not None:
+            if refresh is not None:
+                refresher.track(key, stored[0]['expires_at'], refresh)
+            _stored(data, on_store)
+        else:
+            _record('uncached')
+        flight.result = data
+        return data
+    finally:
+        flight.event.set()
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+_async_inflight = {}
+
+
+async def acached_fetch(endpoint, lat, lon, fetch, ttl_for=weather_api_ttl, on_store=None, cell=None, track=True):
+    """
+    النسخة غير المتزامنة من cached_fetch، fetch هنا دالة async
+    الطلبات المتزامنة لنفس الخلية داخل نفس event loop تنتظر نفس الاستدعاء
+    """
+    config = get_geo_cache_config()
+    cache = caches[config['CACHE_ALIAS']]
+    key = cell_cache_key(endpoint, cell or location_cell(lat, lon, config['PRECISION']))
+    loop = asyncio.get_running_loop()
+
+    def refresh():
+        # fetch مرتبطة بـ event loop هذا الطلب، فيُنفذ الاستدعاء عليه من thread المجدول
+        async def background_fetch():
+            with quota.priority(quota.BACKGROUND):
+                return await fetch()
+
+        def fetch_on_loop():
+            return asyncio.run_coroutine_threadsafe(background_fetch(), loop).result(config['LOCK_TIMEOUT'])
+        return _refresh(cache, key, fetch_on_loop, ttl_for, config['LOCK_TIMEOUT'], on_store)
+
+    if not track:
+        refresh = None
+
+    entry = await cache.aget(key)
+    if entry is not None:
+        return _serve_entry(key, entry, refresh)
+
+    flight_key = (id(loop), key)
+    flight = _async_inflight.get(flight_key)
+    if flight is not None:
+        _record('coalesced')
+        return await asyncio.shield(flight)
+
+    _record('misses')
+    flight = loop.create_future()
+    _async_inflight[flight_key] = flight
+    try:
+        try:
+            data = await fetch()
+        except Exception as e:
+            data = {'error': str(e)}
+        stored = _make_entry(data, ttl_for)
+        if stored is not None:
+            await cache.aset(key, *stored)
+            if refresh is not None:
+                refresher.track(key, stored[0]['expires_at'], refresh)
+            _stored(data, on_store)
+        else:
+            _record('uncached')
+        flight.set_result(data)
+        return data
+    finally:
+        if not flight.done():
+            flight.set_result({'error': 'cancelled'})
+        _async_inflight.pop(flight_key, None)
+
+
+class LRUCache:
+    """ذاكرة مؤقتة محلية بحجم محدود، تحذف الأقدم استخداماً عند الامتلاء"""
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
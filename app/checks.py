@@ -0,0 +1,19 @@
+from django.core.checks import Warning, register
+
+from .cache import is_shared_cache
+from .quota import get_upstream_quota_config
+
+
+@register()
+def upstream_quota_cache_check(app_configs, **kwargs):
+    """ميزانية المصادر لا تكون مشتركة بين العمال إذا كانت ذاكرة العدادات خاصة بكل عملية"""
+    config = get_upstream_quota_config()
+    if not config['ENABLED'] or not config['LIMITS'] or is_shared_cache(config['CACHE_ALIAS']):
+        return []
+    return [Warning(
+        f"UPSTREAM_QUOTA CACHE_ALIAS '{config['CACHE_ALIAS']}' is process-local, so workers do not "
+        f"share quota counters; each enforces 1/{max(1, config['LOCAL_WORKERS'])} of every limit.",
+        hint="Use a shared cache (Redis, Memcached, database) for CACHE_ALIAS, "
+             "or set WEB_CONCURRENCY to the number of workers.",
+        id='app.W001',
+    )]
@@ -0,0 +1,169 @@
+import time
+import random
+import threading
+import logging
+from collections import deque
+import httpx
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_BREAKER_DEFAULTS = {
+    'WINDOW': 20,              # عدد آخر الاستدعاءات التي تحسب منها النسب
+    'MIN_CALLS': 10,           # لا يفتح القاطع قبل هذا العدد من الاستدعاءات
+    'ERROR_RATE': 0.5,
+    'SLOW_CALL_MS': 5000,
+    'SLOW_RATE': 0.8,
+    'OPEN_SECONDS': 30,        # مدة الفتح قبل السماح باستدعاء تجريبي (half-open)
+    'HALF_OPEN_CALLS': 1,
+    'RETRIES': 2,              # إعادة المحاولة للأخطاء المؤقتة فقط
+    'BACKOFF_BASE': 0.2,
+    'BACKOFF_MAX': 2.0,
+}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def get_circuit_breaker_config():
+    config = dict(CIRCUIT_BREAKER_DEFAULTS)
+    config.update(getattr(settings, 'CIRCUIT_BREAKER', {}))
+    return config
+
+
+# يرث من نوعي الأخطاء حتى تلتقطه معالجات المسار المتزامن وغير المتزامن كما هي
+class CircuitOpenError(requests.RequestException, httpx.HTTPError):
+    pass
+
+
+class QuotaExceededError(CircuitOpenError):
+    """الاستدعاء لم يرسل لأن ميزانية مفتاح الـ API استهلكت (انظر app/quota.py)"""
+
+
+class CircuitBreaker:
+    """قاطع دائرة لمصدر خارجي واحد: closed ثم open عند تجاوز نسب الأخطاء أو البطء ثم half_open"""
+
+    def __init__(self, provider, config):
+        self.provider = provider
+        self.config = config
+        self.state = CLOSED
+        self.calls = deque(maxlen=config['WINDOW'])
+        self.opened_at = None
+        self.half_open_inflight = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """ترفع CircuitOpenError إذا كان القاطع مفتوحاً"""
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.config['OPEN_SECONDS']:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Circuit open for {self.provider}")
+                self.state = HALF_OPEN
+                self.half_open_inflight = 0
+                logger.info(f"Circuit half-open for {self.provider}, sending probe")
+            if self.state == HALF_OPEN:
+                if self.half_open_inflight >= self.config['HALF_OPEN_CALLS']:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Circuit half-open for {self.provider}, probe in progress")
+                self.half_open_inflight += 1
+
+    def record(self, ok, elapsed_ms):
+        config = self.config
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.half_open_inflight = max(0, self.half_open_inflight - 1)
+                if ok:
+                    self.state = CLOSED
+                    self.calls.clear()
+                    logger.info(f"Circuit closed for {self.provider}")
+                else:
+                    self._open()
+                return
+            self.calls.append((ok, elapsed_ms >= config['SLOW_CALL_MS']))
+            if self.state == CLOSED and len(self.calls) >= config['MIN_CALLS']:
+                errors = sum(1 for call_ok, _ in self.calls if not call_ok) / len(self.calls)
+                slow = sum(1 for _, call_slow in self.calls if call_slow) / len(self.calls)
+                if errors >= config['ERROR_RATE'] or slow >= config['SLOW_RATE']:
+                    logger.warning(
+                        f"Circuit opened for {self.provider}: error rate {errors:.0%}, slow rate {slow:.0%}"
+                    )
+                    self._open()
+
+    def release(self):
+        """استدعاء انتهى بدون نتيجة (مثل إلغائه عند مهلة الطلب): يحرر مكان الاستدعاء التجريبي فقط"""
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.half_open_inflight = max(0, self.half_open_inflight - 1)
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.calls.clear()
+
+    def snapshot(self):
+        with self.lock:
+            calls = len(self.calls)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'error_rate': round(sum(1 for ok, _ in self.calls if not ok) / calls, 4) if calls else 0.0,
+                'slow_rate': round(sum(1 for _, slow in self.calls if slow) / calls, 4) if calls else 0.0,
+                'rejected': self.rejected,
+                'retry_in': (
+                    max(0.0, round(self.config['OPEN_SECONDS'] - (time.monotonic() - self.opened_at), 1))
+                    if self.state == OPEN else None
+                ),
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(provider)
+            if breaker is None:
+                breaker = CircuitBreaker(provider, get_circuit_breaker_config())
+                _breakers[provider] = breaker
+    return breaker
+
+
+def get_breaker_states():
+    """حالة قواطع الدائرة في هذه العملية لكل مصدر"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.provider: breaker.snapshot() for breaker in breakers}
+
+
+def backoff_delay(attempt, config=None):
+    """انتظار أسي مع jitter كامل قبل المحاولة رقم attempt + 1"""
+    config = config or get_circuit_breaker_config()
+    return random.uniform(0, min(config['BACKOFF_MAX'], config['BACKOFF_BASE'] * (2 ** attempt)))
+
+
+def is_transient(error):
+    """
+    أخطاء الاتصال وردود 5xx و429 تستحق إعادة المحاولة
+    انتهاء مهلة القراءة لا يعاد لأن المصدر البطيء سيبطئ المحاولة التالية أيضاً
+    """
+    if isinstance(error, (requests.ReadTimeout, httpx.ReadTimeout)):
+        return False
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    return status_code is not None and (status_code >= 500 or status_code == 429)
+
+
+def counts_as_failure(error):
+    """أخطاء 4xx (عدا 429) سببها الطلب نفسه ولا تدل على تعطل المصدر"""
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    return status_code is None or status_code >= 500 or status_code == 429
@@ -0,0 +1,105 @@
+import os
+import asyncio
+import contextvars
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_background_tasks = set()
+
+
+def get_executor():
+    """مجمع threads مشترك ومحدود الحجم لاستدعاءات المصادر الخارجية المتوازية"""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is not None and _executor_pid == pid:
+        return _executor
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            max_workers = getattr(settings, 'UPSTREAM_MAX_WORKERS', 8)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upstream')
+            _executor_pid = pid
+    return _executor
+
+
+def gather(calls, timeout):
+    """
+    تنفيذ مجموعة استدعاءات بالتوازي مع مهلة إجمالية
+    calls: قاموس key -> (fn, args)
+    تعيد (results, pending) حيث pending هي المفاتيح التي لم تنته قبل المهلة أو فشلت
+    """
+    executor = get_executor()
+    # نسخ السياق حتى تسجل الاستدعاءات المتوازية مراحلها في Server-Timing للطلب نفسه
+    futures = {executor.submit(contextvars.copy_context().run, fn, *args): key for key, (fn, args) in calls.items()}
+    done, not_done = wait(futures, timeout=timeout)
+
+    results = {}
+    pending = set()
+    for future in done:
+        key = futures[future]
+        try:
+            results[key] = future.result()
+        except Exception as e:
+            logger.error(f"Concurrent call failed for {key}: {e}")
+            pending.add(key)
+    for future in not_done:
+        # الاستدعاءات الجارية تكمل في الخلفية وتملأ الذاكرة المؤقتة
+        future.cancel()
+        pending.add(futures[future])
+    return results, pending
+
+
+async def agather(calls, timeout):
+    """
+    النسخة غير المتزامنة من gather
+    calls: قاموس key -> coroutine
+    تعيد (results, pending) بنفس معنى gather
+    """
+    tasks = {asyncio.ensure_future(coro): key for key, coro in calls.items()}
+    done, not_done = await asyncio.wait(tasks, timeout=timeout)
+
+    results = {}
+    pending = set()
+    for task in done:
+        key = tasks[task]
+        try:
+            results[key] = task.result()
+        except Exception as e:
+            logger.error(f"Concurrent call failed for {key}: {e}")
+            pending.add(key)
+    for task in not_done:
+        # تكمل في الخلفية وتملأ الذاكرة المؤقتة؛ المرجع يبقيها حتى تنتهي
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        pending.add(tasks[task])
+    return results, pending
+
+
+_DONE = object()
+
+
+async def aiterate(iterator):
+    """
+    مولد متزامن كـ async iterator: كل جزء يحسب في thread ويرسل فوراً
+    StreamingHttpResponse تحت ASGI تجمع المولدات المتزامنة كاملة قبل إرسال أي شيء
+    عند انقطاع العميل يغلق المولد فتنفذ كتل finally فيه
+    """
+    iterator = iter(iterator)
+    step = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            item = await step(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=False)()
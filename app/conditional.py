@@ -0,0 +1,128 @@
+import time
+import hashlib
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+
+from .cache import cell_cache_key, get_geo_cache_config, location_cell
+
+CONDITIONAL_GET_DEFAULTS = {
+    'ENABLED': True,
+    'PUBLIC': True,  # الردود لا تعتمد على المستخدم، فيمكن للـ CDN والـ proxy تخزينها
+}
+
+
+def get_conditional_get_config():
+    config = dict(CONDITIONAL_GET_DEFAULTS)
+    config.update(getattr(settings, 'CONDITIONAL_GET', {}))
+    return config
+
+
+def _cell_keys(request, endpoints):
+    try:
+        lat = float(request.GET['lat'])
+        lon = float(request.GET['lon'])
+    except (KeyError, TypeError, ValueError):
+        return None, []
+    cell = location_cell(lat, lon)
+    return cell, [cell_cache_key(endpoint, cell) for endpoint in endpoints]
+
+
+def _validators(request, cell, keys, found, extra):
+    """
+    (etag, max_age) من الخلية ووقت جلب بيانات كل endpoint من المصدر
+    None إذا لم تكن كل البيانات في الذاكرة المؤقتة (رد بديل أو خطأ)
+    """
+    if cell is None or len(found) < len(keys):
+        return None
+    entries = [found[key] for key in keys]
+    parts = [
+        request.path,
+        '&'.join(f"{name}={value}" for name, values in sorted(request.GET.lists()) for value in values),
+        request.META.get('HTTP_ACCEPT', ''),
+        cell,
+    ]
+    parts += [f"{entry['fetched_at']:.3f}" for entry in entries]
+    if extra is not None:
+        parts.append(str(extra(request)))
+    etag = quote_etag(hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest())
+    max_age = max(0, int(min(entry['expires_at'] for entry in entries) - time.time()))
+    return etag, max_age
+
+
+def _patch_headers(response, validators, public):
+    patch_vary_headers(response, ('Accept',))
+    if validators is None:
+        patch_cache_control(response, no_cache=True)
+        return
+    etag, max_age = validators
+    response.headers.setdefault('ETag', etag)
+    if public:
+        patch_cache_control(response, public=True, max_age=max_age)
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+
+
+def _not_modified(request, validators, public):
+    """رد 304 قبل تنفيذ الـ view إذا طابق If-None-Match وكانت البيانات ما زالت صالحة"""
+    if validators is None or validators[1] <= 0 or 'HTTP_IF_NONE_MATCH' not in request.META:
+        return None
+    response = HttpResponse()
+    _patch_headers(response, validators, public)
+    conditional = get_conditional_response(request, etag=validators[0], response=response)
+    return conditional if conditional is not response else None
+
+
+def _finish(request, response, validators, public):
+    if response.status_code != 200:
+        return response
+    _patch_headers(response, validators, public)
+    if validators is None:
+        return response
+    return get_conditional_response(request, etag=validators[0], response=response)
+
+
+def cell_conditional(*endpoints, extra=None):
+    """
+    GET مشروط لـ view يعتمد على بيانات خلية lat/lon في endpoints المذكورة
+    ETag من الخلية ووقت جلب البيانات من المصدر، وmax-age حتى انتهاء صلاحيتها
+    If-None-Match المطابق يحصل على 304 بدون تنفيذ الـ view أو استدعاء المصدر
+    extra(request): قيمة إضافية تدخل في ETag (مثل تاريخ اليوم للتنبؤات)
+    يستخدم على methods الـ views (sync أو async) التي تستقبل request بعد self
+    """
+    def decorator(method):
+        if iscoroutinefunction(method):
+            @wraps(method)
+            async def wrapper(self, request, *args, **kwargs):
+                config = get_conditional_get_config()
+                if not config['ENABLED'] or request.method not in ('GET', 'HEAD'):
+                    return await method(self, request, *args, **kwargs)
+                cache = caches[get_geo_cache_config()['CACHE_ALIAS']]
+                cell, keys = _cell_keys(request, endpoints)
+                validators = _validators(request, cell, keys, await cache.aget_many(keys) if keys else {}, extra)
+                not_modified = _not_modified(request, validators, config['PUBLIC'])
+                if not_modified is not None:
+                    return not_modified
+                response = await method(self, request, *args, **kwargs)
+                validators = _validators(request, cell, keys, await cache.aget_many(keys) if keys else {}, extra)
+                return _finish(request, response, validators, config['PUBLIC'])
+        else:
+            @wraps(method)
+            def wrapper(self, request, *args, **kwargs):
+                config = get_conditional_get_config()
+                if not config['ENABLED'] or request.method not in ('GET', 'HEAD'):
+                    return method(self, request, *args, **kwargs)
+                cache = caches[get_geo_cache_config()['CACHE_ALIAS']]
+                cell, keys = _cell_keys(request, endpoints)
+                validators = _validators(request, cell, keys, cache.get_many(keys) if keys else {}, extra)
+                not_modified = _not_modified(request, validators, config['PUBLIC'])
+                if not_modified is not None:
+                    return not_modified
+                response = method(self, request, *args, **kwargs)
+                validators = _validators(request, cell, keys, cache.get_many(keys) if keys else {}, extra)
+                return _finish(request, response, validators, config['PUBLIC'])
+        return wrapper
+    return decorator
@@ -0,0 +1,262 @@
+import time
+import logging
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+FORECAST_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 3600,              # تعاد التنبؤات كل ساعة حتى تدخل تحديثات المصدر
+    'HORIZON': 7,             # أيام، ويقتطع منها طلب days
+    'HISTORY_DAYS': 14,       # متوسطات يومية من Observation
+    'HISTORY_HALF_LIFE': 3,   # أيام، وزن القراءات الأقدم يتناقص
+    'PERSISTENCE': 0.6,       # وزن القراءة الحالية يتناقص بهذه النسبة كل يوم
+    'TREND_DAMPING': 0.8,
+    'MAX_TREND': 0.5,         # أقصى تغير في المؤشر لكل يوم
+    'UPSTREAM_WEIGHT': 0.7,   # وزن تنبؤ WeatherAPI عند توفره مقابل النموذج الإحصائي
+    'WIND_REFERENCE': 15.0,   # كم/س، الرياح الأقوى تشتت التلوث
+    'WIND_COEF': 0.03,
+    'PRECIP_COEF': 0.08,      # لكل مم مطر، حتى PRECIP_CAP
+    'PRECIP_CAP': 10.0,
+    'DEFAULT_INDEX': 3.0,
+    'ACTIVE_DAYS': 2,         # الخلايا التي لها قراءات خلال هذه المدة تحسب في وضع الدفعات
+    'BATCH_CHUNK': 50000,     # خلايا لكل مهمة في process pool؛ النموذج ~1 ميكروثانية لكل خلية
+}
+
+
+def get_forecast_config():
+    config = dict(FORECAST_DEFAULTS)
+    config.update(getattr(settings, 'FORECAST', {}))
+    return config
+
+
+def utc_today():
+    return datetime.now(tz=timezone.utc).date()
+
+
+def forecast_cache_key(cell, day):
+    return f"forecast:aqi:{cell}:{day.isoformat()}"
+
+
+def predict(history, current, upstream, wind, precip, config):
+    """
+    تنبؤ مؤشر EPA (1-6) لكل الخلايا وكل الأيام دفعة واحدة
+    history (n, H): متوسطات يومية، العمود الأخير هو اليوم، NaN للأيام بلا قراءات
+    current (n,): القراءة الحالية أو NaN
+    upstream, wind, precip (n, D): تنبؤات WeatherAPI اليومية أو NaN، اليوم 0 هو اليوم الحالي
+    """
+    history = np.asarray(history, dtype=float)
+    current = np.asarray(current, dtype=float)
+    n, days_back = history.shape
+    horizon = upstream.shape[1]
+
+    # مستوى واتجاه بالمربعات الصغرى الموزونة، بأوزان تتناقص مع عمر القراءة
+    t = np.arange(days_back, dtype=float) - (days_back - 1)
+    valid = ~np.isnan(history)
+    w = np.where(valid, 0.5 ** (-t / config['HISTORY_HALF_LIFE']), 0.0)
+    x = np.where(valid, history, 0.0)
+    w_sum = w.sum(axis=1)
+    has_history = w_sum > 0
+    safe_sum = np.where(has_history, w_sum, 1.0)
+    mean = (w * x).sum(axis=1) / safe_sum
+    t_mean = (w * t).sum(axis=1) / safe_sum
+    dt = t - t_mean[:, None]
+    var = (w * dt ** 2).sum(axis=1)
+    cov = (w * dt * (x - mean[:, None])).sum(axis=1)
+    slope = np.where(var > 0, cov / np.where(var > 0, var, 1.0), 0.0)
+    slope = np.clip(slope, -config['MAX_TREND'], config['MAX_TREND'])
+    level = np.where(has_history, mean - slope * t_mean, np.nan)
+
+    current = np.where(np.isnan(current), level, current)
+    current = np.where(np.isnan(current), config['DEFAULT_INDEX'], current)
+    level = np.where(np.isnan(level), current, level)
+
+    # القراءة الحالية تستمر في الأيام الأولى ثم يغلب المستوى مع اتجاه متناقص
+    steps = np.arange(horizon, dtype=float)
+    phi = config['TREND_DAMPING']
+    damped = phi * (1 - phi ** steps) / (1 - phi) if phi != 1 else steps
+    persistence = config['PERSISTENCE'] ** steps
+    statistical = (current[:, None] * persistence
+                   + (level[:, None] + slope[:, None] * damped) * (1 - persistence))
+
+    weather = (-config['WIND_COEF'] * (np.nan_to_num(wind, nan=config['WIND_REFERENCE']) - config['WIND_REFERENCE'])
+               - config['PRECIP_COEF'] * np.minimum(np.nan_to_num(precip, nan=0.0), config['PRECIP_CAP']))
+    statistical = statistical + weather
+
+    weight = config['UPSTREAM_WEIGHT']
+    blended = np.where(np.isnan(upstream), statistical, weight * upstream + (1 - weight) * statistical)
+    return np.clip(blended, 1, 6)
+
+
+def to_app_scale(index):
+    """مؤشر EPA (1-6) إلى مقياسنا (1-5) كما في parse_air_quality"""
+    return np.clip(np.rint(index), 1, 5).astype(int)
+
+
+def upstream_daily(forecast_data, today, horizon):
+    """
+    (current, aqi, wind, precip) من رد forecast.json?aqi=yes، مرتبة حسب التاريخ بدءاً من today
+    الأيام غير الموجودة في الرد تبقى NaN
+    """
+    aqi = np.full(horizon, np.nan)
+    wind = np.full(horizon, np.nan)
+    precip = np.full(horizon, np.nan)
+    current = np.nan
+    if not isinstance(forecast_data, dict) or 'error' in forecast_data:
+        return current, aqi, wind, precip
+
+    current_index = (forecast_data.get('current') or {}).get('air_quality', {}).get('us-epa-index')
+    if current_index is not None:
+        current = float(current_index)
+    for forecast_day in forecast_data.get('forecast', {}).get('forecastday', []):
+        try:
+            i = (date.fromisoformat(forecast_day['date']) - today).days
+        except (KeyError, TypeError, ValueError):
+            continue
+        if not 0 <= i < horizon:
+            continue
+        day = forecast_day.get('day') or {}
+        index = (day.get('air_quality') or {}).get('us-epa-index')
+        if index is None:
+            hourly = [hour['air_quality']['us-epa-index'] for hour in forecast_day.get('hour', [])
+                      if 'us-epa-index' in (hour.get('air_quality') or {})]
+            index = np.mean(hourly) if hourly else None
+        if index is not None:
+            aqi[i] = index
+        if day.get('maxwind_kph') is not None:
+            wind[i] = day['maxwind_kph']
+        if day.get('totalprecip_mm') is not None:
+            precip[i] = day['totalprecip_mm']
+    return current, aqi, wind, precip
+
+
+def load_history(cells, today, days):
+    """
+    مصفوفة (len(cells), days) لمتوسط المؤشر اليومي لكل خلية، باستعلام تجميع واحد
+    العمود الأخير هو today
+    """
+    from .models import Observation
+
+    index = {cell: i for i, cell in enumerate(cells)}
+    history = np.full((len(cells), days), np.nan)
+    if not cells:
+        return history
+    start = datetime.combine(today - timedelta(days=days - 1), datetime.min.time(), tzinfo=timezone.utc)
+    end = datetime.combine(today + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    queryset = Observation.objects.filter(observed_at__gte=start, observed_at__lt=end, aqi__isnull=False)
+    if len(cells) == 1:
+        queryset = queryset.filter(cell=cells[0])
+    elif len(cells) <= 1000:
+        queryset = queryset.filter(cell__in=cells)
+    # لعدد كبير من الخلايا يكفي فلتر الوقت وتتجاهل الخلايا غير المطلوبة
+    for row in queryset.downsample('day', by=('cell',)):
+        column = (row['bucket'].date() - today).days + days - 1
+        if row['cell'] in index and 0 <= column < days and row['avg_aqi'] is not None:
+            history[index[row['cell']], column] = row['avg_aqi']
+    return history
+
+
+def forecast_result(cell, today, predicted, inputs):
+    return {
+        'cell': cell,
+        'dates': [(today + timedelta(days=i)).isoformat() for i in range(len(predicted))],
+        'aqi': [int(value) for value in predicted],
+        'inputs': inputs,
+    }
+
+
+def get_cached_forecast(cell, today=None):
+    config = get_forecast_config()
+    return caches[config['CACHE_ALIAS']].get(forecast_cache_key(cell, today or utc_today()))
+
+
+def build_forecast(cell, forecast_data=None, today=None):
+    """
+    التنبؤ لخلية واحدة من رد WeatherAPI وسجل القراءات المخزن
+    النتيجة حتمية لنفس المدخلات وتخزن لكل خلية لكل يوم؛ لا تخزن إذا لم تتوفر أي مدخلات
+    """
+    config = get_forecast_config()
+    today = today or utc_today()
+    horizon = config['HORIZON']
+    current, upstream, wind, precip = upstream_daily(forecast_data, today, horizon)
+    history = load_history([cell], today, config['HISTORY_DAYS'])
+
+    predicted = to_app_scale(predict(history, [current], upstream[None], wind[None], precip[None], config))[0]
+    inputs = []
+    if not np.isnan(current) or not np.isnan(upstream).all():
+        inputs.append('weatherapi')
+    if not np.isnan(history).all():
+        inputs.append('history')
+    result = forecast_result(cell, today, predicted, inputs)
+    if inputs:
+        caches[config['CACHE_ALIAS']].set(forecast_cache_key(cell, today), result, config['TTL'])
+    return result
+
+
+def predict_chunk(history, current, upstream, wind, precip, config):
+    """مهمة process pool: النموذج على مجموعة خلايا، تعيد مؤشرات مقياسنا"""
+    return to_app_scale(predict(history, current, upstream, wind, precip, config))
+
+
+def precompute_forecasts(cells, forecast_data_for, executor=None, today=None, config=None):
+    """
+    حساب وتخزين التنبؤات لعدة خلايا: استعلام سجل واحد، ثم النموذج على دفعات BATCH_CHUNK
+    forecast_data_for(cell) تعيد رد WeatherAPI المتوفر للخلية أو None
+    executor (مثل ProcessPoolExecutor) يوزع الدفعات، وبدونه تحسب في هذه العملية
+    """
+    config = config or get_forecast_config()
+    today = today or utc_today()
+    horizon = config['HORIZON']
+    cells = list(cells)
+    start = time.monotonic()
+
+    history = load_history(cells, today, config['HISTORY_DAYS'])
+    current = np.full(len(cells), np.nan)
+    upstream = np.full((len(cells), horizon), np.nan)
+    wind = np.full_like(upstream, np.nan)
+    precip = np.full_like(upstream, np.nan)
+    for i, cell in enumerate(cells):
+        current[i], upstream[i], wind[i], precip[i] = upstream_daily(forecast_data_for(cell), today, horizon)
+    loaded = time.monotonic()
+
+    chunk = config['BATCH_CHUNK']
+    slices = [slice(i, i + chunk) for i in range(0, len(cells), chunk)]
+    args = [(history[s], current[s], upstream[s], wind[s], precip[s], config) for s in slices]
+    if executor is None:
+        parts = [predict_chunk(*arg) for arg in args]
+    else:
+        parts = list(executor.map(predict_chunk, *zip(*args))) if args else []
+    predicted = np.concatenate(parts) if parts else np.empty((0, horizon), dtype=int)
+    computed = time.monotonic()
+
+    has_upstream = ~np.isnan(current) | ~np.isnan(upstream).all(axis=1)
+    has_history = ~np.isnan(history).all(axis=1)
+    results = {}
+    for i, cell in enumerate(cells):
+        inputs = (['weatherapi'] if has_upstream[i] else []) + (['history'] if has_history[i] else [])
+        if inputs:
+            results[forecast_cache_key(cell, today)] = forecast_result(cell, today, predicted[i], inputs)
+    caches[config['CACHE_ALIAS']].set_many(results, config['TTL'])
+
+    return {
+        'cells': len(cells),
+        'stored': len(results),
+        'load_ms': round((loaded - start) * 1000, 1),
+        'compute_ms': round((computed - loaded) * 1000, 1),
+        'store_ms': round((time.monotonic() - computed) * 1000, 1),
+    }
+
+
+def active_cells(config=None):
+    """الخلايا التي لها قراءات جودة هواء خلال ACTIVE_DAYS الأخيرة"""
+    from .models import Observation
+
+    config = config or get_forecast_config()
+    since = datetime.now(tz=timezone.utc) - timedelta(days=config['ACTIVE_DAYS'])
+    return list(
+        Observation.objects.filter(observed_at__gte=since, aqi__isnull=False)
+        .order_by().values_list('cell', flat=True).distinct()
+    )
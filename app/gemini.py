@@ -0,0 +1,66 @@
+import time
+import threading
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# تحميل مكتبة google.generativeai مؤجل حتى أول استخدام لنصائح الذكاء الاصطناعي
+# حتى لا تدفع أوامر manage.py وبدء تشغيل العمال تكلفة الاستيراد أو الاتصال بالشبكة
+_genai = None
+_available = None
+_load_lock = threading.Lock()
+
+
+def _load():
+    global _genai, _available
+    if not getattr(settings, 'GOOGLE_API_KEY', None):
+        _available = False
+        logger.warning("❌ Google API key not configured")
+        return
+    start = time.monotonic()
+    try:
+        import google.generativeai as genai
+        endpoint = getattr(settings, 'GEMINI_API_ENDPOINT', None)
+        if endpoint:
+            genai.configure(api_key=settings.GOOGLE_API_KEY, transport='rest',
+                            client_options={'api_endpoint': endpoint})
+        else:
+            genai.configure(api_key=settings.GOOGLE_API_KEY)
+    except ImportError:
+        _available = False
+        logger.warning("❌ google-generativeai library not installed")
+        return
+    except Exception as e:
+        _available = False
+        logger.error(f"❌ Error configuring Gemini: {e}")
+        return
+    _genai = genai
+    _available = True
+    logger.info(f"✅ Gemini API configured successfully in {(time.monotonic() - start) * 1000:.0f}ms")
+
+
+def get_genai():
+    """مكتبة genai بعد الإعداد، أو None إذا لم تكن متاحة"""
+    if _available is None:
+        with _load_lock:
+            if _available is None:
+                _load()
+    return _genai
+
+
+def gemini_available():
+    return get_genai() is not None
+
+
+def warm_up():
+    """استيراد المكتبة مسبقاً في thread خلفي حتى لا ينتظرها أول طلب"""
+    def run():
+        try:
+            get_genai()
+        except Exception as e:
+            logger.warning(f"Gemini warm-up failed: {e}")
+
+    thread = threading.Thread(target=run, name='gemini-warm-up', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,86 @@
+import numpy as np
+
+EARTH_RADIUS = 6371000  # نصف قطر الأرض بالأمتار
+
+
+def _radians(*arrays):
+    return [np.radians(np.asarray(a, dtype=np.float64)) for a in arrays]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """المسافة (بالأمتار) بين مصفوفات من النقاط، تدعم broadcasting"""
+    lat1, lon1, lat2, lon2 = _radians(lat1, lon1, lat2, lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bearing(lat1, lon1, lat2, lon2):
+    """الاتجاه الابتدائي (بالدرجات 0-360) من النقطة الأولى إلى الثانية"""
+    lat1, lon1, lat2, lon2 = _radians(lat1, lon1, lat2, lon2)
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(x, y)) + 360) % 360
+
+
+def distances_from(lat, lon, lats, lons):
+    """المسافات من نقطة واحدة إلى مجموعة نقاط (one-to-many)"""
+    return haversine(lat, lon, lats, lons)
+
+
+def distance_matrix(lats1, lons1, lats2, lons2):
+    """مصفوفة المسافات بين مجموعتين من النقاط (many-to-many) بشكل (n, m)"""
+    lats1 = np.asarray(lats1, dtype=np.float64)[:, None]
+    lons1 = np.asarray(lons1, dtype=np.float64)[:, None]
+    lats2 = np.asarray(lats2, dtype=np.float64)[None, :]
+    lons2 = np.asarray(lons2, dtype=np.float64)[None, :]
+    return haversine(lats1, lons1, lats2, lons2)
+
+
+def cumulative_length(lats, lons):
+    """المسافة التراكمية على طول المسار، تبدأ بصفر عند أول نقطة"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.size == 0:
+        return np.zeros(0)
+    segments = haversine(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    return np.concatenate(([0.0], np.cumsum(segments)))
+
+
+def resample_polyline(lats, lons, spacing):
+    """نقاط على المسار كل spacing متر (مع نقطة النهاية)، تعيد (lats, lons, المسافة المقطوعة)"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    travelled = cumulative_length(lats, lons)
+    if travelled.size == 0:
+        return lats, lons, travelled
+    total = travelled[-1]
+    marks = np.arange(0.0, total, spacing) if total > 0 else np.zeros(1)
+    if total > marks[-1]:
+        marks = np.append(marks, total)
+    return np.interp(marks, travelled, lats), np.interp(marks, travelled, lons), marks
+
+
+def point_to_polyline_distance(lats, lons, line_lats, line_lons):
+    """
+    أقصر مسافة (بالأمتار) من كل نقطة إلى المسار
+    إسقاط محلي متساوي المسافات حول المسار، دقيق على مستوى المدينة
+    """
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    line_lats = np.asarray(line_lats, dtype=np.float64)
+    line_lons = np.asarray(line_lons, dtype=np.float64)
+    if line_lats.size == 1:
+        return haversine(lats, lons, line_lats[0], line_lons[0])
+
+    scale_x = np.radians(1) * EARTH_RADIUS * np.cos(np.radians(line_lats.mean()))
+    scale_y = np.radians(1) * EARTH_RADIUS
+    px, py = (lons * scale_x)[:, None], (lats * scale_y)[:, None]
+    ax, ay = (line_lons[:-1] * scale_x)[None, :], (line_lats[:-1] * scale_y)[None, :]
+    bx, by = (line_lons[1:] * scale_x)[None, :], (line_lats[1:] * scale_y)[None, :]
+
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    t = np.where(length_sq > 0, ((px - ax) * dx + (py - ay) * dy) / np.where(length_sq > 0, length_sq, 1), 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy)).min(axis=1)
@@ -0,0 +1,122 @@
+import io
+import time
+import hashlib
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import location_cell
+
+# tiles خريطة الحرارة بنظام z/x/y (Web Mercator) مثل tiles الخرائط العادية
+# كل tile شبكة size×size من درجات السلامة، كل خلية مكانية فيها تطلب مرة واحدة فقط
+
+HEATMAP_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'SIZE': 16,                 # نقاط في كل ضلع من الـ tile
+    'SIZES': (8, 16, 32),
+    'MIN_ZOOM': 8,              # tile بزوم أقل يغطي مئات الكيلومترات ولا معنى لعيناته
+    'MAX_ZOOM': 18,
+    'MAX_UPSTREAM_CALLS': 32,   # خلايا غير مخزنة تجلب لكل tile، والباقي تملؤه الطلبات التالية
+    'DEADLINE': 5,
+    'MIN_TTL': 60,
+    'MAX_TTL': 900,
+    'PARTIAL_TTL': 30,          # tile فيها خلايا بدون بيانات تعاد قريباً لتكتمل
+}
+
+NO_DATA = 255
+
+# لون لكل مستوى سلامة بنفس ترتيب SAFETY_LEVELS (من خطير إلى ممتاز)
+LEVEL_COLORS = (
+    (153, 0, 76),
+    (230, 57, 70),
+    (244, 162, 97),
+    (233, 196, 106),
+    (138, 201, 38),
+    (42, 157, 143),
+)
+
+FORMATS = {
+    'png': 'image/png',
+    'bin': 'application/octet-stream',
+}
+
+
+def get_heatmap_config():
+    config = dict(HEATMAP_DEFAULTS)
+    config.update(getattr(settings, 'HEATMAP', {}))
+    return config
+
+
+def tile_grid(z, x, y, size):
+    """(lats, lons) بشكل (size, size) لمراكز نقاط الـ tile، الصف الأول في الشمال"""
+    n = 2 ** z
+    offsets = (np.arange(size) + 0.5) / size
+    lons = (x + offsets) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    return np.broadcast_to(lats[:, None], (size, size)), np.broadcast_to(lons[None, :], (size, size))
+
+
+def tile_cells(lats, lons):
+    """
+    (cells, points, inverse): الخلايا المكانية المختلفة ونقطة ممثلة لكل منها
+    inverse يعيد قيم الخلايا إلى شكل الشبكة
+    """
+    flat = [location_cell(lat, lon) for lat, lon in zip(lats.ravel().tolist(), lons.ravel().tolist())]
+    cells, first, inverse = np.unique(np.array(flat), return_index=True, return_inverse=True)
+    points = [(float(lats.flat[i]), float(lons.flat[i])) for i in first]
+    return cells.tolist(), points, inverse.reshape(lats.shape)
+
+
+def tile_ttl(expiries, missing, config):
+    """حتى أقرب انتهاء لبيانات الخلايا، وأقصر إذا كانت بعض الخلايا بدون بيانات"""
+    now = time.time()
+    ttl = min((expires_at - now for expires_at in expiries), default=config['MAX_TTL'])
+    ttl = max(config['MIN_TTL'], min(config['MAX_TTL'], int(ttl)))
+    return min(ttl, config['PARTIAL_TTL']) if missing else ttl
+
+
+def tile_cache_key(z, x, y, size):
+    return f"heatmap:{z}:{x}:{y}:{size}"
+
+
+def get_cached_tile(z, x, y, size, config=None):
+    config = config or get_heatmap_config()
+    return caches[config['CACHE_ALIAS']].get(tile_cache_key(z, x, y, size))
+
+
+def cache_tile(z, x, y, size, scores, missing, ttl, config=None):
+    """
+    تخزين درجات الـ tile (uint8، NO_DATA للخلايا بدون بيانات) مستقلة عن صيغة الرد
+    """
+    config = config or get_heatmap_config()
+    body = np.ascontiguousarray(scores, dtype=np.uint8).tobytes()
+    tile = {
+        'scores': body,
+        'size': size,
+        'missing': missing,
+        'etag': hashlib.md5(body, usedforsecurity=False).hexdigest(),
+        'expires_at': time.time() + ttl,
+    }
+    caches[config['CACHE_ALIAS']].set(tile_cache_key(z, x, y, size), tile, ttl)
+    return tile
+
+
+def tile_scores(tile):
+    return np.frombuffer(tile['scores'], dtype=np.uint8).reshape(tile['size'], tile['size'])
+
+
+def encode_png(levels, mask):
+    """PNG بلوحة ألوان (بايت لكل نقطة)، النقاط بدون بيانات شفافة"""
+    indexes = np.where(mask, len(LEVEL_COLORS), levels).astype(np.uint8)
+    # صورة L ثم لوحة الألوان تجعلها P (تمرير mode إلى fromarray مهمل منذ Pillow 11.3)
+    image = Image.fromarray(indexes)
+    image.putpalette([channel for color in LEVEL_COLORS + ((0, 0, 0),) for channel in color])
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True, transparency=len(LEVEL_COLORS))
+    return buffer.getvalue()
+
+
+def valid_tile(z, x, y, config):
+    return config['MIN_ZOOM'] <= z <= config['MAX_ZOOM'] and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
@@ -0,0 +1,235 @@
+import os
+import time
+import asyncio
+import weakref
+import threading
+import logging
+from urllib.parse import urlsplit
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .circuit import (
+    CircuitOpenError, get_breaker, get_circuit_breaker_config, backoff_delay, is_transient, counts_as_failure
+)
+from . import metrics, quota, timing
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_HTTP_DEFAULTS = {
+    'POOL_CONNECTIONS': 10,  # عدد المضيفين الذين نحتفظ لهم بـ pool
+    'POOL_MAXSIZE': 20,      # عدد الاتصالات المفتوحة لكل مضيف
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 10,
+    'SLOW_REQUEST_MS': 2000,
+    'ASYNC_MAX_CONNECTIONS': 200,  # الطلبات المتزامنة لكل event loop في وضع ASGI
+}
+
+# عناوين المصادر قابلة للتغيير (مثلاً لخوادم بديلة محلية في benchmarks/)
+UPSTREAM_BASE_URLS_DEFAULTS = {
+    'weatherapi': 'http://api.weatherapi.com/v1',
+    'tomtom': 'https://api.tomtom.com',
+    'nasa': 'https://cmr.earthdata.nasa.gov',
+}
+
+PROVIDER_HOSTS = {
+    'api.weatherapi.com': 'weatherapi',
+    'api.tomtom.com': 'tomtom',
+    'cmr.earthdata.nasa.gov': 'nasa',
+}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_upstream_http_config():
+    config = dict(UPSTREAM_HTTP_DEFAULTS)
+    config.update(getattr(settings, 'UPSTREAM_HTTP', {}))
+    return config
+
+
+def upstream_url(provider, path):
+    base_urls = dict(UPSTREAM_BASE_URLS_DEFAULTS)
+    base_urls.update({key: value for key, value in getattr(settings, 'UPSTREAM_BASE_URLS', {}).items() if value})
+    return f"{base_urls[provider].rstrip('/')}/{path.lstrip('/')}"
+
+
+def get_session():
+    """جلسة requests مشتركة لكل عملية مع pool اتصالات keep-alive لكل مضيف"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        # جلسة جديدة بعد fork حتى لا تتشارك العمليات نفس المقابس
+        if _session is None or _session_pid != pid:
+            config = get_upstream_http_config()
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=config['POOL_CONNECTIONS'],
+                pool_maxsize=config['POOL_MAXSIZE'],
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+            _session_pid = pid
+    return _session
+
+
+def provider_for_url(url):
+    host = urlsplit(url).hostname or ''
+    return PROVIDER_HOSTS.get(host, host)
+
+
+def _before_call(breaker, provider):
+    try:
+        breaker.before_call()
+    except CircuitOpenError:
+        metrics.inc('upstream_circuit_rejections_total', provider=provider)
+        raise
+
+
+def _log_call(config, provider, elapsed_ms, status_code):
+    metrics.observe('upstream_request_duration_seconds', elapsed_ms / 1000, provider=provider)
+    timing.record(provider, elapsed_ms)
+    metrics.inc('upstream_requests_total', provider=provider, status=status_code or 'error')
+    if elapsed_ms >= config['SLOW_REQUEST_MS']:
+        logger.warning(f"Slow upstream call to {provider}: {elapsed_ms:.0f}ms (status {status_code})")
+    else:
+        logger.debug(f"Upstream call to {provider}: {elapsed_ms:.0f}ms (status {status_code})")
+
+
+def _before_call_with_quota(breaker, provider):
+    """حجز من ميزانية المصدر ثم فحص القاطع؛ الحجز يعاد إذا رفض القاطع الاستدعاء"""
+    taken = quota.acquire(provider)
+    try:
+        _before_call(breaker, provider)
+    except CircuitOpenError:
+        quota.release(provider, taken)
+        raise
+
+
+async def _abefore_call_with_quota(breaker, provider):
+    taken = await quota.aacquire(provider)
+    try:
+        _before_call(breaker, provider)
+    except CircuitOpenError:
+        await quota.arelease(provider, taken)
+        raise
+
+
+def upstream_request(provider, url, params=None, headers=None, auth=None, method='GET', json=None):
+    """
+    نقطة الدخول الموحدة لكل استدعاءات المصادر الخارجية
+    تعيد JSON الرد أو ترفع requests.RequestException
+    ترفع CircuitOpenError فوراً إذا كان قاطع الدائرة للمصدر مفتوحاً
+    وQuotaExceededError إذا استهلكت ميزانية المصدر (كل محاولة تحسب استدعاءً)
+    """
+    config = get_upstream_http_config()
+    breaker_config = get_circuit_breaker_config()
+    breaker = get_breaker(provider)
+    timeout = (config['CONNECT_TIMEOUT'], config['READ_TIMEOUT'])
+    attempt = 0
+    while True:
+        _before_call_with_quota(breaker, provider)
+        start = time.monotonic()
+        status_code = None
+        try:
+            response = get_session().request(
+                method, url, params=params, headers=headers, auth=auth, json=json, timeout=timeout
+            )
+            status_code = response.status_code
+            response.raise_for_status()
+            data = response.json()
+        except requests.RequestException as e:
+            elapsed_ms = (time.monotonic() - start) * 1000
+            _log_call(config, provider, elapsed_ms, status_code)
+            breaker.record(not counts_as_failure(e), elapsed_ms)
+            if attempt >= breaker_config['RETRIES'] or not is_transient(e):
+                raise
+            delay = backoff_delay(attempt, breaker_config)
+            logger.info(f"Retrying {provider} in {delay:.2f}s after: {e}")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except Exception:
+            # أخطاء غير متوقعة أثناء الاستدعاء تحسب فشلاً حتى لا يبقى الاستدعاء التجريبي معلقاً
+            elapsed_ms = (time.monotonic() - start) * 1000
+            _log_call(config, provider, elapsed_ms, status_code)
+            breaker.record(False, elapsed_ms)
+            raise
+        except BaseException:
+            # الإلغاء (CancelledError عند مهلة الطلب) ليس نتيجة من المصدر
+            breaker.release()
+            raise
+        elapsed_ms = (time.monotonic() - start) * 1000
+        _log_call(config, provider, elapsed_ms, status_code)
+        breaker.record(True, elapsed_ms)
+        return data
+
+
+def get_async_client():
+    """عميل httpx غير متزامن مشترك لكل event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        config = get_upstream_http_config()
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config['ASYNC_MAX_CONNECTIONS'],
+                max_keepalive_connections=config['POOL_MAXSIZE'],
+            ),
+            timeout=httpx.Timeout(config['READ_TIMEOUT'], connect=config['CONNECT_TIMEOUT']),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def async_upstream_request(provider, url, params=None, headers=None, auth=None, method='GET', json=None):
+    """
+    النسخة غير المتزامنة من upstream_request
+    تعيد JSON الرد أو ترفع httpx.HTTPError
+    """
+    config = get_upstream_http_config()
+    breaker_config = get_circuit_breaker_config()
+    breaker = get_breaker(provider)
+    attempt = 0
+    while True:
+        await _abefore_call_with_quota(breaker, provider)
+        start = time.monotonic()
+        status_code = None
+        try:
+            response = await get_async_client().request(
+                method, url, params=params, headers=headers, auth=auth, json=json
+            )
+            status_code = response.status_code
+            response.raise_for_status()
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            elapsed_ms = (time.monotonic() - start) * 1000
+            _log_call(config, provider, elapsed_ms, status_code)
+            breaker.record(not counts_as_failure(e), elapsed_ms)
+            if attempt >= breaker_config['RETRIES'] or not is_transient(e):
+                raise
+            delay = backoff_delay(attempt, breaker_config)
+            logger.info(f"Retrying {provider} in {delay:.2f}s after: {e}")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except Exception:
+            # أخطاء غير متوقعة أثناء الاستدعاء تحسب فشلاً حتى لا يبقى الاستدعاء التجريبي معلقاً
+            elapsed_ms = (time.monotonic() - start) * 1000
+            _log_call(config, provider, elapsed_ms, status_code)
+            breaker.record(False, elapsed_ms)
+            raise
+        except BaseException:
+            # الإلغاء (CancelledError عند مهلة الطلب) ليس نتيجة من المصدر
+            breaker.release()
+            raise
+        elapsed_ms = (time.monotonic() - start) * 1000
+        _log_call(config, provider, elapsed_ms, status_code)
+        breaker.record(True, elapsed_ms)
+        return data
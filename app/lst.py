@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import math
+import time
+import threading
+import logging
+from datetime import date, timedelta
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# درجة حرارة سطح الأرض (LST) من MOD11A1، مخزنة محلياً كملف NumPy لكل tile من شبكة MODIS
+# العمال يفتحون الملفات بـ mmap فتتشارك العمليات نفس الصفحات ويكون البحث قراءة واحدة O(1)
+
+LST_TILES_DEFAULTS = {
+    'DIRECTORY': None,       # None = BASE_DIR/data/lst
+    'RELOAD_INTERVAL': 60,   # ثوان بين فحص الملفات الجديدة من أمر الاستيراد
+    'SDS': 'LST_Day_1km',
+}
+
+# شبكة MODIS الجيبية (sinusoidal): 36×18 tile، كل منها 1200×1200 بكسل بدقة ~1 كم
+SPHERE_RADIUS = 6371007.181
+TILE_SIZE = 1111950.5197665  # متر
+TILE_PIXELS = 1200
+PIXEL_SIZE = TILE_SIZE / TILE_PIXELS
+GRID_X_MIN = -20015109.355798
+GRID_Y_MAX = 10007554.677899
+
+LST_SCALE = 0.02  # كلفن لكل وحدة في قيم uint16
+LST_FILL = 0
+
+GRANULE_NAME = re.compile(r'MOD11A1\.A(\d{4})(\d{3})\.h(\d{2})v(\d{2})\.')
+
+_tiles = {}
+_lock = threading.Lock()
+
+
+def get_lst_tiles_config():
+    config = dict(LST_TILES_DEFAULTS)
+    config.update(getattr(settings, 'LST_TILES', {}))
+    if not config['DIRECTORY']:
+        config['DIRECTORY'] = os.path.join(settings.BASE_DIR, 'data', 'lst')
+    return config
+
+
+def tile_name(h, v):
+    return f"h{h:02d}v{v:02d}"
+
+
+def sinusoidal_pixel(lat, lon):
+    """
+    (h, v, row, col) في شبكة MODIS لكل نقطة؛ تقبل أرقاماً أو مصفوفات
+    """
+    lat_rad = np.radians(lat)
+    x = SPHERE_RADIUS * np.radians(lon) * np.cos(lat_rad) - GRID_X_MIN
+    y = GRID_Y_MAX - SPHERE_RADIUS * lat_rad
+    h = np.floor(x / TILE_SIZE).astype(int)
+    v = np.floor(y / TILE_SIZE).astype(int)
+    col = np.clip(np.floor((x - h * TILE_SIZE) / PIXEL_SIZE).astype(int), 0, TILE_PIXELS - 1)
+    row = np.clip(np.floor((y - v * TILE_SIZE) / PIXEL_SIZE).astype(int), 0, TILE_PIXELS - 1)
+    return h, v, row, col
+
+
+def pixel_for(lat, lon):
+    """نفس sinusoidal_pixel لنقطة واحدة بدون تكلفة NumPy للأرقام المفردة"""
+    lat_rad = math.radians(lat)
+    x = SPHERE_RADIUS * math.radians(lon) * math.cos(lat_rad) - GRID_X_MIN
+    y = GRID_Y_MAX - SPHERE_RADIUS * lat_rad
+    h = int(x // TILE_SIZE)
+    v = int(y // TILE_SIZE)
+    col = min(max(int((x - h * TILE_SIZE) // PIXEL_SIZE), 0), TILE_PIXELS - 1)
+    row = min(max(int((y - v * TILE_SIZE) // PIXEL_SIZE), 0), TILE_PIXELS - 1)
+    return h, v, row, col
+
+
+def parse_granule_name(path):
+    """(tile, date) من اسم ملف MOD11A1 مثل MOD11A1.A2024001.h21v06.061.xxx.hdf"""
+    match = GRANULE_NAME.search(os.path.basename(path))
+    if not match:
+        raise ValueError(f"Not a MOD11A1 granule name: {path}")
+    year, day_of_year, h, v = (int(group) for group in match.groups())
+    return tile_name(h, v), date(year, 1, 1) + timedelta(days=day_of_year - 1)
+
+
+def read_granule(path, sds=None):
+    """
+    قيم LST الخام (uint16، 1200×1200) من granule محلي
+    .hdf تحتاج pyhdf؛ .npy هي نفس الـ SDS مستخرجة مسبقاً (مثلاً عبر gdal_translate)
+    """
+    sds = sds or get_lst_tiles_config()['SDS']
+    if str(path).endswith('.npy'):
+        raw = np.load(path)
+    else:
+        try:
+            from pyhdf.SD import SD, SDC
+        except ImportError:
+            raise ImportError("Reading MOD11A1 .hdf granules requires pyhdf (pip install pyhdf)")
+        dataset = SD(str(path), SDC.READ)
+        try:
+            raw = dataset.select(sds).get()
+        finally:
+            dataset.end()
+    raw = np.asarray(raw, dtype=np.uint16)
+    if raw.shape != (TILE_PIXELS, TILE_PIXELS):
+        raise ValueError(f"Unexpected {sds} shape {raw.shape} in {path}")
+    return raw
+
+
+def tile_paths(directory, name):
+    return Path(directory) / f"{name}.npy", Path(directory) / f"{name}.json"
+
+
+def read_tile_meta(directory, name):
+    _, meta_path = tile_paths(directory, name)
+    try:
+        return json.loads(meta_path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_tile(directory, name, raw, meta):
+    """
+    كتابة ذرية: ملف مؤقت ثم os.replace، فالعمال الذين فتحوا الملف القديم بـ mmap يكملون عليه
+    المصفوفة أولاً ثم الـ meta: لا تظهر meta جديدة (تاريخ يمنع إعادة الاستيراد) فوق مصفوفة قديمة
+    """
+    os.makedirs(directory, exist_ok=True)
+    array_path, meta_path = tile_paths(directory, name)
+    tmp_array = array_path.with_suffix('.npy.tmp')
+    tmp_meta = meta_path.with_suffix('.json.tmp')
+    with open(tmp_array, 'wb') as f:
+        np.save(f, np.ascontiguousarray(raw, dtype=np.uint16))
+    tmp_meta.write_text(json.dumps(meta))
+    os.replace(tmp_array, array_path)
+    os.replace(tmp_meta, meta_path)
+
+
+class _Tile:
+    __slots__ = ('array', 'meta', 'mtime', 'checked_at')
+
+    def __init__(self, array, meta, mtime, checked_at):
+        self.array = array
+        self.meta = meta
+        self.mtime = mtime
+        self.checked_at = checked_at
+
+
+def get_tile(name, config=None):
+    """
+    (array, meta) للـ tile مفتوحة بـ mmap للقراءة فقط، أو (None, None) إذا لم تستورد
+    يعاد فتح الملف إذا استبدله أمر الاستيراد (يفحص كل RELOAD_INTERVAL)
+    """
+    config = config or get_lst_tiles_config()
+    now = time.monotonic()
+    tile = _tiles.get(name)
+    if tile is not None and now - tile.checked_at < config['RELOAD_INTERVAL']:
+        return tile.array, tile.meta
+
+    with _lock:
+        tile = _tiles.get(name)
+        if tile is not None and now - tile.checked_at < config['RELOAD_INTERVAL']:
+            return tile.array, tile.meta
+        array_path, meta_path = tile_paths(config['DIRECTORY'], name)
+        try:
+            # الملفان معاً: قارئ بين الاستبدالين يعيد التحميل عند وصول الـ meta الجديدة
+            mtime = (array_path.stat().st_mtime_ns, meta_path.stat().st_mtime_ns)
+        except OSError:
+            mtime = None
+        if tile is not None and tile.mtime == mtime:
+            tile.checked_at = now
+            return tile.array, tile.meta
+
+        array = meta = None
+        if mtime is not None:
+            try:
+                array = np.load(array_path, mmap_mode='r')
+                meta = read_tile_meta(config['DIRECTORY'], name) or {}
+                logger.info(f"Mapped LST tile {name} ({meta.get('date', 'unknown date')})")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not map LST tile {name}: {e}")
+                array = None
+        _tiles[name] = _Tile(array, meta, mtime, now)
+        return array, meta
+
+
+def surface_temperature(lat, lon):
+    """
+    درجة حرارة سطح الأرض نهاراً (°C) عند النقطة من آخر MOD11A1 مستورد، بدون أي استدعاء شبكة
+    None إذا لم تستورد الـ tile أو كان البكسل بلا قيمة (غيوم مثلاً)
+    """
+    h, v, row, col = pixel_for(lat, lon)
+    name = tile_name(h, v)
+    array, meta = get_tile(name)
+    if array is None:
+        return None
+    raw = int(array[row, col])
+    if raw == meta.get('fill', LST_FILL):
+        return None
+    return {
+        'lst_c': round(raw * meta.get('scale', LST_SCALE) - 273.15, 2),
+        'date': meta.get('date'),
+        'tile': name,
+        'source': 'MOD11A1',
+    }
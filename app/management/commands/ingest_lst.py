@@ -0,0 +1,80 @@
+import json
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+
+from app.lst import (
+    LST_FILL,
+    LST_SCALE,
+    get_lst_tiles_config,
+    parse_granule_name,
+    read_granule,
+    read_tile_meta,
+    write_tile,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest downloaded MOD11A1 granules (.hdf, or the LST SDS extracted to .npy) into "
+        "the memory-mapped land surface temperature tile store. The newest granule per tile wins."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='granule files or directories containing them')
+        parser.add_argument('--directory', help='tile store directory (default LST_TILES DIRECTORY)')
+        parser.add_argument('--force', action='store_true', help='replace tiles even with an older granule')
+
+    def handle(self, *args, **options):
+        config = get_lst_tiles_config()
+        directory = options['directory'] or config['DIRECTORY']
+
+        granules = []
+        for path in map(Path, options['paths']):
+            candidates = sorted(path.glob('MOD11A1.*')) if path.is_dir() else [path]
+            for candidate in candidates:
+                if candidate.suffix not in ('.hdf', '.npy'):
+                    continue
+                try:
+                    granules.append((*parse_granule_name(candidate), candidate))
+                except ValueError as e:
+                    self.stderr.write(str(e))
+        if not granules:
+            raise CommandError("No MOD11A1 granules found.")
+
+        # أحدث granule لكل tile فقط
+        latest = {}
+        for tile, day, path in sorted(granules, key=lambda granule: granule[1]):
+            latest[tile] = (day, path)
+
+        written = skipped = failed = 0
+        for tile, (day, path) in sorted(latest.items()):
+            existing = read_tile_meta(directory, tile)
+            if existing and existing.get('date', '') >= day.isoformat() and not options['force']:
+                skipped += 1
+                continue
+            try:
+                raw = read_granule(path, config['SDS'])
+            except (ImportError, OSError, ValueError) as e:
+                # tile واحدة تالفة لا توقف باقي الاستيراد
+                failed += 1
+                self.stderr.write(f"{tile}: {path}: {e}")
+                continue
+            write_tile(directory, tile, raw, {
+                'date': day.isoformat(),
+                'granule': path.name,
+                'sds': config['SDS'],
+                'scale': LST_SCALE,
+                'fill': LST_FILL,
+                'valid_pixels': int((raw != LST_FILL).sum()),
+            })
+            written += 1
+            self.stdout.write(f"{tile}: {day.isoformat()} from {path.name}")
+
+        self.stdout.write(json.dumps({
+            'tiles_written': written,
+            'tiles_skipped': skipped,
+            'tiles_failed': failed,
+            'directory': str(directory),
+        }))
+        if failed and not written:
+            raise CommandError(f"All {failed} granules failed to load.")
@@ -0,0 +1,61 @@
+import os
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+from app.cache import cell_cache_key, get_geo_cache_config, is_shared_cache
+from app.forecast import active_cells, get_forecast_config, precompute_forecasts
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute air quality forecasts for every cell with recent observations "
+        "and store them in the forecast cache (one entry per cell per day)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cells', nargs='*', help='geohash cells (default: all active cells)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='processes for the model; 1 computes in this process')
+        parser.add_argument('--chunk-size', type=int, help='cells per process task (default FORECAST BATCH_CHUNK)')
+
+    def handle(self, *args, **options):
+        config = get_forecast_config()
+        # نتائج الدفعة تكتب من عملية الأمر، فالذاكرة الخاصة بالعملية تضيع عند انتهائه
+        if not is_shared_cache(config['CACHE_ALIAS']):
+            raise CommandError(
+                f"FORECAST CACHE_ALIAS '{config['CACHE_ALIAS']}' is process-local; precomputed forecasts "
+                "would be lost when this command exits. Configure a shared cache (Redis, Memcached, DB)."
+            )
+        geo_alias = get_geo_cache_config()['CACHE_ALIAS']
+        if not is_shared_cache(geo_alias):
+            self.stderr.write(
+                f"GEO_CACHE CACHE_ALIAS '{geo_alias}' is process-local; "
+                "forecasts will use observation history only."
+            )
+        cells = options['cells'] or active_cells(config)
+        if options['chunk_size']:
+            config['BATCH_CHUNK'] = options['chunk_size']
+        if not cells:
+            self.stdout.write("No active cells.")
+            return
+
+        # ردود WeatherAPI الموجودة في ذاكرة الخلايا فقط؛ الدفعة لا تستدعي المصدر
+        geo_cache = caches[geo_alias]
+
+        def forecast_data_for(cell):
+            entry = geo_cache.get(cell_cache_key('forecast', cell))
+            return entry['data'] if entry else None
+
+        workers = options['workers']
+        chunks = -(-len(cells) // config['BATCH_CHUNK'])
+        if workers <= 1 or chunks == 1:
+            stats = precompute_forecasts(cells, forecast_data_for, config=config)
+        else:
+            # spawn: العمليات الفرعية لا ترث اتصال قاعدة البيانات المفتوح
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(workers, chunks), mp_context=context) as executor:
+                stats = precompute_forecasts(cells, forecast_data_for, executor=executor, config=config)
+        self.stdout.write(json.dumps(stats))
@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: بدون قفل ملفات تبقى لقطات العمليات المنتهية كما هي
+    fcntl = None
+import httpx
+import requests
+from django.conf import settings
+
+from .circuit import CircuitOpenError, QuotaExceededError
+
+logger = logging.getLogger(__name__)
+
+METRICS_DEFAULTS = {
+    'MULTIPROC_DIR': None,   # مجلد مشترك بين العمال، كل عملية تكتب ملفاً باسم pid
+    'FLUSH_INTERVAL': 5,
+    'TOKEN': None,           # إن وجد يجب إرساله في Authorization: Bearer
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+}
+
+HELP = {
+    'http_requests_total': ('counter', 'API requests by view, method and status'),
+    'http_request_duration_seconds': ('histogram', 'API request latency by view'),
+    'http_requests_in_flight': ('gauge', 'API requests currently being handled'),
+    'upstream_requests_total': ('counter', 'Upstream calls by provider and status'),
+    'upstream_request_duration_seconds': ('histogram', 'Upstream call latency by provider'),
+    'upstream_circuit_rejections_total': ('counter', 'Upstream calls skipped because the circuit breaker was open'),
+    'upstream_quota_rejections_total': ('counter', 'Upstream calls skipped because the API key budget was exhausted'),
+    'fallback_responses_total': ('counter', 'Responses served from fallback data by source and cause'),
+    'geo_cache_lookups_total': ('counter', 'Geo cell cache lookups by result'),
+    'observations_written_total': ('counter', 'Observation rows sent to the database'),
+    'observations_failed_total': ('counter', 'Observation rows lost because a batch write failed'),
+    'observations_dropped_total': ('counter', 'Observations dropped because the write queue was full'),
+    'observations_flush_seconds': ('histogram', 'Observation batch write latency'),
+}
+
+
+def get_metrics_config():
+    config = dict(METRICS_DEFAULTS)
+    config.update(getattr(settings, 'METRICS', {}))
+    return config
+
+
+# counters وgauges: {(name, labels): value}، histograms: {(name, labels): [counts..., sum, count]}
+_counters = {}
+_gauges = {}
+_histograms = {}
+_lock = threading.Lock()
+_buckets = None
+_flusher_pid = None
+
+
+def _key(name, labels):
+    # قيم الـ labels نصوص دائماً، فلا تختلط أنواع (200 و'error') عند ترتيب السلاسل
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _ensure_flusher()
+
+
+def gauge_add(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    global _buckets
+    if _buckets is None:
+        _buckets = tuple(get_metrics_config()['BUCKETS'])
+    key = _key(name, labels)
+    index = bisect.bisect_left(_buckets, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(_buckets) + 3)
+        histogram[index] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+    _ensure_flusher()
+
+
+@contextmanager
+def in_flight(name, **labels):
+    gauge_add(name, 1, **labels)
+    try:
+        yield
+    finally:
+        gauge_add(name, -1, **labels)
+
+
+def fallback_cause(error):
+    """تصنيف سبب الرجوع للبيانات الافتراضية من الاستثناء"""
+    if isinstance(error, QuotaExceededError):
+        return 'quota_exhausted'
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(error, (requests.Timeout, httpx.TimeoutException)):
+        return 'timeout'
+    if isinstance(error, (requests.RequestException, httpx.HTTPError)):
+        return 'http_error'
+    return 'error'
+
+
+def record_fallback(source, cause):
+    inc('fallback_responses_total', source=source, cause=cause)
+
+
+def _snapshot():
+    with _lock:
+        return {
+            'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+            'gauges': [[name, labels, value] for (name, labels), value in _gauges.items()],
+            'histograms': [[name, labels, list(values)] for (name, labels), values in _histograms.items()],
+        }
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f"metrics_{pid}.json")
+
+
+def flush():
+    """كتابة عدادات هذه العملية إلى ملفها في MULTIPROC_DIR (استبدال ذري)"""
+    directory = get_metrics_config()['MULTIPROC_DIR']
+    if not directory:
+        return
+    path = _snapshot_path(directory, os.getpid())
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(_snapshot(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics snapshot: {e}")
+
+
+def _ensure_flusher():
+    """thread خلفي لكل عملية يكتب اللقطة دورياً، حتى يبقى المسار الساخن مجرد زيادة عداد"""
+    global _flusher_pid
+    pid = os.getpid()
+    if _flusher_pid == pid:
+        return
+    config = get_metrics_config()
+    with _lock:
+        if _flusher_pid == pid:
+            return
+        _flusher_pid = pid
+    if not config['MULTIPROC_DIR']:
+        return
+    os.makedirs(config['MULTIPROC_DIR'], exist_ok=True)
+
+    def run():
+        while True:
+            time.sleep(config['FLUSH_INTERVAL'])
+            flush()
+
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(target, snapshot):
+    """إضافة counters وhistograms لقطة إلى أخرى (الـ gauges لا تجمع من العمليات المنتهية)"""
+    counters = {_key(name, dict(labels)): value for name, labels, value in target['counters']}
+    histograms = {_key(name, dict(labels)): values for name, labels, values in target['histograms']}
+    for name, labels, value in snapshot['counters']:
+        key = _key(name, dict(labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in snapshot['histograms']:
+        key = _key(name, dict(labels))
+        merged = histograms.get(key)
+        histograms[key] = values if merged is None else [a + b for a, b in zip(merged, values)]
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'gauges': [],
+        'histograms': [[name, labels, values] for (name, labels), values in histograms.items()],
+    }
+
+
+@contextmanager
+def _directory_lock(directory):
+    with open(os.path.join(directory, 'metrics.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _collect():
+    """
+    دمج لقطات كل العمال؛ العدادات تجمع دائماً والـ gauges من العمليات الحية فقط
+    لقطات العمليات المنتهية تدمج في metrics_archive.json ثم تحذف، فلا يتراكم ملف لكل pid
+    ولا تنقص العدادات بعد إعادة تشغيل العمال
+    """
+    directory = get_metrics_config()['MULTIPROC_DIR']
+    if not directory:
+        return [_snapshot()]
+    flush()
+    if fcntl is None:
+        return _read_snapshots(directory, prune=False)
+    try:
+        with _directory_lock(directory):
+            return _read_snapshots(directory, prune=True)
+    except OSError as e:
+        logger.warning(f"Could not lock metrics directory: {e}")
+        return _read_snapshots(directory, prune=False)
+
+
+def _read_snapshots(directory, prune):
+    archive_path = os.path.join(directory, 'metrics_archive.json')
+    archive = _read_snapshot(archive_path)
+    snapshots, dead = [], []
+    for filename in os.listdir(directory):
+        if not (filename.startswith('metrics_') and filename.endswith('.json')):
+            continue
+        try:
+            pid = int(filename[len('metrics_'):-len('.json')])
+        except ValueError:
+            continue
+        path = os.path.join(directory, filename)
+        snapshot = _read_snapshot(path)
+        if snapshot is None:
+            continue
+        if _pid_alive(pid):
+            snapshots.append(snapshot)
+        elif prune:
+            dead.append((path, snapshot))
+        else:
+            snapshot['gauges'] = []
+            snapshots.append(snapshot)
+
+    if dead:
+        merged = archive or {'counters': [], 'gauges': [], 'histograms': []}
+        for _, snapshot in dead:
+            merged = _merge(merged, snapshot)
+        tmp_path = f"{archive_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(merged, f)
+            os.replace(tmp_path, archive_path)
+        except OSError as e:
+            logger.warning(f"Could not archive metrics of exited workers: {e}")
+            snapshots.extend({**snapshot, 'gauges': []} for _, snapshot in dead)
+        else:
+            archive = merged
+            for path, _ in dead:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    if archive is not None:
+        snapshots.append(archive)
+    return snapshots
+
+
+def _escape(value):
+    """الصيغة النصية تتطلب escape لـ \\ و" وسطر جديد في قيم الـ labels"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(labels) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render():
+    """كل المقاييس بصيغة Prometheus النصية"""
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in _collect():
+        for name, labels, value in snapshot['counters']:
+            key = _key(name, dict(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot['gauges']:
+            key = _key(name, dict(labels))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = _key(name, dict(labels))
+            merged = histograms.get(key)
+            histograms[key] = values if merged is None else [a + b for a, b in zip(merged, values)]
+
+    config = get_metrics_config()
+    buckets = tuple(config['BUCKETS'])
+    lines = []
+    if not config['MULTIPROC_DIR']:
+        lines.append(f"# Metrics of worker pid {os.getpid()} only; set METRICS_DIR to aggregate all workers")
+    for series in (counters, gauges, histograms):
+        for name in sorted({name for name, _ in series}):
+            kind, description = HELP.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (series_name, labels), value in sorted(series.items()):
+                if series_name != name:
+                    continue
+                if series is not histograms:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-2]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,142 @@
+import json
+import time
+import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics, timing
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_DEFAULTS = {
+    'HEADER': True,
+    'SLOW_REQUEST_MS': 1000,
+}
+
+
+def get_server_timing_config():
+    config = dict(SERVER_TIMING_DEFAULTS)
+    config.update(getattr(settings, 'SERVER_TIMING', {}))
+    return config
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise يدعم الوضع المتزامن فقط، مما يجبر Django على تشغيل كل طلب ASGI في thread
+    هذه النسخة تعمل في الوضعين: الملفات الثابتة تُخدم في thread والباقي يمر مباشرة
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, **kwargs):
+        super().__init__(get_response, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
+
+
+class MetricsMiddleware:
+    """زمن الاستجابة وعدد الطلبات الجارية لكل view، في الوضعين المتزامن وغير المتزامن"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.monotonic()
+        with metrics.in_flight('http_requests_in_flight'):
+            response = self.get_response(request)
+        self.record(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.monotonic()
+        with metrics.in_flight('http_requests_in_flight'):
+            response = await self.get_response(request)
+        self.record(request, response, start)
+        return response
+
+    def record(self, request, response, start):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match is not None else 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.monotonic() - start, view=view)
+        metrics.inc('http_requests_total', view=view, method=request.method, status=response.status_code)
+
+
+class ServerTimingMiddleware:
+    """
+    يجمع أزمنة المراحل المسماة (app.timing) لكل طلب ويرسلها في ترويسة Server-Timing
+    الطلبات الأبطأ من SLOW_REQUEST_MS تسجل في سطر JSON واحد
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_server_timing_config()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        phases, token = timing.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.end_request(token)
+        return self.finish(request, response, phases)
+
+    async def __acall__(self, request):
+        phases, token = timing.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.end_request(token)
+        return self.finish(request, response, phases)
+
+    def process_template_response(self, request, response):
+        # ردود DRF تُحول إلى JSON بعد الـ view مباشرة، فنقيس ذلك كمرحلة render
+        phases = timing.current()
+        if phases is not None:
+            start = time.monotonic()
+            response.add_post_render_callback(lambda r: phases.add('render', (time.monotonic() - start) * 1000))
+        return response
+
+    def finish(self, request, response, phases):
+        total_ms = phases.elapsed_ms()
+        if self.config['HEADER']:
+            response['Server-Timing'] = timing.server_timing_header(phases, total_ms)
+        if total_ms >= self.config['SLOW_REQUEST_MS']:
+            match = request.resolver_match
+            logger.warning("Slow request " + json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': (match.url_name or match.view_name) if match is not None else None,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 1),
+                'phases': {name: {'ms': round(ms, 1), 'count': count} for name, (ms, count) in phases.items()},
+            }))
+        return response
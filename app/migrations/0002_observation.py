@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-16 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Observation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.CharField(max_length=12)),
+                ('observed_at', models.DateTimeField()),
+                ('source', models.CharField(max_length=16)),
+                ('aqi', models.PositiveSmallIntegerField(null=True)),
+                ('pm2_5', models.FloatField(null=True)),
+                ('pm10', models.FloatField(null=True)),
+                ('o3', models.FloatField(null=True)),
+                ('no2', models.FloatField(null=True)),
+                ('so2', models.FloatField(null=True)),
+                ('co', models.FloatField(null=True)),
+                ('temp_c', models.FloatField(null=True)),
+                ('humidity', models.PositiveSmallIntegerField(null=True)),
+                ('wind_kph', models.FloatField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cell', 'observed_at'], name='app_observa_cell_944858_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='observation',
+            constraint=models.UniqueConstraint(fields=('cell', 'source', 'observed_at'), name='unique_cell_observation'),
+        ),
+    ]
@@ -1,5 +1,97 @@
 from django.db import models
+from django.db.models import Avg, Count, Max
+from django.db.models.functions import Trunc
 from django.contrib.auth.models import User
 
 
 # Create your models here.
+class SafeLocation(models.Model):
+    """أماكن آمنة حقيقية (حدائق، عيادات، ملاجئ) لخدمة أقرب موقع آمن"""
+    CATEGORY_CHOICES = [
+        ('park', 'Park'),
+        ('clinic', 'Clinic'),
+        ('shelter', 'Shelter'),
+    ]
+
+    name = models.CharField(max_length=200)
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    city = models.CharField(max_length=100, blank=True)
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.category})"
+
+
+class ObservationQuerySet(models.QuerySet):
+    def for_cell(self, cell):
+        return self.filter(cell=cell)
+
+    def between(self, start, end):
+        """القراءات في المدى [start, end) مرتبة زمنياً، تستخدم فهرس (cell, observed_at)"""
+        return self.filter(observed_at__gte=start, observed_at__lt=end).order_by('observed_at')
+
+    def downsample(self, interval='hour', by=()):
+        """
+        متوسط القراءات لكل فترة (minute, hour, day, week, month) كـ avg_<field> مع عدد القراءات
+        التجميع يتم في قاعدة البيانات، والقيم الفارغة لا تدخل في المتوسط
+        by: حقول تجميع إضافية، مثل ('cell',) لعدة خلايا في استعلام واحد
+        """
+        return (
+            self.annotate(bucket=Trunc('observed_at', interval))
+            .values(*by, 'bucket')
+            .annotate(
+                samples=Count('id'),
+                avg_aqi=Avg('aqi'),
+                max_aqi=Max('aqi'),
+                avg_pm2_5=Avg('pm2_5'),
+                avg_pm10=Avg('pm10'),
+                avg_o3=Avg('o3'),
+                avg_no2=Avg('no2'),
+                avg_temp_c=Avg('temp_c'),
+                avg_humidity=Avg('humidity'),
+                avg_wind_kph=Avg('wind_kph'),
+            )
+            .order_by(*by, 'bucket')
+        )
+
+
+class Observation(models.Model):
+    """
+    قراءة واحدة للطقس وجودة الهواء لخلية geohash كما أعادها المصدر
+    تكتب على دفعات من app/observations.py، والحقول غير المتوفرة تبقى فارغة
+    """
+    cell = models.CharField(max_length=12)
+    observed_at = models.DateTimeField()
+    source = models.CharField(max_length=16)  # endpoint المصدر: current أو current_aqi
+    aqi = models.PositiveSmallIntegerField(null=True)  # us-epa-index (1-6)
+    pm2_5 = models.FloatField(null=True)
+    pm10 = models.FloatField(null=True)
+    o3 = models.FloatField(null=True)
+    no2 = models.FloatField(null=True)
+    so2 = models.FloatField(null=True)
+    co = models.FloatField(null=True)
+    temp_c = models.FloatField(null=True)
+    humidity = models.PositiveSmallIntegerField(null=True)
+    wind_kph = models.FloatField(null=True)
+
+    objects = ObservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cell', 'observed_at']),
+        ]
+        constraints = [
+            # WeatherAPI يحدث القراءة كل 15 دقيقة، فإعادة جلب نفس القراءة لا تكررها
+            models.UniqueConstraint(fields=['cell', 'source', 'observed_at'], name='unique_cell_observation'),
+        ]
+
+    def __str__(self):
+        return f"{self.cell} @ {self.observed_at:%Y-%m-%d %H:%M} ({self.source})"
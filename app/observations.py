@@ -0,0 +1,167 @@
+import os
+import time
+import atexit
+import threading
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import metrics
+from .cache import location_cell
+
+logger = logging.getLogger(__name__)
+
+OBSERVATIONS_DEFAULTS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 500,       # صفوف لكل bulk_create
+    'FLUSH_INTERVAL': 5,     # ثوان بين عمليات الكتابة
+    'MAX_PENDING': 10000,    # عند الامتلاء تحذف أقدم القراءات بدلاً من حجز الطلب
+}
+
+# قراءات لم تكتب بعد في هذه العملية؛ مسار الطلب يضيف إليها فقط ولا يلمس قاعدة البيانات
+_pending = deque()
+_lock = threading.Lock()
+_wake = threading.Event()
+_writer_pid = None
+_stats = {'queued': 0, 'written': 0, 'dropped': 0, 'failed': 0}
+
+
+def get_observations_config():
+    config = dict(OBSERVATIONS_DEFAULTS)
+    config.update(getattr(settings, 'OBSERVATIONS', {}))
+    return config
+
+
+def _observed_at(current):
+    epoch = current.get('last_updated_epoch')
+    if epoch:
+        return datetime.fromtimestamp(epoch, tz=timezone.utc)
+    return datetime.now(tz=timezone.utc).replace(second=0, microsecond=0)
+
+
+def observation_from_weather_api(cell, source, data):
+    """تحويل رد WeatherAPI (current.json) إلى Observation غير محفوظة"""
+    from .models import Observation
+
+    current = data.get('current') or {}
+    air_quality = current.get('air_quality') or {}
+    return Observation(
+        cell=cell,
+        observed_at=_observed_at(current),
+        source=source,
+        aqi=air_quality.get('us-epa-index'),
+        pm2_5=air_quality.get('pm2_5'),
+        pm10=air_quality.get('pm10'),
+        o3=air_quality.get('o3'),
+        no2=air_quality.get('no2'),
+        so2=air_quality.get('so2'),
+        co=air_quality.get('co'),
+        temp_c=current.get('temp_c'),
+        humidity=current.get('humidity'),
+        wind_kph=current.get('wind_kph'),
+    )
+
+
+def record_observation(lat, lon, source, data):
+    """
+    إضافة قراءة جديدة من المصدر إلى طابور الكتابة (بدون انتظار قاعدة البيانات)
+    تستدعى من on_store في cached_fetch، أي مرة واحدة لكل جلب فعلي للخلية
+    """
+    config = get_observations_config()
+    if not config['ENABLED'] or not isinstance(data, dict) or 'current' not in data:
+        return
+    try:
+        observation = observation_from_weather_api(location_cell(lat, lon), source, data)
+    except (TypeError, ValueError, OverflowError) as e:
+        logger.debug(f"Skipping malformed observation: {e}")
+        return
+
+    with _lock:
+        if len(_pending) >= config['MAX_PENDING']:
+            _pending.popleft()
+            _stats['dropped'] += 1
+            metrics.inc('observations_dropped_total')
+        _pending.append(observation)
+        _stats['queued'] += 1
+        full = len(_pending) >= config['BATCH_SIZE']
+    _ensure_writer(config)
+    if full:
+        _wake.set()
+
+
+def flush():
+    """كتابة كل القراءات المعلقة على دفعات، تعيد عدد الصفوف المرسلة"""
+    from .models import Observation
+
+    with _lock:
+        batch = list(_pending)
+        _pending.clear()
+    if not batch:
+        return 0
+
+    batch_size = get_observations_config()['BATCH_SIZE']
+    start = time.monotonic()
+    close_old_connections()
+    try:
+        # القراءة المكررة (نفس الخلية والمصدر والوقت) تتجاهل بدلاً من إفشال الدفعة
+        Observation.objects.bulk_create(batch, batch_size=batch_size, ignore_conflicts=True)
+    except Exception as e:
+        logger.error(f"Could not write {len(batch)} observations: {e}")
+        with _lock:
+            _stats['failed'] += len(batch)
+        metrics.inc('observations_failed_total', len(batch))
+        close_old_connections()
+        return 0
+
+    with _lock:
+        _stats['written'] += len(batch)
+    metrics.inc('observations_written_total', len(batch))
+    metrics.observe('observations_flush_seconds', time.monotonic() - start)
+    return len(batch)
+
+
+def _ensure_writer(config):
+    """thread كتابة واحد لكل عملية، يستيقظ كل FLUSH_INTERVAL أو عند امتلاء دفعة"""
+    global _writer_pid
+    pid = os.getpid()
+    if _writer_pid == pid:
+        return
+    with _lock:
+        if _writer_pid == pid:
+            return
+        _writer_pid = pid
+
+    def run():
+        while True:
+            _wake.wait(config['FLUSH_INTERVAL'])
+            _wake.clear()
+            try:
+                flush()
+            except Exception as e:
+                logger.error(f"Observation writer failed: {e}")
+
+    threading.Thread(target=run, name='observation-writer', daemon=True).start()
+    atexit.register(flush)
+
+
+def get_observation_stats():
+    with _lock:
+        return {**_stats, 'pending': len(_pending)}
+
+
+def cell_history(lat, lon, start, end, interval=None):
+    """
+    قراءات الخلية في المدى [start, end)
+    مع interval (hour, day, ...) تعاد المتوسطات لكل فترة بدلاً من القراءات الخام
+    """
+    from .models import Observation
+
+    queryset = Observation.objects.for_cell(location_cell(lat, lon)).between(start, end)
+    if interval:
+        return list(queryset.downsample(interval))
+    return list(queryset.values(
+        'observed_at', 'source', 'aqi', 'pm2_5', 'pm10', 'o3', 'no2', 'so2', 'co',
+        'temp_c', 'humidity', 'wind_kph',
+    ))
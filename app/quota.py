@@ -0,0 +1,229 @@
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+
+from .circuit import QuotaExceededError
+from . import cache as geo_cache, metrics
+
+logger = logging.getLogger(__name__)
+
+# ميزانية الاستدعاءات لكل مفتاح API مشتركة بين العمال عبر الذاكرة المؤقتة
+# كل نافذة عداد يزاد ذرياً (add/incr)، ونافذة الدقيقة منزلقة تقديرياً مع وزن الدقيقة السابقة
+
+UPSTREAM_QUOTA_DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'LIMITS': {},  # provider -> {'PER_MINUTE': n, 'PER_DAY': n}، القيمة 0 أو None = بلا حد
+    # نسبة من كل حد محجوزة للأولويات الأعلى: الخلفية لا تستهلك آخر 20% والدفعات آخر 50%
+    'RESERVE': {'interactive': 0.0, 'background': 0.2, 'batch': 0.5},
+    # عدد العمال عندما تكون الذاكرة خاصة بكل عملية (LocMem): كل عامل يأخذ حصته من كل حد
+    'LOCAL_WORKERS': 1,
+}
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+BATCH = 'batch'
+
+WINDOWS = (
+    ('minute', 60, 'PER_MINUTE'),
+    ('day', 86400, 'PER_DAY'),
+)
+
+_priority = ContextVar('upstream_priority', default=INTERACTIVE)
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_upstream_quota_config():
+    config = dict(UPSTREAM_QUOTA_DEFAULTS)
+    config.update(getattr(settings, 'UPSTREAM_QUOTA', {}))
+    return config
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def priority(level):
+    """كل استدعاءات المصادر داخل الكتلة تحسب بهذه الأولوية"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def with_priority(level, fn):
+    """fn بأولوية ثابتة، لتمريرها إلى executor حيث لا ينتقل السياق"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with priority(level):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def worker_share(config):
+    """نسبة الحد المتاحة لهذه العملية: كامل الحد مع ذاكرة مشتركة، وإلا حصة عامل واحد"""
+    if geo_cache.is_shared_cache(config['CACHE_ALIAS']):
+        return 1.0
+    return 1.0 / max(1, config['LOCAL_WORKERS'])
+
+
+def _windows(provider, limits, now):
+    """(name, key, previous_key, previous_weight, timeout, limit) للنوافذ المحدودة فقط"""
+    for name, seconds, limit_name in WINDOWS:
+        limit = limits.get(limit_name)
+        if not limit:
+            continue
+        index = int(now // seconds)
+        # الدقيقة السابقة تحسب بقدر ما بقي منها داخل آخر 60 ثانية، واليوم يبدأ من الصفر
+        weight = 1 - (now % seconds) / seconds if name == 'minute' else 0.0
+        yield (name, f"quota:{provider}:{name}:{index}", f"quota:{provider}:{name}:{index - 1}",
+               weight, seconds * 2, limit)
+
+
+def _count(provider, counter):
+    with _stats_lock:
+        stats = _stats.setdefault(provider, {'allowed': 0, 'rejected': 0})
+        stats[counter] += 1
+
+
+def _plan(provider, level):
+    """(cache, windows, allowed_fraction) أو None إذا لم يكن للمصدر حد"""
+    config = get_upstream_quota_config()
+    limits = config['LIMITS'].get(provider)
+    if not config['ENABLED'] or not limits:
+        return None
+    windows = list(_windows(provider, limits, time.time()))
+    if not windows:
+        return None
+    allowed = (1 - config['RESERVE'].get(level, 0.0)) * worker_share(config)
+    return caches[config['CACHE_ALIAS']], windows, allowed
+
+
+def _over(windows, counts, previous, allowed):
+    """اسم أول نافذة تجاوزت الحد بعد الزيادة، أو None"""
+    for (name, _, previous_key, weight, _, limit), count in zip(windows, counts):
+        if count + weight * previous.get(previous_key, 0) > limit * allowed:
+            return name
+    return None
+
+
+def _reject(provider, level, window):
+    _count(provider, 'rejected')
+    metrics.inc('upstream_quota_rejections_total', provider=provider, priority=level, window=window)
+    logger.debug(f"Upstream quota for {provider} exhausted ({window}), skipping {level} call")
+    return QuotaExceededError(f"Upstream quota for {provider} exhausted ({window}, {level})")
+
+
+def _take(cache, key, timeout):
+    if cache.add(key, 1, timeout):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # انتهت صلاحية العداد بين add وincr
+        cache.set(key, 1, timeout)
+        return 1
+
+
+async def _atake(cache, key, timeout):
+    if await cache.aadd(key, 1, timeout):
+        return 1
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        await cache.aset(key, 1, timeout)
+        return 1
+
+
+def acquire(provider, level=None):
+    """
+    حجز استدعاء واحد من ميزانية المصدر قبل إرساله
+    تعيد المفاتيح المحجوزة (لإرجاعها بـ release إذا لم يرسل الاستدعاء)
+    ترفع QuotaExceededError فوراً إذا كان الاستدعاء سيتجاوز الحد لهذه الأولوية
+    """
+    level = level or current_priority()
+    plan = _plan(provider, level)
+    if plan is None:
+        return []
+    cache, windows, allowed = plan
+    previous = cache.get_many([window[2] for window in windows if window[3]])
+    # الزيادة أولاً ثم الفحص، فلا يتجاوز عاملان الحد معاً
+    counts = [_take(cache, key, timeout) for _, key, _, _, timeout, _ in windows]
+    keys = [window[1] for window in windows]
+    window = _over(windows, counts, previous, allowed)
+    if window is not None:
+        release(provider, keys)
+        raise _reject(provider, level, window)
+    _count(provider, 'allowed')
+    return keys
+
+
+async def aacquire(provider, level=None):
+    """النسخة غير المتزامنة من acquire"""
+    level = level or current_priority()
+    plan = _plan(provider, level)
+    if plan is None:
+        return []
+    cache, windows, allowed = plan
+    previous = await cache.aget_many([window[2] for window in windows if window[3]])
+    counts = [await _atake(cache, key, timeout) for _, key, _, _, timeout, _ in windows]
+    keys = [window[1] for window in windows]
+    window = _over(windows, counts, previous, allowed)
+    if window is not None:
+        await arelease(provider, keys)
+        raise _reject(provider, level, window)
+    _count(provider, 'allowed')
+    return keys
+
+
+def release(provider, keys):
+    """إرجاع حجز لم يستخدم (مثلاً رفضه قاطع الدائرة)"""
+    if not keys:
+        return
+    cache = caches[get_upstream_quota_config()['CACHE_ALIAS']]
+    for key in keys:
+        try:
+            cache.decr(key)
+        except ValueError:
+            pass
+
+
+async def arelease(provider, keys):
+    if not keys:
+        return
+    cache = caches[get_upstream_quota_config()['CACHE_ALIAS']]
+    for key in keys:
+        try:
+            await cache.adecr(key)
+        except ValueError:
+            pass
+
+
+def get_quota_stats():
+    """الاستهلاك الحالي لكل مصدر محدود (مشترك بين العمال) وعدادات هذه العملية"""
+    config = get_upstream_quota_config()
+    cache = caches[config['CACHE_ALIAS']]
+    share = worker_share(config)
+    now = time.time()
+    with _stats_lock:
+        local = {provider: dict(stats) for provider, stats in _stats.items()}
+    stats = {}
+    for provider, limits in config['LIMITS'].items():
+        windows = list(_windows(provider, limits or {}, now))
+        if not windows:
+            continue
+        values = cache.get_many([key for window in windows for key in window[1:3]])
+        provider_stats = local.get(provider, {'allowed': 0, 'rejected': 0})
+        for name, key, previous_key, weight, _, limit in windows:
+            used = values.get(key, 0) + weight * values.get(previous_key, 0)
+            provider_stats[name] = {'used': round(used), 'limit': int(limit * share)}
+        stats[provider] = provider_stats
+    return stats
@@ -0,0 +1,162 @@
+import os
+import time
+import threading
+import logging
+from collections import deque
+
+from .concurrency import get_executor
+
+logger = logging.getLogger(__name__)
+
+# شعبية الخلايا في هذه العملية: key -> _Tracked
+# الذاكرة المؤقتة الافتراضية LocMem خاصة بكل عملية، لذلك يعمل المجدول داخل كل عامل
+_tracked = {}
+_pending = set()
+_refreshes = deque()
+_lock = threading.Lock()
+_thread_pid = None
+
+
+class _Tracked:
+    __slots__ = ('hits', 'expires_at', 'refresh')
+
+    def __init__(self, expires_at, refresh):
+        self.hits = 0.0
+        self.expires_at = expires_at
+        self.refresh = refresh
+
+
+def _config():
+    from .cache import get_geo_cache_config
+    return get_geo_cache_config()
+
+
+def track(key, expires_at, refresh):
+    """
+    تسجيل طلب لخلية مع طريقة إعادة جلبها
+    refresh دالة بدون معاملات تعيد expires_at الجديد أو None إذا فشلت
+    """
+    with _lock:
+        tracked = _tracked.get(key)
+        if tracked is None:
+            tracked = _tracked[key] = _Tracked(expires_at, refresh)
+        tracked.hits += 1
+        tracked.refresh = refresh
+        if expires_at is not None:
+            tracked.expires_at = expires_at
+    _ensure_started()
+
+
+def _take_budget(config):
+    """حد أقصى لعدد إعادات الجلب في الدقيقة (نافذة منزلقة)"""
+    now = time.monotonic()
+    with _lock:
+        while _refreshes and now - _refreshes[0] >= 60:
+            _refreshes.popleft()
+        if len(_refreshes) >= config['REFRESH_BUDGET_PER_MINUTE']:
+            return False
+        _refreshes.append(now)
+        return True
+
+
+def _run_refresh(key, refresh):
+    try:
+        expires_at = refresh()
+    except Exception as e:
+        logger.warning(f"Background refresh failed for {key}: {e}")
+        expires_at = None
+    with _lock:
+        _pending.discard(key)
+        tracked = _tracked.get(key)
+        if tracked is not None and expires_at is not None:
+            tracked.expires_at = expires_at
+
+
+def refresh_soon(key, refresh):
+    """إعادة جلب خلية انتهت صلاحيتها في الخلفية، بينما يُخدم الطلب الحالي بالقيمة القديمة"""
+    config = _config()
+    with _lock:
+        if key in _pending:
+            return False
+    if not _take_budget(config):
+        return False
+    with _lock:
+        if key in _pending:
+            return False
+        _pending.add(key)
+    get_executor().submit(_run_refresh, key, refresh)
+    return True
+
+
+def run_cycle(config=None):
+    """
+    دورة واحدة: إعادة جلب الخلايا الأكثر طلباً التي تقترب صلاحيتها من الانتهاء
+    تعيد عدد الخلايا التي أعيد جلبها
+    """
+    config = config or _config()
+    now = time.time()
+    decay = 0.5 ** (config['REFRESH_INTERVAL'] / config['REFRESH_HALF_LIFE'])
+    with _lock:
+        for key in list(_tracked):
+            tracked = _tracked[key]
+            tracked.hits *= decay
+            # خلايا لم تعد تطلب وانتهت فترة السماح للقيمة القديمة
+            if tracked.hits < 0.1 and (tracked.expires_at or 0) + config['STALE_TTL'] < now:
+                del _tracked[key]
+        candidates = sorted(
+            (
+                (tracked.hits, key, tracked.refresh) for key, tracked in _tracked.items()
+                if tracked.hits >= config['REFRESH_MIN_HITS'] and key not in _pending
+                and tracked.expires_at is not None and tracked.expires_at - now <= config['REFRESH_AHEAD']
+            ),
+            key=lambda candidate: candidate[0],
+            reverse=True,
+        )
+
+    refreshed = 0
+    for _, key, refresh in candidates:
+        if not _take_budget(config):
+            logger.info(f"Refresh budget exhausted, {len(candidates) - refreshed} popular cells left to expire")
+            break
+        with _lock:
+            _pending.add(key)
+        _run_refresh(key, refresh)
+        refreshed += 1
+    return refreshed
+
+
+def _ensure_started():
+    global _thread_pid
+    pid = os.getpid()
+    if _thread_pid == pid:
+        return
+    with _lock:
+        if _thread_pid == pid:
+            return
+        _thread_pid = pid
+    config = _config()
+    if not config['REFRESH_ENABLED']:
+        return
+
+    def loop():
+        while True:
+            time.sleep(config['REFRESH_INTERVAL'])
+            try:
+                run_cycle(config)
+            except Exception as e:
+                logger.error(f"Cell refresher cycle failed: {e}")
+
+    threading.Thread(target=loop, name='cell-refresher', daemon=True).start()
+    logger.info(f"Cell refresher started (every {config['REFRESH_INTERVAL']}s, "
+                f"{config['REFRESH_BUDGET_PER_MINUTE']} refreshes/min)")
+
+
+def get_refresher_stats():
+    min_hits = _config()['REFRESH_MIN_HITS']
+    now = time.monotonic()
+    with _lock:
+        return {
+            'tracked_cells': len(_tracked),
+            'popular_cells': sum(1 for tracked in _tracked.values() if tracked.hits >= min_hits),
+            'refreshes_last_minute': sum(1 for at in _refreshes if now - at < 60),
+        }
@@ -0,0 +1,82 @@
+import orjson
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+_drf_encoder = JSONEncoder()
+
+
+def _default(obj):
+    """الأنواع التي لا يعرفها orjson (Decimal, lazy strings, ...) تحول كما في DRF"""
+    return _drf_encoder.default(obj)
+
+
+def dumps(data):
+    """JSON بترميز UTF-8 بدون escape للأحرف العربية، مثل UNICODE_JSON في DRF"""
+    return orjson.dumps(data, default=_default, option=ORJSON_OPTIONS)
+
+
+def parse_fields(value):
+    """
+    ?fields=date,day.maxtemp_c -> {'date': None, 'day': {'maxtemp_c': None}}
+    None في الشجرة تعني الحقل كاملاً، والقيمة None تعني عدم التحديد (كل الحقول)
+    """
+    if not value:
+        return None
+    tree = {}
+    for path in value.split(','):
+        parts = [part for part in path.strip().split('.') if part]
+        node = tree
+        for depth, part in enumerate(parts):
+            if depth == len(parts) - 1:
+                node[part] = None
+            elif node.get(part, {}) is None:
+                break  # الحقل الأب مطلوب كاملاً
+            else:
+                node = node.setdefault(part, {})
+    return tree or None
+
+
+def select_fields(data, tree):
+    """الحقول المطلوبة فقط؛ القوائم تطبق الشجرة على كل عنصر"""
+    if tree is None:
+        return data
+    if isinstance(data, dict):
+        return {key: select_fields(data[key], subtree) for key, subtree in tree.items() if key in data}
+    if isinstance(data, (list, tuple)):
+        return [select_fields(item, tree) for item in data]
+    return data
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer عبر orjson، مع ?fields= لاختيار جزء من حقول الرد في كل endpoint
+    ردود الأخطاء (4xx/5xx) ترسل كاملة
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        request = renderer_context.get('request')
+        response = renderer_context.get('response')
+        if request is not None and (response is None or response.status_code < 400):
+            data = select_fields(data, parse_fields(request.query_params.get('fields')))
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class FixedContentNegotiation(BaseContentNegotiation):
+    """
+    بدون تفاوض على Accept، لـ views ترد بـ HttpResponse بصيغة ثابتة (مثل صور الـ tiles)
+    رسائل الخطأ عبر Response تستخدم أول renderer (JSON)
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import SafeLocation
+from .spatial import location_changed, location_deleted
+
+
+@receiver(post_save, sender=SafeLocation)
+def safe_location_saved(sender, instance, **kwargs):
+    location_changed(instance)
+
+
+@receiver(post_delete, sender=SafeLocation)
+def safe_location_deleted(sender, instance, **kwargs):
+    location_deleted(instance.id)
@@ -0,0 +1,202 @@
+import math
+import time
+import threading
+import logging
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from . import geo
+from .cache import is_shared_cache
+
+logger = logging.getLogger(__name__)
+
+SAFE_LOCATIONS_DEFAULTS = {
+    'BUCKET_DEGREES': 0.01,  # حجم خلية الشبكة ≈ 1.1 كم
+    'K': 5,
+    'MAX_RADIUS': 10000,     # أقصى نطاق بحث بالأمتار
+    'CACHE_ALIAS': 'default',  # رقم إصدار الفهرس المشترك بين العمال
+    'RELOAD_INTERVAL': 300,  # إعادة تحميل دورية فقط إذا كانت CACHE_ALIAS خاصة بكل عملية (LocMem)
+}
+
+VERSION_KEY = 'safe_locations:version'
+METERS_PER_DEGREE = 111195
+
+
+def get_safe_locations_config():
+    config = dict(SAFE_LOCATIONS_DEFAULTS)
+    config.update(getattr(settings, 'SAFE_LOCATIONS', {}))
+    return config
+
+
+class GridIndex:
+    """فهرس مكاني بشبكة buckets ثابتة الحجم يدعم الإضافة والحذف التزايدي"""
+
+    def __init__(self, bucket_degrees):
+        self.bucket_degrees = bucket_degrees
+        self.buckets = {}
+        self.items = {}
+        self.lock = threading.RLock()
+
+    def _bucket(self, lat, lon):
+        return (math.floor(lat / self.bucket_degrees), math.floor(lon / self.bucket_degrees))
+
+    def __len__(self):
+        return len(self.items)
+
+    def upsert(self, item_id, lat, lon, data):
+        with self.lock:
+            self.remove(item_id)
+            self.items[item_id] = (lat, lon, data)
+            self.buckets.setdefault(self._bucket(lat, lon), set()).add(item_id)
+
+    def remove(self, item_id):
+        with self.lock:
+            existing = self.items.pop(item_id, None)
+            if existing is None:
+                return
+            key = self._bucket(existing[0], existing[1])
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(item_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def _ring(self, center, ring):
+        row, col = center
+        if ring == 0:
+            return [center]
+        cells = []
+        for d in range(-ring, ring + 1):
+            cells.extend([(row - ring, col + d), (row + ring, col + d)])
+        for d in range(-ring + 1, ring):
+            cells.extend([(row + d, col - ring), (row + d, col + ring)])
+        return cells
+
+    def _candidates(self, lat, lon, keys):
+        ids = [item_id for key in keys for item_id in self.buckets.get(key, ())]
+        if not ids:
+            return [], np.zeros(0)
+        coords = np.array([self.items[item_id][:2] for item_id in ids], dtype=np.float64)
+        return ids, geo.distances_from(lat, lon, coords[:, 0], coords[:, 1])
+
+    def _result(self, ids, distances, order):
+        return [
+            {'id': ids[i], 'lat': self.items[ids[i]][0], 'lon': self.items[ids[i]][1],
+             'distance': float(distances[i]), **self.items[ids[i]][2]}
+            for i in order
+        ]
+
+    def nearest(self, lat, lon, k, max_radius):
+        """أقرب k عناصر ضمن max_radius متر"""
+        with self.lock:
+            if not self.items:
+                return []
+            # أصغر عرض للخلية بالأمتار داخل نطاق البحث (خط الطول ينكمش مع خط العرض)
+            lat_extent = max_radius / METERS_PER_DEGREE
+            cos_lat = max(math.cos(math.radians(min(abs(lat) + lat_extent, 89.9))), 0.01)
+            cell_meters = self.bucket_degrees * METERS_PER_DEGREE * cos_lat
+            max_ring = int(max_radius / cell_meters) + 1
+
+            center = self._bucket(lat, lon)
+            ids = []
+            distances = np.zeros(0)
+            for ring in range(max_ring + 1):
+                ring_ids, ring_distances = self._candidates(lat, lon, self._ring(center, ring))
+                ids.extend(ring_ids)
+                distances = np.concatenate((distances, ring_distances))
+                # كل العناصر ضمن ring * cell_meters أصبحت ضمن المرشحين
+                if np.count_nonzero(distances <= min(ring * cell_meters, max_radius)) >= k:
+                    break
+            if not ids:
+                return []
+            within = np.flatnonzero(distances <= max_radius)
+            order = within[np.argsort(distances[within], kind='stable')][:k]
+            return self._result(ids, distances, order)
+
+
+_index = None
+_index_version = None
+_index_loaded_at = None
+_index_lock = threading.Lock()
+
+
+def _version_cache():
+    return caches[get_safe_locations_config()['CACHE_ALIAS']]
+
+
+def _current_version():
+    return _version_cache().get(VERSION_KEY, 0)
+
+
+def _index_expired(config):
+    """
+    مع ذاكرة خاصة بكل عملية لا يصل رقم الإصدار من العمال الآخرين
+    فيعاد تحميل الفهرس كل RELOAD_INTERVAL حتى تظهر تعديلات الإدارة في كل العمال
+    """
+    if is_shared_cache(config['CACHE_ALIAS']):
+        return False
+    return time.monotonic() - _index_loaded_at >= config['RELOAD_INTERVAL']
+
+
+def _location_data(location):
+    return {'name': location.name, 'category': location.category}
+
+
+def _load_index(version):
+    global _index, _index_version, _index_loaded_at
+    from .models import SafeLocation
+
+    index = GridIndex(get_safe_locations_config()['BUCKET_DEGREES'])
+    rows = SafeLocation.objects.filter(is_active=True).values_list('id', 'name', 'category', 'latitude', 'longitude')
+    for location_id, name, category, lat, lon in rows.iterator():
+        index.upsert(location_id, lat, lon, {'name': name, 'category': category})
+    _index = index
+    _index_version = version
+    _index_loaded_at = time.monotonic()
+    logger.info(f"Safe location index loaded with {len(index)} locations (version {version})")
+
+
+def get_safe_location_index():
+    """الفهرس المحلي للعملية، يعاد تحميله إذا غيرت عملية أخرى البيانات"""
+    config = get_safe_locations_config()
+    version = _current_version()
+    if _index is None or _index_version != version or _index_expired(config):
+        with _index_lock:
+            if _index is None or _index_version != version or _index_expired(config):
+                _load_index(version)
+    return _index
+
+
+def _bump_version():
+    cache = _version_cache()
+    cache.add(VERSION_KEY, 0, None)
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        return None
+
+
+def location_changed(location):
+    """تحديث تزايدي للفهرس عند حفظ موقع، وإبلاغ العمليات الأخرى عبر رقم الإصدار"""
+    global _index_version
+    in_sync = _index is not None and _index_version == _current_version()
+    if _index is not None:
+        if location.is_active:
+            _index.upsert(location.id, location.latitude, location.longitude, _location_data(location))
+        else:
+            _index.remove(location.id)
+    version = _bump_version()
+    if in_sync:
+        _index_version = version
+
+
+def location_deleted(location_id):
+    """حذف تزايدي من الفهرس عند حذف موقع"""
+    global _index_version
+    in_sync = _index is not None and _index_version == _current_version()
+    if _index is not None:
+        _index.remove(location_id)
+    version = _bump_version()
+    if in_sync:
+        _index_version = version
@@ -1,3 +1,1297 @@
-from django.test import TestCase
+import os
+import json
+import time
+import threading
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from . import cache as geo_cache
+
+# بدون مجدول إعادة الجلب في الخلفية حتى لا تستدعى دوال الاختبار من thread آخر
+NO_REFRESH = {'REFRESH_ENABLED': False, 'LOCK_TIMEOUT': 2}
+
+# سجل الملاحظات يكتب من thread خلفي لا يرى قاعدة بيانات الاختبار
+TEST_SETTINGS = {'GEO_CACHE': NO_REFRESH, 'OBSERVATIONS': {'ENABLED': False}, 'WEATHER_API_KEY': 'test'}
+
+WEATHER = {'current': {'last_updated_epoch': None, 'temp_c': 25, 'air_quality': {'us-epa-index': 2}}}
+
+
+@override_settings(**TEST_SETTINGS)
+class CachedFetchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_second_lookup_in_same_cell_is_a_hit(self):
+        fetch = mock.Mock(return_value=WEATHER)
+        self.assertEqual(geo_cache.cached_fetch('current', 30.0444, 31.2357, fetch), WEATHER)
+        self.assertEqual(geo_cache.cached_fetch('current', 30.0445, 31.2358, fetch), WEATHER)
+        fetch.assert_called_once()
+
+    def test_errors_are_not_cached(self):
+        fetch = mock.Mock(return_value={'error': 'boom'})
+        geo_cache.cached_fetch('current', 30.0, 31.0, fetch)
+        geo_cache.cached_fetch('current', 30.0, 31.0, fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_concurrent_misses_share_one_upstream_call(self):
+        started = threading.Event()
+
+        def slow_fetch():
+            started.set()
+            time.sleep(0.2)
+            return WEATHER
+
+        fetch = mock.Mock(side_effect=slow_fetch)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(geo_cache.cached_fetch('current', 30.0, 31.0, fetch)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        fetch.assert_called_once()
+        self.assertEqual(results, [WEATHER] * 5)
+
+    def test_waiter_stops_when_other_process_releases_lock_without_entry(self):
+        key = geo_cache.cell_cache_key('current', geo_cache.location_cell(30.0, 31.0))
+        cache.add(f"{key}:lock", 1, 2)
+        # العملية الأخرى فشلت: تحرر القفل بدون تخزين قيمة
+        threading.Timer(0.1, cache.delete, args=(f"{key}:lock",)).start()
+        fetch = mock.Mock(return_value=WEATHER)
+        start = time.monotonic()
+        self.assertEqual(geo_cache.cached_fetch('current', 30.0, 31.0, fetch), WEATHER)
+        self.assertLess(time.monotonic() - start, 1)
+        fetch.assert_called_once()
+
+    def test_waiter_uses_entry_stored_by_other_process(self):
+        key = geo_cache.cell_cache_key('current', geo_cache.location_cell(30.0, 31.0))
+        cache.add(f"{key}:lock", 1, 2)
+
+        def other_process():
+            cache.set(key, {'data': WEATHER, 'fetched_at': time.time(), 'expires_at': time.time() + 60}, 60)
+            cache.delete(f"{key}:lock")
+
+        threading.Timer(0.1, other_process).start()
+        fetch = mock.Mock()
+        self.assertEqual(geo_cache.cached_fetch('current', 30.0, 31.0, fetch), WEATHER)
+        fetch.assert_not_called()
+
+
+@override_settings(**TEST_SETTINGS)
+class BatchSafetyScoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def lines(self, coordinates):
+        from .views import stream_batch_safety_scores
+        return [json.loads(line) for line in stream_batch_safety_scores(coordinates)]
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    def test_one_lookup_per_cell_and_one_line_per_point(self, upstream):
+        coordinates = [(30.0444, 31.2357), (30.0445, 31.2358), (30.5, 31.5)]
+        lines = self.lines(coordinates)
+        self.assertEqual(sorted(line['index'] for line in lines), [0, 1, 2])
+        self.assertEqual(upstream.call_count, 2)
+        self.assertTrue(all(line['air_quality_index'] == 2 and not line['estimated'] for line in lines))
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    def test_cached_cells_are_answered_without_the_pool(self, upstream):
+        self.lines([(30.0444, 31.2357)])
+        with mock.patch('app.views.get_executor') as get_executor:
+            lines = self.lines([(30.0444, 31.2357)])
+        get_executor.return_value.submit.assert_not_called()
+        self.assertFalse(lines[0]['estimated'])
+        upstream.assert_called_once()
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    def test_cells_over_the_upstream_budget_are_estimated(self, upstream):
+        with override_settings(BATCH_SCORING={'MAX_POINTS': 1000, 'MAX_UPSTREAM_CALLS': 1, 'DEADLINE': 5}):
+            lines = self.lines([(30.0, 31.0), (31.0, 32.0)])
+        self.assertEqual(sum(line['estimated'] for line in lines), 1)
+        upstream.assert_called_once()
+
+    def test_pending_lookups_are_cancelled_after_the_deadline(self):
+        release = threading.Event()
+        calls = []
+
+        def blocked_upstream(*args, **kwargs):
+            calls.append(args)
+            release.wait(5)
+            return WEATHER
+
+        coordinates = [(30.0 + i * 0.1, 31.0) for i in range(30)]
+        config = {'MAX_POINTS': 1000, 'MAX_UPSTREAM_CALLS': 100, 'DEADLINE': 0.2}
+        with mock.patch('app.views.upstream_request', side_effect=blocked_upstream), \
+                override_settings(BATCH_SCORING=config):
+            lines = self.lines(coordinates)
+            release.set()
+            time.sleep(0.2)
+        self.assertEqual(len(lines), 30)
+        self.assertTrue(all(line['estimated'] for line in lines))
+        # فقط الاستدعاءات التي بدأت قبل المهلة، والباقي ألغي ولم يشغل المجمع
+        self.assertLessEqual(len(calls), 8)
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    def test_endpoint_streams_ndjson(self, upstream):
+        response = self.client.post('/api/batch/safety-score/', {'points': [[30.0, 31.0], {'lat': 30.1, 'lon': 31.1}]},
+                                    content_type='application/json', HTTP_X_FORWARDED_PROTO='https')
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(lines), 2)
+
+
+class CircuitBreakerTests(TestCase):
+    CONFIG = {
+        'WINDOW': 4, 'MIN_CALLS': 4, 'ERROR_RATE': 0.5, 'SLOW_CALL_MS': 1000, 'SLOW_RATE': 0.8,
+        'OPEN_SECONDS': 30, 'HALF_OPEN_CALLS': 1, 'RETRIES': 2, 'BACKOFF_BASE': 0, 'BACKOFF_MAX': 0,
+    }
+
+    def breaker(self):
+        from .circuit import CircuitBreaker
+        return CircuitBreaker('test', self.CONFIG)
+
+    def test_opens_on_error_rate_and_rejects(self):
+        from .circuit import CircuitOpenError, OPEN
+        breaker = self.breaker()
+        for ok in (True, False, True, False):
+            breaker.before_call()
+            breaker.record(ok, 10)
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_opens_on_slow_rate(self):
+        from .circuit import OPEN
+        breaker = self.breaker()
+        for _ in range(4):
+            breaker.record(True, 2000)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_half_open_allows_one_probe_then_closes(self):
+        from .circuit import CircuitOpenError, CLOSED, HALF_OPEN
+        breaker = self.breaker()
+        for _ in range(4):
+            breaker.record(False, 10)
+        breaker.opened_at -= self.CONFIG['OPEN_SECONDS']
+        breaker.before_call()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record(True, 10)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_failed_probe_reopens(self):
+        from .circuit import OPEN
+        breaker = self.breaker()
+        for _ in range(4):
+            breaker.record(False, 10)
+        breaker.opened_at -= self.CONFIG['OPEN_SECONDS']
+        breaker.before_call()
+        breaker.record(False, 10)
+        self.assertEqual(breaker.state, OPEN)
+
+
+@override_settings(**TEST_SETTINGS, CIRCUIT_BREAKER=CircuitBreakerTests.CONFIG, UPSTREAM_QUOTA={'ENABLED': False})
+class UpstreamRequestTests(TestCase):
+    def setUp(self):
+        from . import circuit
+        cache.clear()
+        circuit._breakers.clear()
+
+    def response(self, status_code, data=None):
+        import requests
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = data or {}
+        response.raise_for_status.side_effect = (
+            requests.HTTPError(response=response) if status_code >= 400 else None
+        )
+        return response
+
+    def test_retries_transient_errors(self):
+        from .http_client import upstream_request
+        session = mock.Mock()
+        session.request.side_effect = [self.response(503), self.response(200, {'ok': True})]
+        with mock.patch('app.http_client.get_session', return_value=session):
+            self.assertEqual(upstream_request('test', 'http://upstream.test/'), {'ok': True})
+        self.assertEqual(session.request.call_count, 2)
+
+    def test_client_errors_are_not_retried(self):
+        import requests
+        from .http_client import upstream_request
+        session = mock.Mock()
+        session.request.return_value = self.response(404)
+        with mock.patch('app.http_client.get_session', return_value=session):
+            with self.assertRaises(requests.HTTPError):
+                upstream_request('test', 'http://upstream.test/')
+        session.request.assert_called_once()
+
+    def test_open_circuit_falls_back_without_calling_upstream(self):
+        from .views import safe_request
+        session = mock.Mock()
+        session.request.side_effect = lambda *args, **kwargs: self.response(500)
+        with mock.patch('app.http_client.get_session', return_value=session):
+            for _ in range(2):
+                safe_request('http://upstream.test/', provider='test')
+            calls = session.request.call_count
+            result = safe_request('http://upstream.test/', provider='test')
+        self.assertEqual(result['cause'], 'circuit_open')
+        self.assertEqual(session.request.call_count, calls)
+
+    def half_open_breaker(self):
+        from .circuit import get_breaker, OPEN
+        breaker = get_breaker('test')
+        breaker.state = OPEN
+        breaker.opened_at = time.monotonic() - breaker.config['OPEN_SECONDS']
+        return breaker
+
+    def test_cancelled_half_open_probe_frees_the_slot(self):
+        import asyncio
+        from .circuit import HALF_OPEN
+        from .http_client import async_upstream_request
+        breaker = self.half_open_breaker()
+
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(5)
+
+        async def probe():
+            with mock.patch('app.http_client.get_async_client') as get_client:
+                get_client.return_value.request.side_effect = hang
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(async_upstream_request('test', 'http://upstream.test/'), 0.05)
+
+        asyncio.run(probe())
+        self.assertEqual((breaker.state, breaker.half_open_inflight), (HALF_OPEN, 0))
+        breaker.before_call()
+
+    def test_unexpected_error_in_half_open_probe_reopens(self):
+        from .circuit import OPEN
+        from .http_client import upstream_request
+        breaker = self.half_open_breaker()
+        session = mock.Mock()
+        session.request.side_effect = AttributeError('boom')
+        with mock.patch('app.http_client.get_session', return_value=session):
+            with self.assertRaises(AttributeError):
+                upstream_request('test', 'http://upstream.test/')
+        self.assertEqual((breaker.state, breaker.half_open_inflight), (OPEN, 0))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_label_values_are_escaped(self):
+        from . import metrics
+        with override_settings(METRICS={'MULTIPROC_DIR': self.directory.name}):
+            metrics.inc('fallback_responses_total', source='te"st\\x', cause='line\nbreak')
+            output = metrics.render()
+        self.assertIn('source="te\\"st\\\\x"', output)
+        self.assertIn('cause="line\\nbreak"', output)
+
+    def test_counters_from_other_workers_are_summed(self):
+        from . import metrics
+        snapshot = {'counters': [['upstream_requests_total', [['provider', 'other'], ['status', 200]], 5]],
+                    'gauges': [['http_requests_in_flight', [['view', 'x']], 3]], 'histograms': []}
+        with open(os.path.join(self.directory.name, 'metrics_999999.json'), 'w') as f:
+            json.dump(snapshot, f)
+        with override_settings(METRICS={'MULTIPROC_DIR': self.directory.name}), \
+                mock.patch('app.metrics._pid_alive', side_effect=lambda pid: pid != 999999):
+            output = metrics.render()
+            self.assertIn('upstream_requests_total{provider="other",status="200"} 5', output)
+            # gauges من عمليات انتهت لا تحسب
+            self.assertNotIn('http_requests_in_flight{view="x"}', output)
+
+            # لقطة العملية المنتهية تدمج في الأرشيف مرة واحدة ويحذف ملفها
+            files = os.listdir(self.directory.name)
+            self.assertNotIn('metrics_999999.json', files)
+            self.assertIn('metrics_archive.json', files)
+            self.assertIn('upstream_requests_total{provider="other",status="200"} 5', metrics.render())
+
+            # عامل آخر ينتهي بنفس العداد: يضاف إلى الأرشيف ولا ينقص المجموع
+            snapshot['counters'][0][2] = 2
+            with open(os.path.join(self.directory.name, 'metrics_999998.json'), 'w') as f:
+                json.dump(snapshot, f)
+            with mock.patch('app.metrics._pid_alive', side_effect=lambda pid: pid < 999998):
+                output = metrics.render()
+            self.assertIn('upstream_requests_total{provider="other",status="200"} 7', output)
+            self.assertEqual(sorted(name for name in os.listdir(self.directory.name) if 'metrics_99' in name), [])
+
+    def test_gauges_from_live_workers_are_summed(self):
+        from . import metrics
+        snapshot = {'counters': [], 'gauges': [['http_requests_in_flight', [['view', 'live']], 3]], 'histograms': []}
+        with open(os.path.join(self.directory.name, 'metrics_999997.json'), 'w') as f:
+            json.dump(snapshot, f)
+        with override_settings(METRICS={'MULTIPROC_DIR': self.directory.name}), \
+                mock.patch('app.metrics._pid_alive', return_value=True):
+            output = metrics.render()
+        self.assertIn('http_requests_in_flight{view="live"} 3', output)
+        self.assertIn('metrics_999997.json', os.listdir(self.directory.name))
+
+    def test_observation_metrics_are_typed(self):
+        from . import metrics
+        with override_settings(METRICS={'MULTIPROC_DIR': ''}):
+            metrics.inc('observations_written_total', 3)
+            metrics.observe('observations_flush_seconds', 0.02)
+            output = metrics.render()
+        self.assertIn('# TYPE observations_written_total counter', output)
+        self.assertIn('# TYPE observations_flush_seconds histogram', output)
+        self.assertNotIn('untyped', output)
+
+    def test_int_and_str_label_values_render_together(self):
+        from . import metrics
+        with override_settings(METRICS={'MULTIPROC_DIR': ''}):
+            metrics.inc('upstream_requests_total', provider='sorting', status=200)
+            metrics.inc('upstream_requests_total', provider='sorting', status='error')
+            output = metrics.render()
+        self.assertIn('upstream_requests_total{provider="sorting",status="200"}', output)
+        self.assertIn('upstream_requests_total{provider="sorting",status="error"}', output)
+
+    def test_single_worker_output_says_so(self):
+        from . import metrics
+        with override_settings(METRICS={'MULTIPROC_DIR': ''}):
+            self.assertIn(f"worker pid {os.getpid()} only", metrics.render())
+
+
+@override_settings(**TEST_SETTINGS)
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def store_expired(self, data):
+        key = geo_cache.cell_cache_key('current', geo_cache.location_cell(30.0, 31.0))
+        now = time.time()
+        cache.set(key, {'data': data, 'fetched_at': now - 100, 'expires_at': now - 10}, 300)
+        return key
+
+    def test_expired_entry_is_served_and_refreshed_in_background(self):
+        key = self.store_expired({'current': {'temp_c': 1}})
+        fresh = {'current': {'temp_c': 2}}
+        fetch = mock.Mock(return_value=fresh)
+        with mock.patch('app.refresher.get_executor') as get_executor:
+            get_executor.return_value.submit.side_effect = lambda fn, *args: fn(*args)
+            self.assertEqual(geo_cache.cached_fetch('current', 30.0, 31.0, fetch), {'current': {'temp_c': 1}})
+        fetch.assert_called_once()
+        self.assertEqual(cache.get(key)['data'], fresh)
+
+    def test_failed_refresh_keeps_serving_stale_entry(self):
+        key = self.store_expired({'current': {'temp_c': 1}})
+        fetch = mock.Mock(return_value={'error': 'down'})
+        with mock.patch('app.refresher.get_executor') as get_executor:
+            get_executor.return_value.submit.side_effect = lambda fn, *args: fn(*args)
+            geo_cache.cached_fetch('current', 30.0, 31.0, fetch)
+        self.assertEqual(cache.get(key)['data'], {'current': {'temp_c': 1}})
+
+    def test_second_worker_skips_cell_refreshed_by_the_first(self):
+        from . import refresher
+        key = geo_cache.cell_cache_key('current', geo_cache.location_cell(30.0, 31.0))
+        now = time.time()
+        cache.set(key, {'data': WEATHER, 'fetched_at': now - 870, 'expires_at': now + 30}, 600)
+        config = geo_cache.get_geo_cache_config()
+        fetches = []
+        # كل عامل يتتبع الخلية في عمليته ويعيدها في نفس الدورة، والذاكرة المؤقتة مشتركة
+        for worker in ('a', 'b'):
+            fetch = mock.Mock(return_value=WEATHER)
+            fetches.append(fetch)
+            refresher._tracked.clear()
+            for _ in range(5):
+                refresher.track(key, now + 30, lambda fetch=fetch: geo_cache._refresh(
+                    cache, key, fetch, geo_cache.weather_api_ttl, config['LOCK_TIMEOUT']))
+            refresher.run_cycle(config)
+        refresher._tracked.clear()
+        self.assertEqual([fetch.call_count for fetch in fetches], [1, 0])
+        self.assertGreater(cache.get(key)['expires_at'], now + 60)
+
+    def test_popular_cells_are_refreshed_before_expiry(self):
+        from . import refresher
+        refresh = mock.Mock(return_value=time.time() + 900)
+        refresher._tracked.clear()
+        for _ in range(5):
+            refresher.track('geo:current:test', time.time() + 10, refresh)
+        self.assertEqual(refresher.run_cycle(geo_cache.get_geo_cache_config()), 1)
+        refresh.assert_called_once()
+        refresher._tracked.clear()
+
+
+class ForecastModelTests(TestCase):
+    def setUp(self):
+        from . import forecast
+        self.forecast = forecast
+        self.config = forecast.get_forecast_config()
+
+    def run_model(self, history, current, upstream):
+        import numpy as np
+        upstream = np.asarray(upstream, dtype=float)
+        return self.forecast.predict(history, current, upstream, np.full(upstream.shape, np.nan),
+                                     np.full(upstream.shape, np.nan), self.config)
+
+    def test_predictions_are_deterministic_and_in_range(self):
+        import numpy as np
+        history = [[1, 2, 3, 4, 5, 6, 6], [6, 6, 6, 6, 6, 6, 6]]
+        upstream = [[np.nan] * 7, [6] * 7]
+        first = self.run_model(history, [6, 6], upstream)
+        np.testing.assert_array_equal(first, self.run_model(history, [6, 6], upstream))
+        self.assertTrue(((first >= 1) & (first <= 6)).all())
+        scaled = self.forecast.to_app_scale(first)
+        self.assertEqual(scaled.dtype.kind, 'i')
+        self.assertTrue(((scaled >= 1) & (scaled <= 5)).all())
+
+    def test_cells_without_data_use_default_index(self):
+        import numpy as np
+        nan = [[np.nan] * 7]
+        predicted = self.run_model(nan, [np.nan], nan)
+        np.testing.assert_allclose(predicted, self.config['DEFAULT_INDEX'])
+
+    def test_upstream_forecast_is_blended_with_current_reading(self):
+        import numpy as np
+        predicted = self.run_model([[np.nan] * 3], [2], [[5, 5, 5]])
+        weight = self.config['UPSTREAM_WEIGHT']
+        self.assertAlmostEqual(predicted[0, 0], weight * 5 + (1 - weight) * 2)
+
+
+class PrecomputeForecastsCommandTests(TestCase):
+    def test_refuses_process_local_forecast_cache(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        with mock.patch('app.management.commands.precompute_forecasts.precompute_forecasts') as run:
+            with self.assertRaisesMessage(CommandError, 'process-local'):
+                call_command('precompute_forecasts', cells=['abc123'])
+        run.assert_not_called()
+
+    def test_runs_with_shared_forecast_cache(self):
+        from io import StringIO
+        from django.core.management import call_command
+        stdout, stderr = StringIO(), StringIO()
+        command = 'app.management.commands.precompute_forecasts'
+        with override_settings(FORECAST={'CACHE_ALIAS': 'shared'}), \
+                mock.patch(f'{command}.is_shared_cache', side_effect=lambda alias: alias == 'shared'), \
+                mock.patch(f'{command}.precompute_forecasts', return_value={'cells': 1}) as run:
+            call_command('precompute_forecasts', cells=['abc123'], workers=1, stdout=stdout, stderr=stderr)
+        run.assert_called_once()
+        self.assertIn('history only', stderr.getvalue())
+        self.assertEqual(json.loads(stdout.getvalue()), {'cells': 1})
+
+
+@override_settings(**TEST_SETTINGS)
+class ConditionalGetTests(TestCase):
+    url = '/api/weather/?lat=30.0444&lon=31.2357'
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url=None, **headers):
+        return self.client.get(url or self.url, HTTP_X_FORWARDED_PROTO='https', **headers)
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    def test_matching_etag_gets_304_without_upstream_call(self, upstream):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('max-age=', first['Cache-Control'])
+        second = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        upstream.assert_called_once()
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    def test_async_view_shares_cache_but_not_etag(self, upstream):
+        etag = self.get()['ETag']
+        response = self.get('/api/async/weather/?lat=30.0444&lon=31.2357', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        upstream.assert_called_once()
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    def test_etag_changes_when_data_is_refetched(self, upstream):
+        etag = self.get()['ETag']
+        cache.clear()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @mock.patch('app.views.upstream_request', return_value={'error': 'down'})
+    def test_uncached_fallback_is_not_cacheable(self, upstream):
+        response = self.get()
+        self.assertNotIn('ETag', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+
+class SparseFieldsetTests(TestCase):
+    def test_parse_fields_builds_nested_tree(self):
+        from .renderers import parse_fields
+        self.assertIsNone(parse_fields(''))
+        self.assertEqual(parse_fields('date, day.maxtemp_c,day.mintemp_c'),
+                         {'date': None, 'day': {'maxtemp_c': None, 'mintemp_c': None}})
+        # الحقل الأب كاملاً يغلب الحقول الفرعية في أي ترتيب
+        self.assertEqual(parse_fields('day,day.maxtemp_c'), {'day': None})
+
+    def test_select_fields_prunes_dicts_and_lists(self):
+        from .renderers import parse_fields, select_fields
+        data = [{'date': '2026-01-01', 'day': {'maxtemp_c': 30, 'mintemp_c': 20}, 'hour': [1, 2]}]
+        self.assertEqual(select_fields(data, parse_fields('date,day.maxtemp_c,missing')),
+                         [{'date': '2026-01-01', 'day': {'maxtemp_c': 30}}])
+        self.assertIs(select_fields(data, None), data)
+
+    @override_settings(**TEST_SETTINGS)
+    def test_forecast_endpoint_applies_fields(self):
+        forecast = {'forecast': {'forecastday': [
+            {'date': '2026-01-01', 'day': {'maxtemp_c': 30, 'mintemp_c': 20}, 'hour': []},
+        ]}}
+        cache.clear()
+        with mock.patch('app.views.upstream_request', return_value=forecast):
+            response = self.client.get('/api/future-weather/?lat=30&lon=31&days=1&fields=date,day.maxtemp_c',
+                                       HTTP_X_FORWARDED_PROTO='https')
+            invalid = self.client.get('/api/future-weather/?lat=30&lon=31&fields=nope',
+                                      HTTP_X_FORWARDED_PROTO='https')
+        self.assertEqual(json.loads(response.content), [{'date': '2026-01-01', 'day': {'maxtemp_c': 30}}])
+        self.assertEqual(invalid.status_code, 400)
+
+
+@override_settings(**TEST_SETTINGS, COMPREHENSIVE_SAFETY={'DEADLINE': 0.1})
+class AsyncDeadlineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @staticmethod
+    async def hang(*args):
+        import asyncio
+        await asyncio.sleep(5)
+
+    @mock.patch('app.async_views.aget_combined_air_quality', new_callable=mock.AsyncMock, return_value={'aqi': 2})
+    def test_comprehensive_safety_falls_back_after_deadline(self, air_quality):
+        start = time.monotonic()
+        with mock.patch('app.async_views.aget_nasa_earth_data', side_effect=self.hang):
+            response = self.client.get('/api/async/comprehensive-safety/?lat=30&lon=31', HTTP_X_FORWARDED_PROTO='https')
+        self.assertLess(time.monotonic() - start, 2)
+        data = json.loads(response.content)
+        self.assertEqual(data['air_quality_index'], 2)
+        self.assertTrue(data['nasa_earth_data'])
+
+    @mock.patch('app.async_views.agenerate_advice', new_callable=mock.AsyncMock, return_value='advice')
+    @mock.patch('app.async_views.gemini_available', return_value=True)
+    def test_ai_advice_uses_fallback_weather_after_deadline(self, available, generate):
+        start = time.monotonic()
+        with mock.patch('app.async_views.aget_combined_air_quality', side_effect=self.hang), \
+                mock.patch('app.async_views.aget_weather_api_data', side_effect=self.hang):
+            response = self.client.post('/api/async/ai-advice/', {'lat': 30, 'lon': 31},
+                                        content_type='application/json', HTTP_X_FORWARDED_PROTO='https')
+        self.assertLess(time.monotonic() - start, 2)
+        data = json.loads(response.content)
+        self.assertEqual((data['advice'], data['air_quality_index']), ('advice', 3))
+
+
+class UpstreamQuotaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def limits(self, **limits):
+        return override_settings(UPSTREAM_QUOTA={'LIMITS': {'test': limits}})
+
+    def test_rejects_over_the_limit_and_release_returns_the_call(self):
+        from . import quota
+        from .circuit import QuotaExceededError
+        with self.limits(PER_DAY=2):
+            quota.acquire('test')
+            keys = quota.acquire('test')
+            with self.assertRaises(QuotaExceededError):
+                quota.acquire('test')
+            quota.release('test', keys)
+            quota.acquire('test')
+            self.assertEqual(quota.get_quota_stats()['test']['day'], {'used': 2, 'limit': 2})
+
+    def test_lower_priorities_leave_the_reserve(self):
+        from . import quota
+        from .circuit import QuotaExceededError
+        with self.limits(PER_DAY=10):
+            for _ in range(5):
+                quota.acquire('test', quota.BATCH)
+            with self.assertRaises(QuotaExceededError):
+                quota.acquire('test', quota.BATCH)
+            with quota.priority(quota.BACKGROUND):
+                for _ in range(3):
+                    quota.acquire('test')
+                self.assertRaises(QuotaExceededError, quota.acquire, 'test')
+            quota.acquire('test', quota.INTERACTIVE)
+            quota.acquire('test', quota.INTERACTIVE)
+            self.assertRaises(QuotaExceededError, quota.acquire, 'test', quota.INTERACTIVE)
+
+    def test_previous_minute_counts_towards_the_sliding_window(self):
+        from . import quota
+        from .circuit import QuotaExceededError
+        now = 1_000_000 * 60 + 15  # ربع الدقيقة الحالية مضى، فتحسب 75% من السابقة
+        cache.set(f"quota:test:minute:{1_000_000 - 1}", 4, 120)
+        with self.limits(PER_MINUTE=4), mock.patch('app.quota.time.time', return_value=now):
+            quota.acquire('test')
+            with self.assertRaises(QuotaExceededError):
+                quota.acquire('test')
+
+    def test_async_acquire_shares_counters(self):
+        from asgiref.sync import async_to_sync
+        from . import quota
+        from .circuit import QuotaExceededError
+        with self.limits(PER_DAY=1):
+            async_to_sync(quota.aacquire)('test')
+            with self.assertRaises(QuotaExceededError):
+                quota.acquire('test')
+
+    def test_process_local_cache_splits_limits_between_workers(self):
+        from . import quota
+        from .checks import upstream_quota_cache_check
+        from .circuit import QuotaExceededError
+        config = {'LIMITS': {'test': {'PER_DAY': 4}}, 'LOCAL_WORKERS': 2}
+        with override_settings(UPSTREAM_QUOTA=config):
+            quota.acquire('test')
+            quota.acquire('test')
+            self.assertRaises(QuotaExceededError, quota.acquire, 'test')
+            self.assertEqual([warning.id for warning in upstream_quota_cache_check(None)], ['app.W001'])
+
+    @override_settings(UPSTREAM_QUOTA={'LIMITS': {'gemini': {'PER_DAY': 1}}})
+    def test_gemini_rejection_is_recorded_as_quota_exhausted(self):
+        from .circuit import QuotaExceededError
+        from .metrics import fallback_cause
+        from .views import generate_advice
+        model = mock.Mock()
+        model.generate_content.return_value.text = 'advice'
+        with mock.patch('app.views.gemini_model_candidates', side_effect=lambda: iter([('a', model), ('b', model)])), \
+                mock.patch('app.views.remember_gemini_model'), \
+                mock.patch('app.views.forget_gemini_model') as forget:
+            self.assertEqual(generate_advice('prompt'), 'advice')
+            with self.assertRaises(QuotaExceededError) as raised:
+                generate_advice('prompt')
+        forget.assert_not_called()
+        self.assertEqual(fallback_cause(raised.exception), 'quota_exhausted')
+
+
+@override_settings(**TEST_SETTINGS, UPSTREAM_QUOTA={'ENABLED': False})
+class HeatmapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tile_url(self, fmt='bin', z=13, size=8):
+        import math
+        from . import heatmap
+        lat, lon = 30.0444, 31.2357
+        n = 2 ** z
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+        self.assertTrue(heatmap.valid_tile(z, x, y, heatmap.get_heatmap_config()))
+        return f'/api/heatmap/{z}/{x}/{y}.{fmt}?size={size}'
+
+    def get(self, url, **headers):
+        return self.client.get(url, HTTP_X_FORWARDED_PROTO='https', **headers)
+
+    def test_vectorized_scores_and_levels_match_scalar_functions(self):
+        import numpy as np
+        from .views import (calculate_safety_score_from_aqi, get_safety_level, safety_level_indexes,
+                            safety_scores_from_aqi, SAFETY_LEVELS)
+        aqi = [0, 1, 2, 3, 4, 5, 6, 2.5, np.nan]
+        self.assertEqual(safety_scores_from_aqi(aqi).tolist(),
+                         [calculate_safety_score_from_aqi(value) for value in aqi])
+        scores = np.arange(101)
+        self.assertEqual([SAFETY_LEVELS[index] for index in safety_level_indexes(scores)],
+                         [get_safety_level(score) for score in scores])
+
+    def test_png_uses_palette_with_transparent_missing_points(self):
+        import io
+        import numpy as np
+        from PIL import Image
+        from . import heatmap
+        body = heatmap.encode_png(np.array([[0, 5], [2, 3]]), np.array([[False, False], [True, False]]))
+        image = Image.open(io.BytesIO(body))
+        self.assertEqual(image.mode, 'P')
+        self.assertEqual(list(image.getdata()), [0, 5, len(heatmap.LEVEL_COLORS), 3])
+        self.assertEqual(image.info['transparency'], len(heatmap.LEVEL_COLORS))
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    def test_tile_is_built_once_and_revalidated(self, upstream):
+        response = self.get(self.tile_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, bytes([80]) * 64)
+        self.assertEqual(response['X-Heatmap-Missing-Cells'], '0')
+        calls = upstream.call_count
+        self.assertEqual(self.get(self.tile_url(), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        png = self.get(self.tile_url('png'))
+        self.assertEqual(png['Content-Type'], 'image/png')
+        self.assertNotEqual(png['ETag'], response['ETag'])
+        self.assertEqual(upstream.call_count, calls)
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    def test_map_clients_accepting_only_images_get_the_tile(self, upstream):
+        response = self.get(self.tile_url('png'), HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(self.get(self.tile_url(size=7), HTTP_ACCEPT='image/png').status_code, 400)
+
+    @mock.patch('app.views.upstream_request', return_value={'error': 'down'})
+    def test_failed_cells_are_marked_missing_not_defaulted(self, upstream):
+        from . import heatmap
+        response = self.get(self.tile_url())
+        self.assertEqual(response.content, bytes([heatmap.NO_DATA]) * 64)
+        self.assertNotEqual(response['X-Heatmap-Missing-Cells'], '0')
+
+    def test_invalid_tiles_are_rejected(self):
+        for url in ('/api/heatmap/3/0/0.bin', '/api/heatmap/13/8192/0.bin',
+                    self.tile_url('gif'), self.tile_url(size=7)):
+            self.assertEqual(self.get(url).status_code, 400, url)
+
+
+@override_settings(**TEST_SETTINGS)
+class AsgiStreamingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def body(self, response):
+        self.assertTrue(response.is_async)
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    async def test_batch_streams_with_async_iterator(self, upstream):
+        response = await self.async_client.post('/api/batch/safety-score/', {'points': [[30.0, 31.0], [30.5, 31.5]]},
+                                                 content_type='application/json', headers={'X-Forwarded-Proto': 'https'})
+        lines = [json.loads(line) for line in (await self.body(response)).splitlines()]
+        self.assertEqual(sorted(line['index'] for line in lines), [0, 1])
+
+    @mock.patch('app.views.generate_advice_stream', return_value=iter(['نصيحة ', 'قصيرة']))
+    @mock.patch('app.views.upstream_request', return_value=WEATHER)
+    @mock.patch('app.async_views.gemini_available', return_value=True)
+    async def test_async_advice_has_stream_mode(self, available, upstream, generate):
+        response = await self.async_client.post('/api/async/ai-advice/', {'lat': 30, 'lon': 31, 'stream': True},
+                                                 content_type='application/json', headers={'X-Forwarded-Proto': 'https'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = await self.body(response)
+        self.assertTrue(body.startswith(': stream opened\n\n'))
+        self.assertEqual(body.count('event: token'), 2)
+
+
+class GeoTests(TestCase):
+    POINTS = [(30.0444, 31.2357), (30.0626, 31.2497), (29.9792, 31.1342), (31.2001, 29.9187)]
+
+    @staticmethod
+    def scalar_bearing(lat1, lon1, lat2, lon2):
+        import math
+        lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+        x = math.sin(lon2 - lon1) * math.cos(lat2)
+        y = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(lon2 - lon1)
+        return (math.degrees(math.atan2(x, y)) + 360) % 360
+
+    def test_vectorized_distances_match_scalar_haversine(self):
+        import numpy as np
+        from . import geo
+        from .views import calculate_distance
+        lats, lons = np.array(self.POINTS).T
+        matrix = geo.distance_matrix(lats, lons, lats, lons)
+        for i, (lat1, lon1) in enumerate(self.POINTS):
+            np.testing.assert_allclose(geo.distances_from(lat1, lon1, lats, lons),
+                                       [calculate_distance(lat1, lon1, lat2, lon2) for lat2, lon2 in self.POINTS],
+                                       atol=1e-6)
+            np.testing.assert_allclose(matrix[i], geo.distances_from(lat1, lon1, lats, lons))
+            for lat2, lon2 in self.POINTS:
+                if (lat1, lon1) != (lat2, lon2):
+                    self.assertAlmostEqual(float(geo.bearing(lat1, lon1, lat2, lon2)),
+                                           self.scalar_bearing(lat1, lon1, lat2, lon2))
+        self.assertEqual(matrix.shape, (4, 4))
+
+    def test_cumulative_length(self):
+        import numpy as np
+        from . import geo
+        from .views import calculate_distance
+        lats, lons = np.array(self.POINTS).T
+        expected = np.cumsum([0] + [calculate_distance(*a, *b) for a, b in zip(self.POINTS, self.POINTS[1:])])
+        np.testing.assert_allclose(geo.cumulative_length(lats, lons), expected, atol=1e-6)
+        self.assertEqual(geo.cumulative_length([], []).tolist(), [])
+        self.assertEqual(geo.cumulative_length([30.0], [31.0]).tolist(), [0.0])
+
+    def test_resample_polyline(self):
+        import numpy as np
+        from . import geo
+        lats, lons, marks = geo.resample_polyline([30.0, 30.01], [31.0, 31.0], 250)
+        total = geo.haversine(30.0, 31.0, 30.01, 31.0)
+        np.testing.assert_allclose(marks, list(np.arange(0, total, 250)) + [total])
+        np.testing.assert_allclose(geo.distances_from(30.0, 31.0, lats, lons), marks, rtol=1e-6)
+        self.assertTrue((lons == 31.0).all())
+        # نقطة واحدة أو نقاط مكررة: نقطة واحدة عند مسافة صفر
+        for line in (([30.0], [31.0]), ([30.0, 30.0], [31.0, 31.0])):
+            lats, lons, marks = geo.resample_polyline(*line, 250)
+            self.assertEqual((lats.tolist(), lons.tolist(), marks.tolist()), ([30.0], [31.0], [0.0]))
+
+    def test_point_to_polyline_distance(self):
+        import numpy as np
+        from . import geo
+        from .views import calculate_distance
+        line_lats, line_lons = [30.0, 30.02, 30.02], [31.0, 31.0, 31.02]
+        lats = [30.01, 30.01, 29.99, 30.021]
+        lons = [31.0, 31.005, 31.0, 31.01]
+        distances = geo.point_to_polyline_distance(lats, lons, line_lats, line_lons)
+        expected = [
+            0.0,                                           # على المسار
+            calculate_distance(30.01, 31.005, 30.01, 31.0),  # عمودي على الجزء الأول
+            calculate_distance(29.99, 31.0, 30.0, 31.0),     # قبل بداية المسار
+            calculate_distance(30.021, 31.01, 30.02, 31.01),  # فوق الجزء الثاني
+        ]
+        np.testing.assert_allclose(distances, expected, rtol=1e-3, atol=0.5)
+        # مسار من نقطة واحدة أو جزء طوله صفر: المسافة إلى تلك النقطة
+        single = geo.point_to_polyline_distance(lats, lons, [30.0], [31.0])
+        np.testing.assert_allclose(single, [calculate_distance(lat, lon, 30.0, 31.0) for lat, lon in zip(lats, lons)])
+        np.testing.assert_allclose(geo.point_to_polyline_distance(lats, lons, [30.0, 30.0], [31.0, 31.0]),
+                                   single, rtol=1e-3)
+
+
+class SpatialIndexTests(TestCase):
+    def setUp(self):
+        from . import spatial
+        cache.clear()
+        spatial._index = None
+        self.addCleanup(setattr, spatial, '_index', None)
+
+    def brute_force(self, points, lat, lon, k, max_radius):
+        import numpy as np
+        from . import geo
+        distances = geo.distances_from(lat, lon, points[:, 0], points[:, 1])
+        order = [i for i in np.argsort(distances, kind='stable') if distances[i] <= max_radius][:k]
+        return [int(i) for i in order], [float(distances[i]) for i in order]
+
+    def test_nearest_matches_brute_force_scan(self):
+        import random
+        import numpy as np
+        from .spatial import GridIndex
+        rng = random.Random(3)
+        points = np.array([(30.0 + rng.uniform(-0.1, 0.1), 31.0 + rng.uniform(-0.1, 0.1)) for _ in range(500)])
+        index = GridIndex(0.01)
+        for i, (lat, lon) in enumerate(points):
+            index.upsert(i, lat, lon, {})
+        queries = [(30.0, 31.0), (30.05, 31.02),
+                   # عند حافة خلية: الأقرب قد يكون في الخلية المجاورة
+                   (30.01 - 1e-9, 31.03 + 1e-9), (29.99 + 1e-9, 30.98 - 1e-9),
+                   # خارج منطقة النقاط: يحتاج عدة حلقات
+                   (30.15, 31.15)]
+        for lat, lon in queries:
+            for k, max_radius in ((1, 10000), (5, 10000), (5, 800), (20, 3000)):
+                result = index.nearest(lat, lon, k, max_radius)
+                ids, distances = self.brute_force(points, lat, lon, k, max_radius)
+                self.assertEqual([item['id'] for item in result], ids, (lat, lon, k, max_radius))
+                np.testing.assert_allclose([item['distance'] for item in result], distances)
+
+    def test_removed_items_are_not_returned(self):
+        from .spatial import GridIndex
+        index = GridIndex(0.01)
+        index.upsert(1, 30.0, 31.0, {'name': 'a'})
+        index.upsert(2, 30.001, 31.0, {'name': 'b'})
+        index.upsert(1, 30.5, 31.5, {'name': 'a'})  # نقل إلى خلية أخرى
+        index.remove(2)
+        self.assertEqual(index.nearest(30.0, 31.0, 5, 1000), [])
+        self.assertEqual(len(index), 1)
+
+    def test_saving_a_location_bumps_the_shared_version(self):
+        from . import spatial
+        from .models import SafeLocation
+        self.assertEqual(len(spatial.get_safe_location_index()), 0)
+        location = SafeLocation.objects.create(name='Park', category='park', latitude=30.0, longitude=31.0)
+        self.assertEqual(cache.get(spatial.VERSION_KEY), 1)
+        # العملية نفسها حدثت فهرسها تزايدياً دون إعادة تحميل
+        with mock.patch('app.spatial._load_index') as load:
+            index = spatial.get_safe_location_index()
+        load.assert_not_called()
+        self.assertEqual(index.nearest(30.0, 31.0, 1, 100)[0]['name'], 'Park')
+        location.delete()
+        self.assertEqual(spatial.get_safe_location_index().nearest(30.0, 31.0, 1, 100), [])
+
+    def test_other_worker_change_rebuilds_the_index(self):
+        from . import spatial
+        from .models import SafeLocation
+        spatial.get_safe_location_index()
+        # عامل آخر أضاف موقعاً: الصف في قاعدة البيانات ورقم الإصدار زاد، وفهرس هذه العملية قديم
+        with mock.patch('app.signals.location_changed'):
+            SafeLocation.objects.create(name='Clinic', category='clinic', latitude=30.0, longitude=31.0)
+        self.assertEqual(spatial.get_safe_location_index().nearest(30.0, 31.0, 1, 100), [])
+        cache.set(spatial.VERSION_KEY, 7)
+        index = spatial.get_safe_location_index()
+        self.assertEqual(index.nearest(30.0, 31.0, 1, 100)[0]['name'], 'Clinic')
+        self.assertEqual(spatial._index_version, 7)
+
+
+@override_settings(**TEST_SETTINGS, UPSTREAM_QUOTA={'ENABLED': False})
+class RouteScoringTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @staticmethod
+    def upstream(provider, url, **kwargs):
+        # هواء ملوث شمال خط العرض 30.02 ونظيف جنوبه
+        lat = float(url.split('q=')[1].split(',')[0])
+        return {'current': {'last_updated_epoch': None, 'air_quality': {'us-epa-index': 5 if lat > 30.02 else 1}}}
+
+    def test_cleanest_route_wins_with_one_upstream_call_per_cell(self):
+        from .views import calculate_best_safe_route, route_sample_cells
+        dirty = {'summary': 'dirty', 'points': [(30.0, 31.0), (30.05, 31.0), (30.05, 31.05), (30.0, 31.05)],
+                 'duration': 700}
+        clean = {'summary': 'clean', 'points': [(30.0, 31.0), (30.0, 31.05)], 'duration': 900}
+        _, points = route_sample_cells([dirty, clean])
+        cells = {geo_cache.location_cell(lat, lon) for lat, lon in points}
+        self.assertLess(len(cells), len(points))  # البداية والنهاية مشتركتان بين المسارين
+        with mock.patch('app.views.upstream_request', side_effect=self.upstream) as upstream:
+            best = calculate_best_safe_route([dirty, clean])
+        self.assertEqual(best['summary'], 'clean')
+        self.assertEqual(best['average_aqi'], 1)
+        self.assertFalse(best['estimated'])
+        self.assertEqual(upstream.call_count, len(cells))
+        requested = [call.args[1].split('q=')[1].split('&')[0] for call in upstream.call_args_list]
+        self.assertEqual(len({geo_cache.location_cell(*map(float, q.split(','))) for q in requested}), len(cells))
+
+    def test_route_cell_weights_split_duration_by_cell(self):
+        from .views import route_cell_weights
+        way = {'points': [(30.0, 31.0), (30.0, 31.05)], 'duration': 600}
+        cells = route_cell_weights(way, 500, 40)
+        self.assertGreater(len(cells), 5)
+        self.assertAlmostEqual(sum(cell['seconds'] for cell in cells.values()), 600)
+        # مسار طويل: عدد العينات لا يتجاوز MAX_SAMPLES
+        long_way = {'points': [(30.0, 31.0), (30.0, 32.0)], 'duration': 3600}
+        self.assertLessEqual(len(route_cell_weights(long_way, 500, 10)), 11)
+        self.assertEqual(route_cell_weights({'points': []}, 500, 40), {})
+
+    def test_exposure_is_weighted_by_time_in_each_cell(self):
+        from .views import pick_best_route
+        # المسار a يقضي 10 ثوان فقط في خلية ملوثة، والمسار b كل وقته في هواء متوسط
+        a = {'summary': 'a'}
+        b = {'summary': 'b'}
+        weights = {
+            id(a): {'x': {'lat': 1, 'lon': 1, 'seconds': 10.0}, 'y': {'lat': 2, 'lon': 2, 'seconds': 590.0}},
+            id(b): {'z': {'lat': 3, 'lon': 3, 'seconds': 600.0}},
+        }
+        air_quality = {(1, 1): {'aqi': 5, 'estimated': False}, (2, 2): {'aqi': 1, 'estimated': False},
+                       (3, 3): {'aqi': 2, 'estimated': True}}
+        best = pick_best_route([a, b], weights, air_quality)
+        self.assertEqual(best['summary'], 'a')
+        self.assertAlmostEqual(best['average_aqi'], round((5 * 10 + 590) / 600, 2))
+
+
+class LstTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from . import lst
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        lst._tiles.clear()
+        self.addCleanup(lst._tiles.clear)
+        settings = override_settings(LST_TILES={'DIRECTORY': self.directory, 'RELOAD_INTERVAL': 0})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def granule(self, name, kelvin, pixel=None):
+        import numpy as np
+        from .lst import LST_SCALE, TILE_PIXELS
+        raw = np.zeros((TILE_PIXELS, TILE_PIXELS), dtype=np.uint16)
+        raw[pixel or (slice(None), slice(None))] = round(kelvin / LST_SCALE)
+        path = os.path.join(self.directory, 'granules', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(path, raw)
+        return path
+
+    def ingest(self, *paths):
+        from io import StringIO
+        from django.core.management import call_command
+        stdout = StringIO()
+        call_command('ingest_lst', *paths, stdout=stdout)
+        return json.loads(stdout.getvalue().splitlines()[-1])
+
+    def test_known_points_land_in_expected_tiles(self):
+        import numpy as np
+        from .lst import pixel_for, sinusoidal_pixel
+        # القاهرة في h20v05 (المنطقة التي تغطيها MOD11A1 لمصر)
+        self.assertEqual(pixel_for(30.0444, 31.2357)[:2], (20, 5))
+        # أصل الشبكة: خط الاستواء وغرينتش في أول بكسل من h18v09
+        self.assertEqual(pixel_for(0, 0), (18, 9, 0, 0))
+        self.assertEqual(pixel_for(0.0001, 0.0001)[:2], (18, 8))
+        self.assertEqual(pixel_for(-0.0001, -0.0001)[:2], (17, 9))
+        # النسخة المتجهة تطابق النسخة العددية
+        lats, lons = np.array([30.0444, 0.0, -33.9, 51.5]), np.array([31.2357, 0.0, 18.4, -0.12])
+        vectorized = sinusoidal_pixel(lats, lons)
+        for i, (lat, lon) in enumerate(zip(lats, lons)):
+            self.assertEqual(tuple(int(part[i]) for part in vectorized), pixel_for(lat, lon))
+
+    def test_write_tile_replaces_array_before_meta(self):
+        import numpy as np
+        from . import lst
+        replaced = []
+        real_replace = os.replace
+
+        def record(src, dst):
+            replaced.append(os.path.basename(dst))
+            real_replace(src, dst)
+
+        raw = np.full((lst.TILE_PIXELS, lst.TILE_PIXELS), 15000, dtype=np.uint16)
+        with mock.patch('app.lst.os.replace', side_effect=record):
+            lst.write_tile(self.directory, 'h20v05', raw, {'date': '2024-07-01'})
+        self.assertEqual(replaced, ['h20v05.npy', 'h20v05.json'])
+        self.assertEqual(lst.read_tile_meta(self.directory, 'h20v05'), {'date': '2024-07-01'})
+        self.assertTrue((np.load(os.path.join(self.directory, 'h20v05.npy')) == raw).all())
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith('.tmp')], [])
+
+    def test_surface_temperature_reads_ingested_pixel(self):
+        from .lst import pixel_for, surface_temperature
+        self.assertIsNone(surface_temperature(30.0444, 31.2357))
+        _, _, row, col = pixel_for(30.0444, 31.2357)
+        # باقي البكسلات fill (غيوم) فلا قيمة لها
+        self.ingest(self.granule('MOD11A1.A2024183.h20v05.061.npy', 313.15, (row, col)))
+        result = surface_temperature(30.0444, 31.2357)
+        # دقة التخزين 0.02 كلفن
+        self.assertAlmostEqual(result.pop('lst_c'), 40.0, delta=0.02)
+        self.assertEqual(result, {'date': '2024-07-01', 'tile': 'h20v05', 'source': 'MOD11A1'})
+        self.assertIsNone(surface_temperature(30.5, 31.5))
+
+    def test_get_tile_reloads_after_newer_ingest(self):
+        from .lst import get_tile, surface_temperature
+        self.ingest(self.granule('MOD11A1.A2024183.h20v05.061.npy', 303.15))
+        first, _ = get_tile('h20v05')
+        self.assertAlmostEqual(surface_temperature(30.0444, 31.2357)['lst_c'], 30.0, delta=0.02)
+        # granule أقدم لا يستبدل الموجود
+        summary = self.ingest(self.granule('MOD11A1.A2024180.h20v05.061.npy', 323.15))
+        self.assertEqual(summary['tiles_skipped'], 1)
+        self.assertIs(get_tile('h20v05')[0], first)
+        summary = self.ingest(self.granule('MOD11A1.A2024190.h20v05.061.npy', 318.15))
+        self.assertEqual(summary['tiles_written'], 1)
+        result = surface_temperature(30.0444, 31.2357)
+        self.assertAlmostEqual(result['lst_c'], 45.0, delta=0.02)
+        self.assertEqual(result['date'], '2024-07-08')
+
+
+@override_settings(**{**TEST_SETTINGS, 'OBSERVATIONS': {'ENABLED': True, 'BATCH_SIZE': 3, 'MAX_PENDING': 4}})
+class ObservationTests(TestCase):
+    def setUp(self):
+        from . import observations
+        observations._pending.clear()
+        observations._wake.clear()
+        self.addCleanup(observations._pending.clear)
+        stats = dict(observations._stats)
+        self.addCleanup(observations._stats.update, stats)
+        # الكتابة تتم باستدعاء flush مباشرة، فالـ thread الخلفي لا يرى قاعدة بيانات الاختبار
+        writer = mock.patch('app.observations._ensure_writer')
+        writer.start()
+        self.addCleanup(writer.stop)
+
+    def reading(self, epoch, aqi=2, temp_c=25):
+        return {'current': {'last_updated_epoch': epoch, 'temp_c': temp_c, 'air_quality': {'us-epa-index': aqi}}}
+
+    def test_readings_are_buffered_until_flush(self):
+        from . import observations
+        from .models import Observation
+        observations.record_observation(30.0444, 31.2357, 'current', self.reading(1719835200))
+        observations.record_observation(30.0444, 31.2357, 'current', {'error': 'boom'})
+        self.assertEqual(Observation.objects.count(), 0)
+        self.assertEqual(observations.get_observation_stats()['pending'], 1)
+        self.assertFalse(observations._wake.is_set())
+
+        self.assertEqual(observations.flush(), 1)
+        self.assertEqual(observations.flush(), 0)
+        observation = Observation.objects.get()
+        self.assertEqual((observation.source, observation.aqi, observation.temp_c), ('current', 2, 25))
+        self.assertEqual(observation.observed_at.timestamp(), 1719835200)
+
+    def test_full_batch_wakes_writer_and_overflow_drops_oldest(self):
+        from . import observations
+        for i in range(5):
+            observations.record_observation(30.0444, 31.2357, 'current', self.reading(1719835200 + i * 900))
+        # BATCH_SIZE=3 يوقظ الكاتب، وMAX_PENDING=4 يحذف أقدم قراءة
+        self.assertTrue(observations._wake.is_set())
+        self.assertEqual([o.observed_at.timestamp() for o in observations._pending],
+                         [1719835200 + i * 900 for i in range(1, 5)])
+        self.assertEqual(observations.get_observation_stats()['dropped'], 1)
+
+    def test_duplicate_readings_are_ignored(self):
+        from . import observations
+        from .models import Observation
+        observations.record_observation(30.0444, 31.2357, 'current', self.reading(1719835200))
+        observations.record_observation(30.0445, 31.2358, 'current', self.reading(1719835200))
+        observations.record_observation(30.0444, 31.2357, 'current_aqi', self.reading(1719835200))
+        observations.flush()
+        # نفس القراءة في دفعة لاحقة لا تفشل الدفعة كلها
+        observations.record_observation(30.0444, 31.2357, 'current', self.reading(1719835200))
+        observations.record_observation(30.0444, 31.2357, 'current', self.reading(1719836100))
+        self.assertEqual(observations.flush(), 2)
+        self.assertEqual(Observation.objects.count(), 3)
+        self.assertEqual(observations.get_observation_stats()['failed'], 0)
+
+    def test_downsample_averages_per_bucket(self):
+        from datetime import datetime, timedelta, timezone as tz
+        from .models import Observation
+        start = datetime(2024, 7, 1, 10, tzinfo=tz.utc)
+        rows = [('a', 0, 1, 20), ('a', 15, 3, None), ('a', 45, 5, 30), ('a', 60, 2, 26), ('b', 5, 6, 40)]
+        Observation.objects.bulk_create([
+            Observation(cell=cell, source='current', observed_at=start + timedelta(minutes=minutes),
+                        aqi=aqi, temp_c=temp_c)
+            for cell, minutes, aqi, temp_c in rows
+        ])
+        buckets = list(Observation.objects.for_cell('a').downsample('hour'))
+        self.assertEqual([bucket['bucket'] for bucket in buckets], [start, start + timedelta(hours=1)])
+        self.assertEqual([bucket['samples'] for bucket in buckets], [3, 1])
+        self.assertEqual((buckets[0]['avg_aqi'], buckets[0]['max_aqi']), (3, 5))
+        # القيم الفارغة لا تدخل في المتوسط
+        self.assertEqual(buckets[0]['avg_temp_c'], 25)
+
+        by_cell = list(Observation.objects.downsample('day', by=('cell',)))
+        self.assertEqual([(bucket['cell'], bucket['samples']) for bucket in by_cell], [('a', 4), ('b', 1)])
+
+
+@override_settings(**TEST_SETTINGS, UPSTREAM_QUOTA={'ENABLED': False})
+class AdviceTests(TestCase):
+    def setUp(self):
+        from . import views
+        cache.clear()
+        views._advice_cache.entries.clear()
+        self.addCleanup(views._advice_cache.entries.clear)
+        self.addCleanup(setattr, views, '_active_model', None)
+        self.addCleanup(views._failed_models.clear)
+        views._active_model = None
+        views._failed_models.clear()
+
+    def weather(self, temp_c, humidity, condition='Sunny'):
+        return {'current': {'temp_c': temp_c, 'humidity': humidity, 'condition': {'text': condition}}}
+
+    def test_cache_key_buckets_conditions(self):
+        from .views import advice_cache_key
+        key = advice_cache_key('  نصائح   للمشي ', 2, 'آمن', self.weather(21.0, 45, 'Sunny'))
+        # 5 درجات و20% لكل فئة، والحالة بدون فرق في حالة الأحرف أو المسافات
+        self.assertEqual(key, advice_cache_key('نصائح للمشي', 2, 'آمن', self.weather(24.9, 59, ' sunny ')))
+        self.assertEqual(key, ('نصائح للمشي', 2, 'آمن', 4, 2, 'sunny'))
+        self.assertNotEqual(key, advice_cache_key('نصائح للمشي', 2, 'آمن', self.weather(25.0, 45)))
+        self.assertNotEqual(key, advice_cache_key('نصائح للمشي', 2, 'آمن', self.weather(21.0, 60)))
+        self.assertNotEqual(key, advice_cache_key('نصائح للمشي', 3, 'آمن', self.weather(21.0, 45)))
+        # بيانات طقس ناقصة لا تكسر المفتاح
+        self.assertEqual(advice_cache_key('x', 2, 'آمن', {}), ('x', 2, 'آمن', None, None, ''))
+
+    def test_similar_conditions_reuse_cached_advice(self):
+        weather = iter([self.weather(21.0, 45), self.weather(23.5, 50)])
+        with mock.patch('app.views.gemini_available', return_value=True), \
+                mock.patch('app.views.get_combined_air_quality', return_value={'aqi': 2}), \
+                mock.patch('app.views.get_weather_api_data', side_effect=lambda lat, lon: next(weather)), \
+                mock.patch('app.views.generate_advice', return_value='اشرب الماء') as generate:
+            responses = [
+                self.client.post('/api/ai-advice/', {'lat': lat, 'lon': 31.2357}, content_type='application/json',
+                                 HTTP_X_FORWARDED_PROTO='https').json()
+                for lat in (30.0444, 30.1)
+            ]
+        generate.assert_called_once()
+        self.assertEqual([(r['advice'], r['cached']) for r in responses], [('اشرب الماء', False), ('اشرب الماء', True)])
+
+    def test_failed_model_falls_back_and_cools_down(self):
+        from . import views
+        models = {
+            'gemini-pro': mock.Mock(**{'generate_content.side_effect': RuntimeError('404 model not found')}),
+            'gemini-2.5-flash': mock.Mock(**{'generate_content.return_value.text': 'advice'}),
+        }
+        genai = mock.Mock(GenerativeModel=lambda name: models[name])
+        with mock.patch('app.views.get_genai', return_value=genai):
+            self.assertEqual(views.generate_advice('prompt'), 'advice')
+            self.assertEqual(views._active_model, ('gemini-2.5-flash', models['gemini-2.5-flash']))
+            self.assertGreater(views._failed_models['gemini-pro'], time.monotonic())
+
+            # النموذج الناجح يجرب أولاً، والفاشل لا يعاد تجربته قبل انتهاء التهدئة
+            self.assertEqual(views.generate_advice('prompt'), 'advice')
+            models['gemini-pro'].generate_content.assert_called_once()
+            self.assertEqual(models['gemini-2.5-flash'].generate_content.call_count, 2)
+
+            # فشل كل النماذج: لا نموذج نشط، وكلاهما في فترة التهدئة
+            models['gemini-2.5-flash'].generate_content.side_effect = RuntimeError('503')
+            with self.assertRaisesMessage(Exception, 'All Gemini models failed'):
+                views.generate_advice('prompt')
+            self.assertIsNone(views._active_model)
+            self.assertEqual(set(views._failed_models), {'gemini-pro', 'gemini-2.5-flash'})
+
+
+@override_settings(**TEST_SETTINGS, UPSTREAM_QUOTA={'ENABLED': False})
+class AdviceStreamTests(TestCase):
+    def setUp(self):
+        from . import views
+        cache.clear()
+        views._advice_cache.entries.clear()
+        self.addCleanup(views._advice_cache.entries.clear)
+
+    def events(self, generate_stream):
+        weather = {'current': {'temp_c': 30, 'humidity': 40, 'condition': {'text': 'Sunny'}}}
+        with mock.patch('app.views.gemini_available', return_value=True), \
+                mock.patch('app.views.get_combined_air_quality', return_value={'aqi': 2}), \
+                mock.patch('app.views.get_weather_api_data', return_value=weather), \
+                mock.patch('app.views.generate_advice_stream', side_effect=generate_stream):
+            response = self.client.post('/api/ai-advice/?stream=true', {'lat': 30.0444, 'lon': 31.2357},
+                                        content_type='application/json', HTTP_X_FORWARDED_PROTO='https')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+            body = b''.join(response.streaming_content).decode()
+        # كل حدث ينتهي بسطر فارغ
+        self.assertTrue(body.endswith('\n\n'))
+        return body.split('\n\n')[:-1]
+
+    def parse(self, block):
+        lines = block.split('\n')
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('event: ') and lines[1].startswith('data: '))
+        return lines[0][len('event: '):], json.loads(lines[1][len('data: '):])
+
+    def test_events_are_framed_in_order(self):
+        blocks = self.events(lambda prompt: iter(['اشرب ', 'الماء']))
+        # تعليق SSE يفتح الاتصال قبل أي استدعاء للمصادر
+        self.assertEqual(blocks[0], ': stream opened')
+        events = [self.parse(block) for block in blocks[1:]]
+        self.assertEqual([event for event, _ in events], ['context', 'token', 'token', 'done'])
+        context = events[0][1]
+        self.assertEqual((context['air_quality_index'], context['weather']['temp_c']), (2, 30))
+        self.assertEqual([data['text'] for event, data in events if event == 'token'], ['اشرب ', 'الماء'])
+
+        # نفس الطلب مرة ثانية: حدث token واحد من الذاكرة المؤقتة
+        events = [self.parse(block) for block in self.events(lambda prompt: iter([]))[1:]]
+        self.assertEqual(events[1], ('token', {'text': 'اشرب الماء', 'cached': True}))
+
+    def test_model_failure_sends_fallback_event(self):
+        def failing(prompt):
+            raise RuntimeError('All Gemini models failed')
+            yield
+
+        events = [self.parse(block) for block in self.events(failing)[1:]]
+        self.assertEqual([event for event, _ in events], ['context', 'fallback', 'done'])
+        self.assertTrue(events[1][1]['advice'].strip())
+
+
+@override_settings(**TEST_SETTINGS)
+class ServerTimingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def get_weather(self):
+        from django.test import Client
+        from . import timing
+
+        def upstream(*args, **kwargs):
+            # عميل HTTP يسجل زمن كل استدعاء باسم المصدر
+            timing.record('weatherapi', 12.5)
+            return WEATHER
+
+        # الـ middleware يقرأ إعداداته عند الإنشاء، فعميل جديد لكل إعداد
+        with mock.patch('app.views.upstream_request', side_effect=upstream):
+            return Client().get('/api/weather/', {'lat': 30.0444, 'lon': 31.2357}, HTTP_X_FORWARDED_PROTO='https')
+
+    def test_header_lists_phases_then_total(self):
+        response = self.get_weather()
+        self.assertEqual(response.status_code, 200)
+        entries = [entry.split(';dur=') for entry in response['Server-Timing'].split(', ')]
+        names = [name for name, _ in entries]
+        self.assertEqual(names[-1], 'total')
+        self.assertEqual(set(names), {'auth', 'weatherapi', 'get_weather_api_data', 'render', 'total'})
+        durations = {name: float(ms) for name, ms in entries}
+        self.assertEqual(durations['weatherapi'], 12.5)
+        # المراحل متداخلة داخل زمن الطلب الكلي
+        self.assertGreaterEqual(durations['total'], durations['get_weather_api_data'])
+
+        # الاستدعاء الثاني من الذاكرة المؤقتة: بدون مرحلة المصدر
+        names = [entry.split(';')[0] for entry in self.get_weather()['Server-Timing'].split(', ')]
+        self.assertNotIn('weatherapi', names)
+
+    def test_header_can_be_disabled_and_slow_requests_are_logged(self):
+        with override_settings(SERVER_TIMING={'HEADER': False, 'SLOW_REQUEST_MS': 0}):
+            with self.assertLogs('app.middleware', 'WARNING') as logs:
+                response = self.get_weather()
+        self.assertNotIn('Server-Timing', response)
+        line = json.loads(logs.records[0].getMessage()[len('Slow request '):])
+        self.assertEqual((line['view'], line['status'], line['method']), ('weather', 200, 'GET'))
+        self.assertEqual(line['phases']['weatherapi'], {'ms': 12.5, 'count': 1})
@@ -0,0 +1,88 @@
+import time
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction
+
+# مراحل الطلب الحالي؛ تنتقل تلقائياً إلى مهام asyncio وإلى threads عبر gather
+_phases = contextvars.ContextVar('request_phases', default=None)
+
+
+class RequestPhases:
+    """أزمنة المراحل المسماة لطلب واحد، آمنة للاستدعاءات المتوازية"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, ms):
+        with self.lock:
+            total, count = self.durations.get(name, (0.0, 0))
+            self.durations[name] = (total + ms, count + 1)
+
+    def elapsed_ms(self):
+        return (time.monotonic() - self.start) * 1000
+
+    def items(self):
+        with self.lock:
+            return list(self.durations.items())
+
+
+def start_request():
+    phases = RequestPhases()
+    return phases, _phases.set(phases)
+
+
+def end_request(token):
+    _phases.reset(token)
+
+
+def current():
+    return _phases.get()
+
+
+def record(name, ms):
+    """تسجيل مرحلة منتهية مباشرة (مثلاً من عميل HTTP)"""
+    phases = _phases.get()
+    if phases is not None:
+        phases.add(name, ms)
+
+
+@contextmanager
+def phase(name):
+    phases = _phases.get()
+    if phases is None:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        phases.add(name, (time.monotonic() - start) * 1000)
+
+
+def timed(name=None):
+    """decorator لقياس زمن دالة (متزامنة أو async) كمرحلة باسمها"""
+    def decorator(fn):
+        phase_name = name or fn.__name__
+        if iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with phase(phase_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(phase_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing_header(phases, total_ms):
+    entries = [f"{name};dur={ms:.1f}" for name, (ms, _) in phases.items()]
+    entries.append(f"total;dur={total_ms:.1f}")
+    return ', '.join(entries)
@@ -2,6 +2,8 @@ from django.urls import path
 from .views import (
     AirQualityAPIView, 
     SafetyScoreAPIView, 
+    BatchSafetyScoreAPIView,
+    HeatmapTileAPIView,
     BestRouteAPIView, 
     NearestSafeLocationAPIView, 
     ComprehensiveSafetyAPIView, 
@@ -10,10 +12,23 @@ from .views import (
     FutureAirQualityAPIView,  # تم تصحيح اسم الفئة
     FutureWeatherAPIView      # تم تصحيح اسم الفئة
 )
+from .async_views import (
+    AsyncAirQualityView,
+    AsyncSafetyScoreView,
+    AsyncBestRouteView,
+    AsyncNearestSafeLocationView,
+    AsyncComprehensiveSafetyView,
+    AsyncWeatherView,
+    AsyncAIAdviceView,
+    AsyncFutureAirQualityView,
+    AsyncFutureWeatherView,
+)
 
 urlpatterns = [
     path('air-quality/', AirQualityAPIView.as_view(), name='air_quality'),
     path('safety-score/', SafetyScoreAPIView.as_view(), name='safety_score'),
+    path('batch/safety-score/', BatchSafetyScoreAPIView.as_view(), name='batch_safety_score'),
+    path('heatmap/<int:z>/<int:x>/<int:y>.<str:fmt>', HeatmapTileAPIView.as_view(), name='heatmap_tile'),
     path('best-route/', BestRouteAPIView.as_view(), name='best_route'),
     path('nearest-safe-location/', NearestSafeLocationAPIView.as_view(), name='nearest_safe_location'),
     path('comprehensive-safety/', ComprehensiveSafetyAPIView.as_view(), name='comprehensive_safety'),
@@ -21,4 +36,15 @@ urlpatterns = [
     path('ai-advice/', AIAdviceAPIView.as_view(), name='ai_advice'),
     path('future-air-quality/', FutureAirQualityAPIView.as_view(), name='future_air_quality'),  # تم التصحيح
     path('future-weather/', FutureWeatherAPIView.as_view(), name='future_weather'),  # تم التصحيح
+
+    # نفس الـ endpoints بشكل غير متزامن (للتشغيل عبر ASGI/uvicorn)
+    path('async/air-quality/', AsyncAirQualityView.as_view(), name='async_air_quality'),
+    path('async/safety-score/', AsyncSafetyScoreView.as_view(), name='async_safety_score'),
+    path('async/best-route/', AsyncBestRouteView.as_view(), name='async_best_route'),
+    path('async/nearest-safe-location/', AsyncNearestSafeLocationView.as_view(), name='async_nearest_safe_location'),
+    path('async/comprehensive-safety/', AsyncComprehensiveSafetyView.as_view(), name='async_comprehensive_safety'),
+    path('async/weather/', AsyncWeatherView.as_view(), name='async_weather'),
+    path('async/ai-advice/', AsyncAIAdviceView.as_view(), name='async_ai_advice'),
+    path('async/future-air-quality/', AsyncFutureAirQualityView.as_view(), name='async_future_air_quality'),
+    path('async/future-weather/', AsyncFutureWeatherView.as_view(), name='async_future_weather'),
 ]
\ No newline at end of file
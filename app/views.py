@@ -1,45 +1,77 @@
 import os
+import json
 import math
+import time
 import random
+import threading
+import contextvars
 import requests
+import numpy as np
 from datetime import datetime, timedelta
 from urllib.parse import urljoin
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
+from .cache import cached_fetch, location_cell, is_cached, get_entries, LRUCache
+from .concurrency import aiterate, gather, get_executor
+from . import geo
+from .spatial import get_safe_location_index, get_safe_locations_config
+from .http_client import upstream_request, provider_for_url, upstream_url
+from .circuit import CircuitOpenError, QuotaExceededError
+from . import quota
+from .metrics import record_fallback, fallback_cause
+from .timing import timed
+from .gemini import get_genai, gemini_available
+from .observations import record_observation
+from .forecast import get_cached_forecast, build_forecast, utc_today
+from .conditional import cell_conditional, get_conditional_get_config
+from .renderers import FixedContentNegotiation, parse_fields
+from .lst import surface_temperature
+from . import heatmap
+
 import logging
 logger = logging.getLogger(__name__)
 
-def safe_request(url, params=None, headers=None):
+def safe_request(url, params=None, headers=None, provider=None, auth=None):
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        return response.json()
+        return upstream_request(provider or provider_for_url(url), url, params=params, headers=headers, auth=auth)
+    except CircuitOpenError as e:
+        logger.debug(f"Skipping {url}: {e}")
+        return {'error': str(e), 'cause': fallback_cause(e)}
     except requests.RequestException as e:
         logger.error(f"Request failed for {url}: {e}")
-        return {'error': str(e)}
+        return {'error': str(e), 'cause': fallback_cause(e)}
 
 # WEATHER API - الإصدار المحسن
+@timed('get_weather_api_data')
 def get_weather_api_data(lat, lon):
     try:
         api_key = settings.WEATHER_API_KEY
         if not api_key:
             logger.warning("WEATHER_API_KEY not configured")
+            record_fallback('weatherapi', 'missing_key')
             return get_fallback_weather_data()
             
-        url = f"http://api.weatherapi.com/v1/current.json?key={api_key}&q={lat},{lon}"
-        data = safe_request(url)
+        url = upstream_url('weatherapi', f"current.json?key={api_key}&q={lat},{lon}")
+        data = cached_fetch('current', lat, lon, lambda: safe_request(url, provider='weatherapi'),
+                            on_store=lambda data: record_observation(lat, lon, 'current', data))
         
         if 'error' in data:
             logger.warning(f"WeatherAPI failed, using fallback: {data['error']}")
+            record_fallback('weatherapi', data.get('cause', 'error'))
             return get_fallback_weather_data()
             
         return data
         
     except Exception as e:
         logger.error(f"WeatherAPI error: {e}")
+        record_fallback('weatherapi', 'error')
         return get_fallback_weather_data()
 
 def get_fallback_weather_data():
@@ -59,46 +91,55 @@ def get_air_quality_from_weather_api(lat, lon):
     try:
         api_key = settings.WEATHER_API_KEY
         if not api_key:
+            record_fallback('weatherapi_aqi', 'missing_key')
             return {'aqi': 3}  # قيمة افتراضية
             
         # جلب بيانات الطقس مع معلومات جودة الهواء
-        url = f"http://api.weatherapi.com/v1/current.json?key={api_key}&q={lat},{lon}&aqi=yes"
-        data = safe_request(url)
+        url = upstream_url('weatherapi', f"current.json?key={api_key}&q={lat},{lon}&aqi=yes")
+        data = cached_fetch('current_aqi', lat, lon, lambda: safe_request(url, provider='weatherapi'),
+                            on_store=lambda data: record_observation(lat, lon, 'current_aqi', data))
         
         if 'error' in data:
             logger.warning(f"WeatherAPI air quality failed: {data['error']}")
+            record_fallback('weatherapi_aqi', data.get('cause', 'error'))
             return {'aqi': 3}
             
-        if 'current' in data and 'air_quality' in data['current']:
-            aqi_data = data['current']['air_quality']
-            us_epa_index = aqi_data.get('us-epa-index', 3)
-            
-            # تحويل مقياس EPA (1-6) إلى مقياسنا (1-5)
-            if us_epa_index == 1:
-                aqi = 1  # ممتاز
-            elif us_epa_index == 2:
-                aqi = 2  # جيد
-            elif us_epa_index == 3:
-                aqi = 3  # متوسط
-            elif us_epa_index == 4:
-                aqi = 4  # سيء
-            else:  # 5 أو 6
-                aqi = 5  # خطير
-                
-            return {'aqi': aqi}
-        else:
-            return {'aqi': 3}  # قيمة افتراضية
+        return parse_air_quality(data)
             
     except Exception as e:
         logger.error(f"WeatherAPI air quality error: {e}")
+        record_fallback('weatherapi_aqi', 'error')
         return {'aqi': 3}
 
+def parse_air_quality(data):
+    """استخراج AQI بمقياسنا (1-5) من رد WeatherAPI"""
+    if 'current' in data and 'air_quality' in data['current']:
+        aqi_data = data['current']['air_quality']
+        us_epa_index = aqi_data.get('us-epa-index', 3)
+        
+        # تحويل مقياس EPA (1-6) إلى مقياسنا (1-5)
+        if us_epa_index == 1:
+            aqi = 1  # ممتاز
+        elif us_epa_index == 2:
+            aqi = 2  # جيد
+        elif us_epa_index == 3:
+            aqi = 3  # متوسط
+        elif us_epa_index == 4:
+            aqi = 4  # سيء
+        else:  # 5 أو 6
+            aqi = 5  # خطير
+            
+        return {'aqi': aqi}
+    else:
+        return {'aqi': 3}  # قيمة افتراضية
+
 def get_air_quality_from_openaq(lat, lon):
     """دالة بديلة لـ OpenAQ - تعيد قيمة افتراضية"""
     logger.info("OpenAQ API is no longer available, using fallback data")
     # قيمة عشوائية بين 1-5 لمحاكاة بيانات حقيقية
     return {'aqi': random.randint(2, 4)}
 
+@timed('get_combined_air_quality')
 def get_combined_air_quality(lat, lon):
     """الدالة النهائية المبسطة لجودة الهواء"""
     try:
@@ -118,7 +159,41 @@ def get_combined_air_quality(lat, lon):
         logger.error(f"Combined air quality error: {e}")
         return {'aqi': 3}
 
+def get_air_quality_many(points, timeout=None):
+    """
+    جلب جودة الهواء لعدة نقاط بالتوازي مع مهلة إجمالية
+    النقاط في نفس الخلية المكانية تستدعى مرة واحدة فقط
+    تعيد قاموس point -> {'aqi', 'estimated'}، والنقاط التي تجاوزت المهلة تأخذ قيمة تقديرية
+    """
+    if timeout is None:
+        timeout = settings.ROUTE_SCORING['DEADLINE']
+
+    cells = group_points_by_cell(points)
+    calls = {cell: (get_combined_air_quality, point) for cell, point in cells.items()}
+    results, pending = gather(calls, timeout)
+    if pending:
+        logger.warning(f"Air quality lookups timed out for {len(pending)}/{len(calls)} cells, using estimates")
+    return expand_cell_results(points, cells, results)
+
+def group_points_by_cell(points):
+    """نقطة ممثلة واحدة لكل خلية مكانية"""
+    cells = {}
+    for point in points:
+        cells.setdefault(location_cell(point[0], point[1]), point)
+    return cells
+
+def expand_cell_results(points, cells, results):
+    """توزيع نتائج الخلايا على النقاط الأصلية، الخلايا بدون نتيجة تأخذ قيمة تقديرية"""
+    by_cell = {}
+    for cell in cells:
+        if cell in results:
+            by_cell[cell] = {'aqi': results[cell].get('aqi', 3), 'estimated': False}
+        else:
+            by_cell[cell] = {'aqi': 3, 'estimated': True}
+    return {point: by_cell[location_cell(point[0], point[1])] for point in points}
+
 # NASA DATA - الإصدار المحسن
+@timed('get_nasa_earth_data')
 def get_nasa_earth_data(lat, lon):
     """دالة NASA مع بيانات افتراضية"""
     try:
@@ -127,32 +202,65 @@ def get_nasa_earth_data(lat, lon):
         
         # إذا لم توجد بيانات اعتماد NASA، استخدم بيانات افتراضية
         if not username or not password:
+            record_fallback('nasa', 'missing_key')
             return get_fallback_nasa_data(lat, lon)
-            
-        end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=30)
-        url = "https://cmr.earthdata.nasa.gov/search/granules.json"
-        params = {
-            'short_name': 'MOD11A1',
-            'temporal': f"{start_date.strftime('%Y-%m-%dT%H:%M:%SZ')},{end_date.strftime('%Y-%m-%dT%H:%M:%SZ')}",
-            'bounding_box': f"{lon-0.1},{lat-0.1},{lon+0.1},{lat+0.1}",
-            'page_size': 1,
-            'sort_key': '-start_date'
-        }
-        
-        response = requests.get(url, params=params, auth=(username, password), timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data['feed']['entry']:
-            return data['feed']['entry'][0]
-        else:
+
+        # أحدث granule لا يتغير خلال اليوم لكل من في نفس الخلية، فيخزن لكل خلية لكل يوم
+        tile, (tile_lat, tile_lon) = nasa_tile(lat, lon)
+        url = upstream_url('nasa', NASA_CMR_GRANULES_PATH)
+        data = cached_fetch(
+            'nasa_granule', lat, lon,
+            lambda: safe_request(url, params=nasa_search_params(tile_lat, tile_lon), provider='nasa', auth=(username, password)),
+            ttl_for=nasa_granule_ttl, cell=f"{tile}:{utc_today().isoformat()}", track=False,
+        )
+
+        if 'error' in data:
+            record_fallback('nasa', data.get('cause', 'error'))
             return get_fallback_nasa_data(lat, lon)
-            
-    except requests.RequestException as e:
+
+        return nasa_latest_granule(data) or get_fallback_nasa_data(lat, lon)
+
+    except Exception as e:
         logger.error(f"NASA EarthData error: {e}")
+        record_fallback('nasa', 'error')
         return get_fallback_nasa_data(lat, lon)
 
+NASA_CMR_GRANULES_PATH = "search/granules.json"
+NASA_TILE_DEGREES = 0.1
+
+def nasa_tile(lat, lon):
+    """خلية شبكة بحجم NASA_TILE_DEGREES ومركزها، يبحث حولها بـ ±0.1°"""
+    row = math.floor(lat / NASA_TILE_DEGREES)
+    col = math.floor(lon / NASA_TILE_DEGREES)
+    center = (round((row + 0.5) * NASA_TILE_DEGREES, 4), round((col + 0.5) * NASA_TILE_DEGREES, 4))
+    return f"{row}_{col}", center
+
+def nasa_granule_ttl(data):
+    """حتى منتصف الليل UTC، حيث يتغير مفتاح اليوم ونطاق البحث"""
+    now = datetime.utcnow()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return max(60, int((midnight - now).total_seconds()))
+
+def nasa_latest_granule(data):
+    """أول granule في رد CMR، أو None مع تسجيل no_data"""
+    entries = data.get('feed', {}).get('entry', [])
+    if entries:
+        return entries[0]
+    record_fallback('nasa', 'no_data')
+    return None
+
+def nasa_search_params(lat, lon):
+    """معاملات البحث عن أحدث granule من MOD11A1 حول الموقع"""
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(days=30)
+    return {
+        'short_name': 'MOD11A1',
+        'temporal': f"{start_date.strftime('%Y-%m-%dT%H:%M:%SZ')},{end_date.strftime('%Y-%m-%dT%H:%M:%SZ')}",
+        'bounding_box': f"{lon-0.1:.4f},{lat-0.1:.4f},{lon+0.1:.4f},{lat+0.1:.4f}",
+        'page_size': 1,
+        'sort_key': '-start_date'
+    }
+
 def get_fallback_nasa_data(lat, lon):
     """بيانات NASA افتراضية"""
     return {
@@ -167,44 +275,54 @@ def get_fallback_nasa_data(lat, lon):
     }
 
 # TOMTOM ROUTING - الإصدار المحسن
+@timed('get_list_of_ways')
 def get_list_of_ways(lat1, lon1, lat2, lon2):
     try:
         api_key = settings.TOMTOM_API_KEY
         if not api_key:
+            record_fallback('tomtom', 'missing_key')
             return get_fallback_route_data(lat1, lon1, lat2, lon2)
             
-        url = f"https://api.tomtom.com/routing/1/calculateRoute/{lat1},{lon1}:{lat2},{lon2}/json"
-        params = {
-            'key': api_key,
-            'routeType': 'fastest',
-            'traffic': 'true',
-            'alternatives': 3
-        }
-        data = safe_request(url, params=params)
+        url = upstream_url('tomtom', f"routing/1/calculateRoute/{lat1},{lon1}:{lat2},{lon2}/json")
+        data = safe_request(url, params=tomtom_route_params(api_key), provider='tomtom')
         
         if 'error' in data:
             logger.warning(f"TomTom failed, using fallback: {data['error']}")
+            record_fallback('tomtom', data.get('cause', 'error'))
             return get_fallback_route_data(lat1, lon1, lat2, lon2)
             
-        routes = data.get('routes', [])
-        ways = []
-        for route in routes:
-            summary = route.get('summary', {})
-            legs = route.get('legs', [])
-            if legs:
-                points = legs[0].get('points', [])
-                way = {
-                    'distance': summary.get('lengthInMeters', 0),
-                    'duration': summary.get('travelTimeInSeconds', 0),
-                    'points': [(point['latitude'], point['longitude']) for point in points]
-                }
-                ways.append(way)
-        return ways
+        return parse_route_data(data)
         
     except Exception as e:
         logger.error(f"TomTom routing error: {e}")
+        record_fallback('tomtom', 'error')
         return get_fallback_route_data(lat1, lon1, lat2, lon2)
 
+def tomtom_route_params(api_key):
+    return {
+        'key': api_key,
+        'routeType': 'fastest',
+        'traffic': 'true',
+        'alternatives': 3
+    }
+
+def parse_route_data(data):
+    """تحويل رد TomTom إلى قائمة مسارات (المسافة، المدة، النقاط)"""
+    routes = data.get('routes', [])
+    ways = []
+    for route in routes:
+        summary = route.get('summary', {})
+        legs = route.get('legs', [])
+        if legs:
+            points = legs[0].get('points', [])
+            way = {
+                'distance': summary.get('lengthInMeters', 0),
+                'duration': summary.get('travelTimeInSeconds', 0),
+                'points': [(point['latitude'], point['longitude']) for point in points]
+            }
+            ways.append(way)
+    return ways
+
 def get_fallback_route_data(lat1, lon1, lat2, lon2):
     """بيانات مسار افتراضية"""
     # حساب مسافة تقريبية
@@ -230,29 +348,91 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
     return R * c
 
+def route_cell_weights(way, spacing, max_samples):
+    """الوقت المقضي (بالثواني) في كل خلية مكانية على طول المسار"""
+    if not way['points']:
+        return {}
+    lats, lons = np.asarray(way['points'], dtype=np.float64).T
+    total = geo.cumulative_length(lats, lons)[-1]
+    if max_samples and total / spacing > max_samples:
+        spacing = total / max_samples  # عدد عينات محدود مهما كان طول المسار
+    sample_lats, sample_lons, travelled = geo.resample_polyline(lats, lons, spacing)
+    duration = way.get('duration') or total
+
+    # كل عينة تمثل المسافة بين منتصفي الجزأين المجاورين لها
+    midpoints = (travelled[:-1] + travelled[1:]) / 2
+    bounds = np.concatenate((travelled[:1], midpoints, travelled[-1:]))
+    if total > 0:
+        seconds = np.diff(bounds) / total * duration
+    else:
+        seconds = np.full(len(travelled), duration / len(travelled))
+
+    cells = {}
+    for lat, lon, spent in zip(sample_lats.tolist(), sample_lons.tolist(), seconds.tolist()):
+        cell = cells.setdefault(location_cell(lat, lon), {'lat': lat, 'lon': lon, 'seconds': 0.0})
+        cell['seconds'] += spent
+    return cells
+
 def calculate_best_safe_route(ways):
     if not ways or 'error' in ways:
         return None
-        
-    def safety_score(way):
-        score = 0
-        point_count = min(3, len(way['points']))  # عينات محدودة
-        for i in range(0, point_count):
-            lat, lon = way['points'][i]
-            air_quality = get_combined_air_quality(lat, lon).get('aqi', 3)
-            score += air_quality
-        return score / point_count
 
-    best_way = min(ways, key=safety_score, default=None)
-    return best_way
+    weights, all_points = route_sample_cells(ways)
+    air_quality = get_air_quality_many(all_points)
+    return pick_best_route(ways, weights, air_quality)
+
+def route_sample_cells(ways):
+    """خلايا العينات لكل مسار، وكل النقاط التي تحتاج جودة الهواء"""
+    config = settings.ROUTE_SCORING
+    weights = {
+        id(way): route_cell_weights(way, config['SAMPLE_SPACING'], config['MAX_SAMPLES'])
+        for way in ways
+    }
+    all_points = [(cell['lat'], cell['lon']) for cells in weights.values() for cell in cells.values()]
+    return weights, all_points
+
+def pick_best_route(ways, weights, air_quality):
+    """المسار الأقل تعرضاً للتلوث مع تفاصيل العينات"""
+    def exposure(way):
+        """التعرض الموزون بالوقت: متوسط AQI حسب الوقت المقضي في كل خلية"""
+        cells = weights[id(way)].values()
+        if not cells:
+            return 3
+        total_seconds = sum(cell['seconds'] for cell in cells)
+        if not total_seconds:
+            return sum(air_quality[(cell['lat'], cell['lon'])]['aqi'] for cell in cells) / len(cells)
+        return sum(air_quality[(cell['lat'], cell['lon'])]['aqi'] * cell['seconds'] for cell in cells) / total_seconds
+
+    best_way = min(ways, key=exposure, default=None)
+    if best_way is None:
+        return None
+
+    best_samples = [
+        {**cell, 'seconds': round(cell['seconds'], 1), **air_quality[(cell['lat'], cell['lon'])]}
+        for cell in weights[id(best_way)].values()
+    ]
+    average_aqi = exposure(best_way)
+    return {
+        **best_way,
+        'average_aqi': round(average_aqi, 2),
+        'exposure': round(average_aqi * sum(cell['seconds'] for cell in weights[id(best_way)].values()), 1),
+        'samples': best_samples,
+        'estimated': any(sample['estimated'] for sample in best_samples),
+    }
 
 def find_nearest_safe_location(lat, lon, locations):
+    if not locations:
+        return None
+    return rank_safe_locations(lat, lon, locations, get_air_quality_many(locations))
+
+def rank_safe_locations(lat, lon, locations, air_quality):
+    """أفضل موقع: الأقل في AQI ثم الأقرب"""
+    loc_lats, loc_lons = np.asarray(locations, dtype=np.float64).T
+    distances = geo.distances_from(lat, lon, loc_lats, loc_lons)
+
     locations_with_scores = []
-    for loc in locations:
-        loc_lat, loc_lon = loc
-        air_quality = get_combined_air_quality(loc_lat, loc_lon).get('aqi', 3)
-        distance = math.sqrt((lat - loc_lat) ** 2 + (lon - loc_lon) ** 2)
-        locations_with_scores.append((loc, air_quality, distance))
+    for loc, distance in zip(locations, distances.tolist()):
+        locations_with_scores.append((loc, air_quality[loc]['aqi'], distance))
 
     locations_with_scores.sort(key=lambda x: (x[1], x[2]))
     return locations_with_scores[0][0] if locations_with_scores else None
@@ -287,8 +467,24 @@ def get_safety_level(score):
     else:
         return "خطير"
 
+# نفس الدالتين لمصفوفات كاملة (خرائط الحرارة)، الجداول مبنية منهما حتى لا تختلف القيم
+SAFETY_SCORE_BY_AQI = np.array([calculate_safety_score_from_aqi(aqi) for aqi in range(6)])
+SAFETY_LEVEL_BOUNDS = (30, 45, 60, 75, 90)
+SAFETY_LEVELS = tuple(get_safety_level(score) for score in (0,) + SAFETY_LEVEL_BOUNDS)
+
+def safety_scores_from_aqi(aqi):
+    """calculate_safety_score_from_aqi لمصفوفة AQI، القيم غير المتوقعة (وNaN) تأخذ 60"""
+    aqi = np.asarray(aqi, dtype=np.float64)
+    known = (aqi >= 1) & (aqi <= 5) & (aqi == np.floor(aqi))
+    return SAFETY_SCORE_BY_AQI[np.where(known, aqi, 0).astype(int)]
+
+def safety_level_indexes(scores):
+    """get_safety_level لمصفوفة درجات: موضع كل درجة في SAFETY_LEVELS"""
+    return np.digitize(scores, SAFETY_LEVEL_BOUNDS)
+
 # API VIEWS - الإصدار النهائي مع تحديث Safety Score
 class AirQualityAPIView(APIView):
+    @cell_conditional('current_aqi')
     def get(self, request):
         lat = request.query_params.get('lat')
         lon = request.query_params.get('lon')
@@ -308,6 +504,7 @@ class AirQualityAPIView(APIView):
         return Response(air_quality)
 
 class FutureAirQualityAPIView(APIView):
+    @cell_conditional('forecast', extra=lambda request: utc_today())
     def get(self, request):
         lat = request.query_params.get('lat')
         lon = request.query_params.get('lon')
@@ -327,27 +524,57 @@ class FutureAirQualityAPIView(APIView):
             return Response({'error': 'Invalid Latitude, Longitude, or Days (1-7).'}, 
                           status=status.HTTP_400_BAD_REQUEST)
 
-        # تنبؤات مبسطة بناءً على البيانات الحالية
-        current_aqi = get_combined_air_quality(lat, lon).get('aqi', 3)
-        future_data = []
-        
-        for day in range(days):
-            future_date = datetime.utcnow() + timedelta(days=day)
-            # تغيير طفيف في AQI (±1)
-            predicted_aqi = max(1, min(5, current_aqi + random.randint(-1, 1)))
-            safety_score = calculate_safety_score_from_aqi(predicted_aqi)
-            safety_level = get_safety_level(safety_score)
-            
-            future_data.append({
-                'date': future_date.strftime('%Y-%m-%d'),
-                'predicted_aqi': predicted_aqi,
-                'safety_score': safety_score,
-                'safety_level': safety_level
-            })
-            
-        return Response({'future_air_quality': future_data})
+        cell = location_cell(lat, lon)
+        forecast = get_cached_forecast(cell)
+        if forecast is None:
+            forecast = build_forecast(cell, get_forecast_data(lat, lon))
+        return Response(format_air_quality_forecast(forecast, days))
+
+@timed('get_forecast_data')
+def get_forecast_data(lat, lon):
+    """تنبؤ WeatherAPI لسبعة أيام مع جودة الهواء، مخزن لكل خلية حتى التحديث التالي"""
+    api_key = settings.WEATHER_API_KEY
+    if not api_key:
+        record_fallback('weatherapi_forecast', 'missing_key')
+        return {'error': 'WEATHER_API_KEY not configured'}
+    url = upstream_url('weatherapi', f"forecast.json?key={api_key}&q={lat},{lon}&days=7&aqi=yes")
+    data = cached_fetch('forecast', lat, lon, lambda: safe_request(url, provider='weatherapi'),
+                        on_store=lambda data: record_observation(lat, lon, 'current_aqi', data))
+    if 'error' in data:
+        record_fallback('weatherapi_forecast', data.get('cause', 'error'))
+    return data
+
+FORECAST_DAY_FIELDS = ('date', 'date_epoch', 'day', 'astro', 'hour')
+
+def validate_forecast_fields(value):
+    """
+    التحقق من ?fields= لـ forecastday (مثل date,day.maxtemp_c)، ترفع ValueError للحقول غير المعروفة
+    الاختيار نفسه يتم عند تحويل الرد إلى JSON (app/renderers.py)
+    """
+    fields = parse_fields(value) or {}
+    unknown = [field for field in fields if field not in FORECAST_DAY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)} (allowed: {', '.join(FORECAST_DAY_FIELDS)})")
+
+def slice_forecast_days(forecast_data, days):
+    """أول days من forecastday بدون نسخ الرد المخزن"""
+    return forecast_data.get('forecast', {}).get('forecastday', [])[:days]
+
+def format_air_quality_forecast(forecast, days):
+    """رد FutureAirQuality من نتيجة محرك التنبؤ (app/forecast.py) مقتطعة إلى days"""
+    future_data = []
+    for date, predicted_aqi in list(zip(forecast['dates'], forecast['aqi']))[:days]:
+        safety_score = calculate_safety_score_from_aqi(predicted_aqi)
+        future_data.append({
+            'date': date,
+            'predicted_aqi': predicted_aqi,
+            'safety_score': safety_score,
+            'safety_level': get_safety_level(safety_score)
+        })
+    return {'future_air_quality': future_data, 'inputs': forecast['inputs']}
 
 class SafetyScoreAPIView(APIView):
+    @cell_conditional('current_aqi')
     def get(self, request):
         lat = request.query_params.get('lat')
         lon = request.query_params.get('lon')
@@ -373,6 +600,191 @@ class SafetyScoreAPIView(APIView):
             'air_quality_index': air_quality
         })
 
+class BatchSafetyScoreAPIView(APIView):
+    """درجات السلامة لقائمة نقاط، تُرسل كسطور NDJSON بمجرد انتهاء كل خلية"""
+    def post(self, request):
+        points = request.data.get('points') if isinstance(request.data, dict) else request.data
+        config = settings.BATCH_SCORING
+        
+        if not isinstance(points, list) or not points:
+            return Response({'error': 'A non-empty list of points is required.'}, 
+                          status=status.HTTP_400_BAD_REQUEST)
+        if len(points) > config['MAX_POINTS']:
+            return Response({'error': f"At most {config['MAX_POINTS']} points per batch."}, 
+                          status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            coordinates = [parse_batch_point(point) for point in points]
+        except (TypeError, ValueError, KeyError, IndexError):
+            return Response({'error': 'Each point needs a valid lat and lon.'}, 
+                          status=status.HTTP_400_BAD_REQUEST)
+
+        return streaming_response(request, stream_batch_safety_scores(coordinates), 'application/x-ndjson')
+
+def streaming_response(request, iterator, content_type):
+    """
+    StreamingHttpResponse ترسل كل جزء فور توفره في WSGI وASGI
+    تحت ASGI يمرر المولد كـ async iterator، وإلا يجمعه Django كاملاً قبل الإرسال
+    """
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        iterator = aiterate(iterator)
+    return StreamingHttpResponse(iterator, content_type=content_type)
+
+def parse_batch_point(point):
+    """نقطة بصيغة {'lat', 'lon'} أو [lat, lon]"""
+    if isinstance(point, dict):
+        return float(point['lat']), float(point['lon'])
+    return float(point[0]), float(point[1])
+
+def batch_result_lines(coordinates, indexes, cell, aqi, estimated, error=None):
+    safety_score = calculate_safety_score_from_aqi(aqi)
+    safety_level = get_safety_level(safety_score)
+    for index in indexes:
+        lat, lon = coordinates[index]
+        record = {
+            'index': index,
+            'lat': lat,
+            'lon': lon,
+            'cell': cell,
+            'air_quality_index': aqi,
+            'safety_score': safety_score,
+            'safety_level': safety_level,
+            'estimated': estimated,
+        }
+        if error:
+            record['error'] = error
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+def stream_batch_safety_scores(coordinates):
+    """
+    تجميع النقاط حسب الخلية المكانية وجلب الخلايا بالتوازي
+    الخلايا المخزنة تُرسل مباشرة، والباقي فور انتهائه، وعدد استدعاءات المصدر لكل دفعة محدود
+    عند انتهاء المهلة أو انقطاع العميل تُلغى الاستدعاءات التي لم تبدأ حتى لا تشغل مجمع الـ threads
+    """
+    config = settings.BATCH_SCORING
+    cells = {}
+    for index, (lat, lon) in enumerate(coordinates):
+        cells.setdefault(location_cell(lat, lon), []).append(index)
+
+    executor = get_executor()
+    futures = {}
+    cached = []
+    over_budget = []
+    upstream_calls = 0
+    lookup = quota.with_priority(quota.BATCH, get_combined_air_quality)
+    for cell, indexes in cells.items():
+        lat, lon = coordinates[indexes[0]]
+        if is_cached('current_aqi', lat, lon):
+            cached.append(cell)
+        elif upstream_calls >= config['MAX_UPSTREAM_CALLS']:
+            over_budget.append(cell)
+        else:
+            upstream_calls += 1
+            # نسخ السياق كما في gather حتى تظهر استدعاءات الدفعة في Server-Timing
+            futures[executor.submit(contextvars.copy_context().run, lookup, lat, lon)] = cell
+
+    try:
+        for cell in cached:
+            lat, lon = coordinates[cells[cell][0]]
+            yield from batch_result_lines(coordinates, cells[cell], cell, lookup(lat, lon).get('aqi', 3), False)
+        for cell in over_budget:
+            yield from batch_result_lines(coordinates, cells[cell], cell, 3, True,
+                                          'Upstream call budget for this batch exhausted.')
+        try:
+            for future in as_completed(futures, timeout=config['DEADLINE']):
+                cell = futures.pop(future)
+                try:
+                    yield from batch_result_lines(coordinates, cells[cell], cell, future.result().get('aqi', 3), False)
+                except Exception as e:
+                    logger.error(f"Batch air quality error for {cell}: {e}")
+                    yield from batch_result_lines(coordinates, cells[cell], cell, 3, True, 'Lookup failed.')
+        except FuturesTimeoutError:
+            logger.warning(f"Batch deadline reached with {len(futures)} cells pending, using estimates")
+            for cell in list(futures.values()):
+                yield from batch_result_lines(coordinates, cells[cell], cell, 3, True, 'Lookup timed out.')
+    finally:
+        for future in futures:
+            future.cancel()
+
+class HeatmapTileAPIView(APIView):
+    """درجات السلامة على tile خريطة z/x/y، بصيغة PNG ملونة أو مصفوفة بايتات (.bin)"""
+    # الصيغة من امتداد المسار، وAccept: image/png من عملاء الخرائط لا يرفض بـ 406
+    content_negotiation_class = FixedContentNegotiation
+
+    def get(self, request, z, x, y, fmt):
+        config = heatmap.get_heatmap_config()
+        if fmt not in heatmap.FORMATS:
+            return Response({'error': f"Format must be one of: {', '.join(heatmap.FORMATS)}."},
+                          status=status.HTTP_400_BAD_REQUEST)
+        if not heatmap.valid_tile(z, x, y, config):
+            return Response({'error': f"Tile must be within zoom {config['MIN_ZOOM']}-{config['MAX_ZOOM']}."},
+                          status=status.HTTP_400_BAD_REQUEST)
+        try:
+            size = int(request.query_params.get('size', config['SIZE']))
+        except ValueError:
+            size = None
+        if size not in config['SIZES']:
+            return Response({'error': f"Size must be one of: {', '.join(map(str, config['SIZES']))}."},
+                          status=status.HTTP_400_BAD_REQUEST)
+
+        tile = heatmap.get_cached_tile(z, x, y, size, config)
+        if tile is None:
+            tile = build_heatmap_tile(z, x, y, size, config)
+        return heatmap_response(request, tile, fmt)
+
+def get_cells_air_quality(cells, points, max_calls, deadline):
+    """
+    (aqi, expiries) لكل خلية، والخلايا المخزنة تقرأ بطلب واحد للذاكرة المؤقتة
+    حتى max_calls خلية غير مخزنة تجلب بالتوازي، والخلايا التي بقيت بدون بيانات قيمتها NaN
+    """
+    entries = get_entries('current_aqi', cells)
+    aqi = np.full(len(cells), np.nan)
+    for index, cell in enumerate(cells):
+        if cell in entries:
+            aqi[index] = parse_air_quality(entries[cell]['data'])['aqi']
+
+    missing = [index for index, cell in enumerate(cells) if cell not in entries][:max_calls]
+    if missing:
+        calls = {index: (get_combined_air_quality, points[index]) for index in missing}
+        with quota.priority(quota.BATCH):
+            results, pending = gather(calls, deadline)
+        if pending:
+            logger.info(f"Heatmap tile left {len(pending)}/{len(calls)} cells pending, they fill in later")
+        # القيمة الافتراضية عند فشل المصدر لا تخزن، فتعتمد فقط الخلايا التي خزن ردها
+        fetched = get_entries('current_aqi', [cells[index] for index in results])
+        for index, result in results.items():
+            if cells[index] in fetched:
+                aqi[index] = result['aqi']
+                entries[cells[index]] = fetched[cells[index]]
+    return aqi, [entry['expires_at'] for entry in entries.values()]
+
+def build_heatmap_tile(z, x, y, size, config):
+    lats, lons = heatmap.tile_grid(z, x, y, size)
+    cells, points, inverse = heatmap.tile_cells(lats, lons)
+    aqi, expiries = get_cells_air_quality(cells, points, config['MAX_UPSTREAM_CALLS'], config['DEADLINE'])
+    no_data = np.isnan(aqi)
+    scores = np.where(no_data, heatmap.NO_DATA, safety_scores_from_aqi(aqi))[inverse]
+    missing = int(no_data.sum())
+    return heatmap.cache_tile(z, x, y, size, scores, missing, heatmap.tile_ttl(expiries, missing, config), config)
+
+def heatmap_response(request, tile, fmt):
+    scores = heatmap.tile_scores(tile)
+    if fmt == 'png':
+        body = heatmap.encode_png(safety_level_indexes(scores), scores == heatmap.NO_DATA)
+    else:
+        body = scores.tobytes()
+    response = HttpResponse(body, content_type=heatmap.FORMATS[fmt])
+    etag = quote_etag(f"{tile['etag']}-{fmt}")
+    response['ETag'] = etag
+    response['X-Heatmap-Size'] = tile['size']
+    response['X-Heatmap-Missing-Cells'] = tile['missing']
+    max_age = max(0, int(tile['expires_at'] - time.time()))
+    if get_conditional_get_config()['PUBLIC']:
+        patch_cache_control(response, public=True, max_age=max_age)
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+    return get_conditional_response(request, etag=etag, response=response)
+
 class BestRouteAPIView(APIView):
     def get(self, request):
         start_lat = request.query_params.get('start_lat')
@@ -418,14 +830,7 @@ class NearestSafeLocationAPIView(APIView):
             return Response({'error': 'Invalid Latitude or Longitude.'}, 
                           status=status.HTTP_400_BAD_REQUEST)
 
-        # مواقع افتراضية حول الموقع الحالي
-        safe_locations = [
-            (lat + 0.01, lon + 0.01),
-            (lat - 0.01, lon - 0.01),
-            (lat + 0.02, lon - 0.02),
-            (lat - 0.02, lon + 0.02),
-        ]
-        
+        candidates, safe_locations = get_safe_location_candidates(lat, lon)
         nearest_location = find_nearest_safe_location(lat, lon, safe_locations)
         
         if not nearest_location:
@@ -434,18 +839,45 @@ class NearestSafeLocationAPIView(APIView):
             
         # حساب درجة السلامة للموقع الآمن
         loc_air_quality = get_combined_air_quality(nearest_location[0], nearest_location[1]).get('aqi', 3)
-        safety_score = calculate_safety_score_from_aqi(loc_air_quality)
-        safety_level = get_safety_level(safety_score)
-            
-        return Response({
-            'nearest_safe_location': {
-                'lat': nearest_location[0], 
-                'lon': nearest_location[1],
-                'safety_score': safety_score,
-                'safety_level': safety_level,
-                'air_quality_index': loc_air_quality
-            }
-        })
+        return Response({'nearest_safe_location': describe_safe_location(nearest_location, loc_air_quality, candidates)})
+
+def get_safe_location_candidates(lat, lon):
+    """أقرب المواقع الآمنة الحقيقية من الفهرس المكاني، ثم جودة الهواء لأفضل k فقط"""
+    candidates = []
+    try:
+        config = get_safe_locations_config()
+        candidates = get_safe_location_index().nearest(lat, lon, config['K'], config['MAX_RADIUS'])
+    except Exception as e:
+        logger.error(f"Safe location index error: {e}")
+
+    if candidates:
+        return candidates, [(c['lat'], c['lon']) for c in candidates]
+    # مواقع افتراضية حول الموقع الحالي
+    return candidates, [
+        (lat + 0.01, lon + 0.01),
+        (lat - 0.01, lon - 0.01),
+        (lat + 0.02, lon - 0.02),
+        (lat - 0.02, lon + 0.02),
+    ]
+
+def describe_safe_location(location, aqi, candidates):
+    safety_score = calculate_safety_score_from_aqi(aqi)
+    result = {
+        'lat': location[0], 
+        'lon': location[1],
+        'safety_score': safety_score,
+        'safety_level': get_safety_level(safety_score),
+        'air_quality_index': aqi
+    }
+    for candidate in candidates:
+        if (candidate['lat'], candidate['lon']) == location:
+            result.update({
+                'name': candidate['name'],
+                'category': candidate['category'],
+                'distance': round(candidate['distance']),
+            })
+            break
+    return result
 
 class ComprehensiveSafetyAPIView(APIView):
     def get(self, request):
@@ -463,20 +895,32 @@ class ComprehensiveSafetyAPIView(APIView):
             return Response({'error': 'Invalid Latitude or Longitude.'}, 
                           status=status.HTTP_400_BAD_REQUEST)
 
-        air_quality = get_combined_air_quality(lat, lon).get('aqi', 3)
+        # الاستدعاءان بالتوازي: زمن الرد هو الأبطأ منهما وليس مجموعهما
+        results, pending = gather({
+            'air_quality': (get_combined_air_quality, (lat, lon)),
+            'nasa': (get_nasa_earth_data, (lat, lon)),
+        }, settings.COMPREHENSIVE_SAFETY['DEADLINE'])
+        if pending:
+            logger.warning(f"Comprehensive safety lookups timed out: {', '.join(sorted(pending))}")
+            if 'nasa' in pending:
+                record_fallback('nasa', 'timeout')
+
+        air_quality = results.get('air_quality', {}).get('aqi', 3)
         safety_score = calculate_safety_score_from_aqi(air_quality)
         safety_level = get_safety_level(safety_score)
-        nasa_data = get_nasa_earth_data(lat, lon)
+        nasa_data = results.get('nasa') or get_fallback_nasa_data(lat, lon)
 
         return Response({
             'air_quality_index': air_quality,
             'safety_score': safety_score,
             'safety_level': safety_level,
             'nasa_earth_data': nasa_data,
+            'surface_temperature': surface_temperature(lat, lon),
             'location': {'lat': lat, 'lon': lon}
         })
 
 class WeatherAPIView(APIView):
+    @cell_conditional('current')
     def get(self, request):
         lat = request.query_params.get('lat')
         lon = request.query_params.get('lon')
@@ -496,6 +940,7 @@ class WeatherAPIView(APIView):
         return Response(weather_data)
 
 class FutureWeatherAPIView(APIView):
+    @cell_conditional('forecast')
     def get(self, request):
         lat = request.query_params.get('lat')
         lon = request.query_params.get('lon')
@@ -516,20 +961,22 @@ class FutureWeatherAPIView(APIView):
                           status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            api_key = settings.WEATHER_API_KEY
-            if not api_key:
-                return self.get_fallback_weather_forecast(days)
-                
-            url = f"http://api.weatherapi.com/v1/forecast.json?key={api_key}&q={lat},{lon}&days={days}"
-            weather_data = safe_request(url)
+            validate_forecast_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # جلب واحد لسبعة أيام لكل خلية، ثم اقتطاع days
+            weather_data = get_forecast_data(lat, lon)
             
             if 'error' in weather_data:
                 return self.get_fallback_weather_forecast(days)
                 
-            return Response(weather_data.get('forecast', {}).get('forecastday', []))
+            return Response(slice_forecast_days(weather_data, days))
             
         except Exception as e:
             logger.error(f"Future weather error: {e}")
+            record_fallback('weatherapi_forecast', 'error')
             return self.get_fallback_weather_forecast(days)
 
     def get_fallback_weather_forecast(self, days):
@@ -552,34 +999,192 @@ class FutureWeatherAPIView(APIView):
         return Response(forecast)
 
 # AI ADVICE - الإصدار المصحح مع Safety Score 100
-try:
-    import google.generativeai as genai
-    if hasattr(settings, 'GOOGLE_API_KEY') and settings.GOOGLE_API_KEY:
-        genai.configure(api_key=settings.GOOGLE_API_KEY)
-        GEMINI_AVAILABLE = True
-        logger.info("✅ Gemini API configured successfully")
-        
-        # اختبر النماذج المتاحة
-        try:
-            models = genai.list_models()
-            available_models = [model.name for model in models]
-            logger.info(f"Available models: {available_models}")
-        except Exception as e:
-            logger.warning(f"Could not list models: {e}")
+GEMINI_MODELS = ['gemini-pro', 'gemini-2.5-flash']
+
+def build_advice_context(lat, lon, aqi, safety_score, safety_level, weather_data):
+    """إنشاء السياق المرسل إلى Gemini"""
+    return f"""
+            الموقع: خط العرض {lat}, خط الطول {lon}
+            درجة السلامة: {safety_score}/100 - {safety_level}
+            جودة الهواء: {aqi}/5 (1=ممتاز, 5=خطير)
+            حالة الطقس: {weather_data.get('current', {}).get('condition', {}).get('text', 'غير معروف')}
+            درجة الحرارة: {weather_data.get('current', {}).get('temp_c', 'غير معروف')}°C
+            الرطوبة: {weather_data.get('current', {}).get('humidity', 'غير معروف')}%
             
-    else:
-        GEMINI_AVAILABLE = False
-        logger.warning("❌ Google API key not configured")
-except ImportError:
-    GEMINI_AVAILABLE = False
-    logger.warning("❌ google-generativeai library not installed")
-except Exception as e:
-    GEMINI_AVAILABLE = False
-    logger.error(f"❌ Error configuring Gemini: {e}")
+            قدم نصائح عملية للسلامة البيئية والصحية بناءً على هذه البيانات. 
+            ركز على:
+            - نصائح لأصحاب الأمراض المزمنة وكبار السن والأطفال
+            - اقتراحات لتحسين جودة الهواء وتلطيف درجة الحرارة
+            - تشجيع زراعة النباتات للتقليل من التلوث
+            - نصائح للتعامل مع الزحام المروري
+            كن ودوداً واستخدم لغة بسيطة واضحة وغير معقدة.
+            تكلم لالغة التي يقدمهالالك المستخدم. انجليزية فقط
+            """
+
+_active_model = None
+_failed_models = {}
+_model_lock = threading.Lock()
+
+def gemini_model_candidates():
+    """
+    النموذج الذي نجح آخر مرة أولاً، ثم بقية النماذج بالترتيب
+    النماذج التي فشلت مؤخراً تؤجل إلى النهاية حتى تنتهي فترة التهدئة
+    """
+    active = _active_model
+    if active is not None:
+        yield active
+    now = time.monotonic()
+    remaining = [name for name in GEMINI_MODELS if active is None or name != active[0]]
+    remaining.sort(key=lambda name: _failed_models.get(name, 0) > now)
+    genai = get_genai()
+    for name in remaining:
+        yield name, genai.GenerativeModel(name)
+
+def remember_gemini_model(name, model):
+    global _active_model
+    with _model_lock:
+        if _active_model is None or _active_model[0] != name:
+            logger.info(f"✅ Using Gemini model: {name}")
+        _active_model = (name, model)
+        _failed_models.pop(name, None)
+
+def forget_gemini_model(name):
+    global _active_model
+    with _model_lock:
+        if _active_model is not None and _active_model[0] == name:
+            _active_model = None
+        _failed_models[name] = time.monotonic() + getattr(settings, 'GEMINI_MODEL_COOLDOWN', 300)
+
+@timed('generate_content')
+def generate_advice(full_prompt):
+    """توليد النصيحة بالنموذج الناجح آخر مرة، مع الانتقال للبدائل عند الفشل"""
+    for name, model in gemini_model_candidates():
+        try:
+            quota.acquire('gemini')
+            advice = model.generate_content(full_prompt).text
+            if advice:
+                remember_gemini_model(name, model)
+                return advice
+        except QuotaExceededError:
+            # الميزانية مشتركة بين النماذج، فلا فائدة من تجربة البدائل
+            raise
+        except Exception as model_error:
+            logger.warning(f"Model {name} failed, trying alternatives: {model_error}")
+        forget_gemini_model(name)
+    raise Exception("All Gemini models failed")
+
+def generate_advice_stream(full_prompt):
+    """توليد النصيحة كأجزاء متتالية فور وصولها من Gemini"""
+    for name, model in gemini_model_candidates():
+        started = False
+        try:
+            quota.acquire('gemini')
+            for chunk in model.generate_content(full_prompt, stream=True):
+                if chunk.text:
+                    started = True
+                    yield chunk.text
+            if started:
+                remember_gemini_model(name, model)
+                return
+        except QuotaExceededError:
+            raise
+        except Exception as model_error:
+            # بعد بدء الإرسال لا يمكن التبديل لنموذج آخر
+            if started:
+                raise
+            logger.warning(f"Model {name} failed, trying alternatives: {model_error}")
+        forget_gemini_model(name)
+    raise Exception("All Gemini models failed")
+
+_advice_cache = LRUCache(
+    settings.ADVICE_CACHE['MAX_ENTRIES'], settings.ADVICE_CACHE['TTL']
+)
+
+def advice_cache_key(prompt, aqi, safety_level, weather_data):
+    """مفتاح الذاكرة المؤقتة: الطلب مع ظروف مجمعة في فئات بدلاً من الإحداثيات"""
+    config = settings.ADVICE_CACHE
+    current = weather_data.get('current', {})
+    temp = current.get('temp_c')
+    humidity = current.get('humidity')
+    temp_band = int(temp // config['TEMP_BAND']) if isinstance(temp, (int, float)) else None
+    humidity_band = int(humidity // config['HUMIDITY_BAND']) if isinstance(humidity, (int, float)) else None
+    condition = str(current.get('condition', {}).get('text', '')).strip().lower()
+    return (' '.join(prompt.split()), aqi, safety_level, temp_band, humidity_band, condition)
+
+def get_cached_advice(key):
+    return _advice_cache.get(key)
+
+def cache_advice(key, advice):
+    _advice_cache.set(key, advice)
+
+def wants_advice_stream(data, params):
+    value = data.get('stream') if isinstance(data, dict) else None
+    if value is None:
+        value = params.get('stream', '')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def advice_stream_response(request, lat, lon, prompt, fallback_advice):
+    response = streaming_response(request, stream_advice_events(lat, lon, prompt, fallback_advice),
+                                  'text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_advice_events(lat, lon, prompt, fallback_advice):
+    """
+    أحداث SSE: فتح الاتصال فوراً، ثم السياق (درجة السلامة، AQI، الطقس)، ثم أجزاء النصيحة
+    """
+    yield ": stream opened\n\n"
+    try:
+        air_quality_data = get_combined_air_quality(lat, lon)
+        weather_data = get_weather_api_data(lat, lon)
+
+        aqi = air_quality_data.get('aqi', 3)
+        safety_score = calculate_safety_score_from_aqi(aqi)
+        safety_level = get_safety_level(safety_score)
+        current = weather_data.get('current', {})
+        yield sse_event('context', {
+            'safety_score': safety_score,
+            'safety_level': safety_level,
+            'air_quality_index': aqi,
+            'weather': {
+                'condition': current.get('condition', {}).get('text'),
+                'temp_c': current.get('temp_c'),
+                'humidity': current.get('humidity'),
+            },
+            'location': {'lat': lat, 'lon': lon}
+        })
+
+        cache_key = advice_cache_key(prompt, aqi, safety_level, weather_data)
+        cached_advice = get_cached_advice(cache_key)
+        if cached_advice is not None:
+            yield sse_event('token', {'text': cached_advice, 'cached': True})
+        else:
+            context = build_advice_context(lat, lon, aqi, safety_score, safety_level, weather_data)
+            parts = []
+            try:
+                for text in generate_advice_stream(context + "\n\n" + prompt):
+                    parts.append(text)
+                    yield sse_event('token', {'text': text})
+                cache_advice(cache_key, ''.join(parts))
+            except Exception as e:
+                logger.error(f"Gemini model error: {e}")
+                record_fallback('gemini', fallback_cause(e))
+                yield sse_event('fallback', {'advice': fallback_advice})
+
+    except Exception as e:
+        logger.error(f"AI Advice error: {e}")
+        record_fallback('gemini', 'error')
+        yield sse_event('error', {'error': str(e), 'advice': fallback_advice})
+    yield sse_event('done', {})
 
 class AIAdviceAPIView(APIView):
     def post(self, request):
-        if not GEMINI_AVAILABLE:
+        if not gemini_available():
+            record_fallback('gemini', 'missing_key')
             return Response({
                 'error': 'Gemini API is not configured or unavailable.',
                 'advice': self.get_fallback_advice()
@@ -604,6 +1209,10 @@ class AIAdviceAPIView(APIView):
                 'advice': self.get_fallback_advice()
             }, status=status.HTTP_400_BAD_REQUEST)
 
+        # وضع البث الاختياري (stream=true): أحداث SSE بدلاً من رد JSON واحد
+        if wants_advice_stream(request.data, request.query_params):
+            return advice_stream_response(request, lat, lon, prompt, self.get_fallback_advice())
+
         try:
             # جمع البيانات
             air_quality_data = get_combined_air_quality(lat, lon)
@@ -613,58 +1222,26 @@ class AIAdviceAPIView(APIView):
             safety_score = calculate_safety_score_from_aqi(aqi)
             safety_level = get_safety_level(safety_score)
             
-            # إنشاء السياق
-            context = f"""
-            الموقع: خط العرض {lat}, خط الطول {lon}
-            درجة السلامة: {safety_score}/100 - {safety_level}
-            جودة الهواء: {aqi}/5 (1=ممتاز, 5=خطير)
-            حالة الطقس: {weather_data.get('current', {}).get('condition', {}).get('text', 'غير معروف')}
-            درجة الحرارة: {weather_data.get('current', {}).get('temp_c', 'غير معروف')}°C
-            الرطوبة: {weather_data.get('current', {}).get('humidity', 'غير معروف')}%
-            
-            قدم نصائح عملية للسلامة البيئية والصحية بناءً على هذه البيانات. 
-            ركز على:
-            - نصائح لأصحاب الأمراض المزمنة وكبار السن والأطفال
-            - اقتراحات لتحسين جودة الهواء وتلطيف درجة الحرارة
-            - تشجيع زراعة النباتات للتقليل من التلوث
-            - نصائح للتعامل مع الزحام المروري
-            كن ودوداً واستخدم لغة بسيطة واضحة وغير معقدة.
-            تكلم لالغة التي يقدمهالالك المستخدم. انجليزية فقط
-            """
+            # نفس الطلب بنفس الظروف تقريباً يُخدم من الذاكرة المؤقتة
+            cache_key = advice_cache_key(prompt, aqi, safety_level, weather_data)
+            advice = get_cached_advice(cache_key)
+            cached = advice is not None
 
-            # استخدام Gemini API مع النموذج الصحيح
-            try:
-                # جرب النماذج المختلفة
-                model_name = 'gemini-pro'
+            if not cached:
+                context = build_advice_context(lat, lon, aqi, safety_score, safety_level, weather_data)
+
+                # استخدام Gemini API مع النموذج الصحيح
                 try:
-                    model = genai.GenerativeModel(model_name)   
-                    response = model.generate_content(context + "\n\n" + prompt)
-                    advice = response.text
-                except Exception as model_error:
-                    logger.warning(f"Model {model_name} failed, trying alternatives: {model_error}")
-                    # جرب النماذج البديلة
-                    alternative_models = ['gemini-2.5-flash']
-                    advice = None
-                    
-                    for alt_model in alternative_models:
-                        try:
-                            model = genai.GenerativeModel(alt_model)
-                            response = model.generate_content(context + "\n\n" + prompt)
-                            advice = response.text
-                            logger.info(f"✅ Success with model: {alt_model}")
-                            break
-                        except Exception:
-                            continue
-                    
-                    if not advice:
-                        raise Exception("All Gemini models failed")
-                
-            except Exception as e:
-                logger.error(f"Gemini model error: {e}")
-                advice = self.get_fallback_advice()
+                    advice = generate_advice(context + "\n\n" + prompt)
+                    cache_advice(cache_key, advice)
+                except Exception as e:
+                    logger.error(f"Gemini model error: {e}")
+                    record_fallback('gemini', fallback_cause(e))
+                    advice = self.get_fallback_advice()
             
             return Response({
                 'advice': advice,
+                'cached': cached,
                 'safety_score': safety_score,
                 'safety_level': safety_level,
                 'air_quality_index': aqi,
@@ -673,6 +1250,7 @@ class AIAdviceAPIView(APIView):
             
         except Exception as e:
             logger.error(f"AI Advice error: {e}")
+            record_fallback('gemini', 'error')
             return Response({
                 'error': str(e),
                 'advice': self.get_fallback_advice()
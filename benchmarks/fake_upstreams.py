@@ -0,0 +1,286 @@
+"""
+Local stand-ins for WeatherAPI, TomTom, NASA CMR and Gemini.
+
+One HTTP server answers all four by path, with a configurable latency and
+error profile per provider. Point the app at it through the base URL settings
+(see FakeUpstreams.env()):
+
+    python benchmarks/fake_upstreams.py --port 8900 --profile realistic
+    python benchmarks/fake_upstreams.py --profile my_profile.json
+
+A profile maps provider -> {latency_ms, jitter_ms, error_rate, timeout_rate,
+timeout_ms}; missing keys fall back to the "fast" preset.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+PROVIDERS = ('weatherapi', 'tomtom', 'nasa', 'gemini')
+
+PROFILES = {
+    'fast': {provider: {'latency_ms': 5, 'jitter_ms': 2} for provider in PROVIDERS},
+    'realistic': {
+        'weatherapi': {'latency_ms': 120, 'jitter_ms': 40, 'error_rate': 0.01},
+        'tomtom': {'latency_ms': 250, 'jitter_ms': 80, 'error_rate': 0.01},
+        'nasa': {'latency_ms': 600, 'jitter_ms': 300, 'error_rate': 0.02},
+        'gemini': {'latency_ms': 1500, 'jitter_ms': 500, 'error_rate': 0.02},
+    },
+    'degraded': {
+        'weatherapi': {'latency_ms': 800, 'jitter_ms': 400, 'error_rate': 0.2, 'timeout_rate': 0.05},
+        'tomtom': {'latency_ms': 1200, 'jitter_ms': 400, 'error_rate': 0.2, 'timeout_rate': 0.05},
+        'nasa': {'latency_ms': 3000, 'jitter_ms': 1000, 'error_rate': 0.3, 'timeout_rate': 0.1},
+        'gemini': {'latency_ms': 4000, 'jitter_ms': 1000, 'error_rate': 0.2},
+    },
+}
+
+PROFILE_DEFAULTS = {'latency_ms': 5, 'jitter_ms': 0, 'error_rate': 0.0, 'timeout_rate': 0.0, 'timeout_ms': 15000}
+
+
+def load_profile(name_or_path):
+    if name_or_path in PROFILES:
+        profile = PROFILES[name_or_path]
+    else:
+        with open(name_or_path) as f:
+            profile = json.load(f)
+    return {provider: {**PROFILE_DEFAULTS, **profile.get(provider, {})} for provider in PROVIDERS}
+
+
+def provider_for_path(path):
+    if path.startswith('/v1beta/'):
+        return 'gemini'
+    if path.startswith('/v1/'):
+        return 'weatherapi'
+    if path.startswith('/routing/'):
+        return 'tomtom'
+    if path.startswith('/search/'):
+        return 'nasa'
+    return None
+
+
+def parse_q(query):
+    lat, lon = query.get('q', ['30,31'])[0].split(',')
+    return float(lat), float(lon)
+
+
+def weather_current(query):
+    lat, lon = parse_q(query)
+    seed = int(abs(lat * 100) + abs(lon * 100))
+    return {
+        'location': {'lat': lat, 'lon': lon, 'name': 'Benchmark'},
+        'current': {
+            'last_updated_epoch': int(time.time()) - 60,
+            'temp_c': 18 + seed % 15,
+            'humidity': 30 + seed % 50,
+            'wind_kph': 5 + seed % 20,
+            'condition': {'text': ('Sunny', 'Partly cloudy', 'Overcast', 'Mist')[seed % 4]},
+            'air_quality': {'us-epa-index': 1 + seed % 6, 'pm2_5': 5.0 + seed % 60, 'pm10': 10.0 + seed % 90},
+        },
+    }
+
+
+def weather_hour(day, hour, seed):
+    # نفس شكل عنصر hour في WeatherAPI تقريباً، وهو الجزء الأكبر من رد forecast.json
+    epoch = int(datetime(day.year, day.month, day.day, hour).timestamp())
+    return {
+        'time_epoch': epoch, 'time': f'{day.isoformat()} {hour:02d}:00',
+        'temp_c': 18 + (seed + hour) % 12, 'temp_f': 64.4 + (seed + hour) % 12 * 1.8, 'is_day': int(6 <= hour < 18),
+        'condition': {'text': 'Partly cloudy', 'icon': '//cdn.weatherapi.com/weather/64x64/day/116.png', 'code': 1003},
+        'wind_mph': 6.3, 'wind_kph': 10.1, 'wind_degree': 200, 'wind_dir': 'SSW', 'pressure_mb': 1014.0,
+        'pressure_in': 29.94, 'precip_mm': 0.0, 'precip_in': 0.0, 'humidity': 40 + hour, 'cloud': 25,
+        'feelslike_c': 19.2, 'feelslike_f': 66.6, 'windchill_c': 19.2, 'heatindex_c': 19.2, 'dewpoint_c': 8.1,
+        'will_it_rain': 0, 'chance_of_rain': 0, 'vis_km': 10.0, 'gust_kph': 14.6, 'uv': 4.0,
+        'air_quality': {'co': 230.3, 'no2': 12.1, 'o3': 60.0, 'so2': 3.2, 'pm2_5': 5.0 + seed % 60,
+                        'pm10': 10.0 + seed % 90, 'us-epa-index': 1 + (seed + hour // 8) % 6, 'gb-defra-index': 2},
+    }
+
+
+def weather_forecast(query):
+    days = int(query.get('days', ['3'])[0])
+    today = datetime.utcnow().date()
+    current = weather_current(query)
+    seed = int(current['current']['temp_c'])
+    forecast_days = []
+    for i in range(days):
+        day = today + timedelta(days=i)
+        forecast_days.append({
+            'date': day.isoformat(),
+            'date_epoch': int(datetime(day.year, day.month, day.day).timestamp()),
+            'day': {'maxtemp_c': 28 + i, 'mintemp_c': 18 + i, 'avghumidity': 50, 'maxwind_kph': 12.0 + i,
+                    'totalprecip_mm': 0.0, 'condition': {'text': 'Sunny'}},
+            'astro': {'sunrise': '06:05 AM', 'sunset': '05:32 PM', 'moon_phase': 'Waxing Gibbous'},
+            'hour': [weather_hour(day, hour, seed + i) for hour in range(24)],
+        })
+    return {**current, 'forecast': {'forecastday': forecast_days}}
+
+
+def tomtom_route(path):
+    coordinates = path.split('/calculateRoute/')[1].split('/')[0]
+    (lat1, lon1), (lat2, lon2) = [map(float, point.split(',')) for point in coordinates.split(':')]
+    routes = []
+    for offset in (0.0, 0.01, -0.01):
+        points = [
+            {'latitude': lat1 + (lat2 - lat1) * i / 20 + offset * (1 - abs(10 - i) / 10),
+             'longitude': lon1 + (lon2 - lon1) * i / 20}
+            for i in range(21)
+        ]
+        routes.append({
+            'summary': {'lengthInMeters': 12000 + int(offset * 1e5), 'travelTimeInSeconds': 900},
+            'legs': [{'points': points}],
+        })
+    return {'routes': routes}
+
+
+def nasa_granules(query):
+    box = query.get('bounding_box', ['31,30,31,30'])[0]
+    return {'feed': {'entry': [{
+        'id': f'G_BENCH_{box}',
+        'title': 'MOD11A1.A2024001.h21v06.061',
+        'time_start': datetime.utcnow().isoformat() + 'Z',
+        'summary': 'Benchmark stand-in granule',
+    }]}}
+
+
+def gemini_candidate(text):
+    return {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'},
+                            'finishReason': 'STOP', 'index': 0}]}
+
+
+ADVICE = 'Stay hydrated, limit time outdoors during peak traffic hours and ventilate indoor spaces. '
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    server_version = 'FakeUpstream/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.handle_request()
+
+    def handle_request(self):
+        url = urlsplit(self.path)
+        provider = provider_for_path(url.path)
+        if provider is None:
+            return self.send_json(404, {'error': 'unknown path'})
+        profile = self.server.profiles[provider]
+        self.server.count(provider)
+
+        if random.random() < profile['timeout_rate']:
+            time.sleep(profile['timeout_ms'] / 1000)
+        else:
+            delay = max(0.0, random.gauss(profile['latency_ms'], profile['jitter_ms'] or 1e-9))
+            time.sleep(delay / 1000)
+        if random.random() < profile['error_rate']:
+            return self.send_json(503, {'error': {'code': 503, 'message': 'stand-in failure'}})
+
+        query = parse_qs(url.query)
+        if provider == 'weatherapi':
+            body = weather_forecast(query) if url.path.endswith('forecast.json') else weather_current(query)
+        elif provider == 'tomtom':
+            body = tomtom_route(url.path)
+        elif provider == 'nasa':
+            body = nasa_granules(query)
+        elif url.path.endswith(':streamGenerateContent'):
+            # REST streaming في Gemini مصفوفة JSON من الأجزاء
+            body = [gemini_candidate(word + ' ') for word in ADVICE.split()]
+        else:
+            body = gemini_candidate(ADVICE)
+        self.send_json(200, body)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, profiles):
+        super().__init__(address, FakeUpstreamHandler)
+        self.profiles = profiles
+        self.requests = {provider: 0 for provider in PROVIDERS}
+        self.requests_lock = threading.Lock()
+
+    def count(self, provider):
+        with self.requests_lock:
+            self.requests[provider] += 1
+
+
+class FakeUpstreams:
+    """تشغيل الخادم البديل في thread خلفي"""
+
+    def __init__(self, profile='fast', host='127.0.0.1', port=0):
+        self.server = FakeUpstreamServer((host, port), load_profile(profile))
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-upstreams', daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request_counts(self):
+        with self.server.requests_lock:
+            return dict(self.server.requests)
+
+    def env(self):
+        """متغيرات البيئة التي توجه التطبيق إلى هذا الخادم"""
+        return {
+            'AIR_API_KEY': 'benchmark',
+            'TOMTOM_API_KEY': 'benchmark',
+            'GOOGLE_API_KEY': 'benchmark',
+            'NASA_EARTHDATA_USERNAME': 'benchmark',
+            'NASA_EARTHDATA_PASSWORD': 'benchmark',
+            'WEATHER_API_BASE_URL': f'{self.base_url}/v1',
+            'TOMTOM_BASE_URL': self.base_url,
+            'NASA_CMR_BASE_URL': self.base_url,
+            'GEMINI_API_ENDPOINT': self.base_url,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--profile', default='realistic', help=f"preset ({', '.join(PROFILES)}) or JSON file")
+    args = parser.parse_args()
+
+    upstreams = FakeUpstreams(args.profile, args.host, args.port)
+    print(f"Fake upstreams on {upstreams.base_url}; export:")
+    for key, value in upstreams.env().items():
+        print(f"  export {key}={value}")
+    try:
+        upstreams.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(upstreams.request_counts()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Micro-benchmark: scalar calculate_distance vs the vectorized app.geo kernel.
+
+    python benchmarks/geo_distance.py [--sizes 10000 100000 1000000] [--repeat 3]
+"""
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from app import geo  # noqa: E402
+from app.views import calculate_distance  # noqa: E402
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"{'pairs':>10} {'scalar pairs/s':>16} {'numpy pairs/s':>16} {'speedup':>9} {'max abs err (m)':>16}")
+    for size in args.sizes:
+        # نقاط داخل نطاق مدينة تقريباً
+        lat1 = 30.0 + rng.random(size) * 0.5
+        lon1 = 31.0 + rng.random(size) * 0.5
+        lat2 = 30.0 + rng.random(size) * 0.5
+        lon2 = 31.0 + rng.random(size) * 0.5
+        pairs = list(zip(lat1.tolist(), lon1.tolist(), lat2.tolist(), lon2.tolist()))
+
+        scalar_time = best_of(args.repeat, lambda: [calculate_distance(*p) for p in pairs])
+        numpy_time = best_of(args.repeat, lambda: geo.haversine(lat1, lon1, lat2, lon2))
+        scalar_result = np.asarray([calculate_distance(*p) for p in pairs])
+        error = np.abs(geo.haversine(lat1, lon1, lat2, lon2) - scalar_result).max()
+
+        print(f"{size:>10} {size / scalar_time:>16,.0f} {size / numpy_time:>16,.0f} "
+              f"{scalar_time / numpy_time:>8.1f}x {error:>16.2e}")
+
+
+if __name__ == '__main__':
+    main()
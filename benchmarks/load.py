@@ -0,0 +1,352 @@
+"""
+Endpoint load benchmark against local stand-in upstreams.
+
+Starts benchmarks/fake_upstreams.py in-process, migrates a scratch SQLite
+database, boots the app under gunicorn (sync WSGI or uvicorn ASGI workers)
+pointed at the stand-ins, then drives every endpoint in app/urls.py at each
+concurrency level and reports throughput and p50/p95/p99 latency.
+
+    python benchmarks/load.py --concurrency 1 8 32 --duration 10
+    python benchmarks/load.py --server asgi --profile realistic --endpoints async_
+    python benchmarks/load.py --compare benchmarks/results/<old>.json
+
+Results are written as JSON to benchmarks/results/<git sha>[-label].json; pass
+--compare with an earlier file to print the deltas and exit non-zero when a
+p95 or throughput regression exceeds --threshold percent.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fake_upstreams import FakeUpstreams  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / 'benchmarks' / 'results'
+CENTER = (30.0444, 31.2357)
+
+
+def random_point(rng, spread):
+    return round(CENTER[0] + rng.uniform(-spread, spread), 5), round(CENTER[1] + rng.uniform(-spread, spread), 5)
+
+
+def location_params(rng, spread):
+    lat, lon = random_point(rng, spread)
+    return {'params': {'lat': lat, 'lon': lon}}
+
+
+def forecast_params(rng, spread):
+    request = location_params(rng, spread)
+    request['params']['days'] = rng.randint(1, 7)
+    return request
+
+
+def route_params(rng, spread):
+    (start_lat, start_lon), (end_lat, end_lon) = random_point(rng, spread), random_point(rng, spread)
+    return {'params': {'start_lat': start_lat, 'start_lon': start_lon, 'end_lat': end_lat, 'end_lon': end_lon}}
+
+
+def advice_body(rng, spread):
+    lat, lon = random_point(rng, spread)
+    return {'json': {'lat': lat, 'lon': lon, 'prompt': 'Is it safe to go running today?'}}
+
+
+def batch_body(rng, spread):
+    return {'json': {'points': [list(random_point(rng, spread)) for _ in range(25)]}}
+
+
+def heatmap_tile(rng, spread, zoom=13):
+    """المسار نفسه يتغير: tile بزوم 13 (~5 كم) تحتوي نقطة عشوائية"""
+    from django.urls import reverse
+
+    lat, lon = random_point(rng, spread)
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return {'path': reverse('heatmap_tile', kwargs={'z': zoom, 'x': x, 'y': y, 'fmt': 'png'})}
+
+
+# url name -> (method, request builder); يجب أن تغطي كل مسارات app/urls.py
+# builder يعيد kwargs لـ requests، ومعها 'path' للمسارات ذات المعاملات
+ENDPOINTS = {
+    'air_quality': ('GET', location_params),
+    'safety_score': ('GET', location_params),
+    'batch_safety_score': ('POST', batch_body),
+    'heatmap_tile': ('GET', heatmap_tile),
+    'best_route': ('GET', route_params),
+    'nearest_safe_location': ('GET', location_params),
+    'comprehensive_safety': ('GET', location_params),
+    'weather': ('GET', location_params),
+    'ai_advice': ('POST', advice_body),
+    'future_air_quality': ('GET', forecast_params),
+    'future_weather': ('GET', forecast_params),
+    'async_air_quality': ('GET', location_params),
+    'async_safety_score': ('GET', location_params),
+    'async_best_route': ('GET', route_params),
+    'async_nearest_safe_location': ('GET', location_params),
+    'async_comprehensive_safety': ('GET', location_params),
+    'async_weather': ('GET', location_params),
+    'async_ai_advice': ('POST', advice_body),
+    'async_future_air_quality': ('GET', forecast_params),
+    'async_future_weather': ('GET', forecast_params),
+}
+
+
+def endpoint_paths():
+    """مسار كل url name في app/urls.py، أو None للمسارات ذات المعاملات التي يبنيها builder"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    import django
+    django.setup()
+    from django.urls import reverse
+    from app.urls import urlpatterns
+
+    paths = {
+        pattern.name: None if pattern.pattern.converters else reverse(pattern.name)
+        for pattern in urlpatterns if pattern.name
+    }
+    missing = sorted(set(paths) - set(ENDPOINTS))
+    if missing:
+        print(f"warning: no request builder for {', '.join(missing)}; skipped", file=sys.stderr)
+    return {name: path for name, path in paths.items() if name in ENDPOINTS}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class AppServer:
+    """تشغيل التطبيق تحت gunicorn بقاعدة بيانات SQLite مؤقتة وموجه إلى الخوادم البديلة"""
+
+    def __init__(self, server, workers, upstream_env, safe_locations):
+        self.port = free_port()
+        self.workdir = tempfile.TemporaryDirectory(prefix='breathe-bench-')
+        self.env = {
+            **os.environ,
+            **upstream_env,
+            'DATABASE_URL': f"sqlite:///{self.workdir.name}/bench.sqlite3",
+            'SECRET_KEY': 'benchmark-secret-key',
+            'DEBUG': 'false',
+            'GEMINI_WARMUP': '1',
+            'METRICS_DIR': f"{self.workdir.name}/metrics",
+            'PYTHONPATH': str(ROOT),
+        }
+        self.command = ['gunicorn', '--bind', f'127.0.0.1:{self.port}', '--workers', str(workers),
+                        '--log-level', 'warning']
+        if server == 'asgi':
+            self.command += ['-k', 'uvicorn.workers.UvicornWorker', 'project.asgi:application']
+        else:
+            self.command += ['project.wsgi:application']
+        self.safe_locations = safe_locations
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def prepare(self):
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'],
+                       cwd=ROOT, env=self.env, check=True)
+        if self.safe_locations:
+            seed = (
+                "import random; from app.models import SafeLocation; rng = random.Random(7); "
+                "SafeLocation.objects.bulk_create([SafeLocation(name=f'Bench {i}', "
+                "category=rng.choice(['park', 'clinic', 'shelter']), "
+                f"latitude={CENTER[0]} + rng.uniform(-0.3, 0.3), longitude={CENTER[1]} + rng.uniform(-0.3, 0.3)) "
+                f"for i in range({self.safe_locations})], batch_size=1000)"
+            )
+            subprocess.run([sys.executable, 'manage.py', 'shell', '-c', seed], cwd=ROOT, env=self.env, check=True)
+
+    def start(self, timeout=30):
+        self.prepare()
+        self.process = subprocess.Popen(self.command, cwd=ROOT, env=self.env)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                requests.get(f'{self.base_url}/api/health/', headers=FORWARDED, timeout=1)
+                return self
+            except requests.RequestException:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError('app server did not start')
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=15)
+        self.workdir.cleanup()
+
+
+# الإعدادات تعيد التوجيه إلى https عندما DEBUG=False، كما خلف proxy الإنتاج
+FORWARDED = {'X-Forwarded-Proto': 'https'}
+
+
+def drive(base_url, path, method, builder, concurrency, duration, spread, seed):
+    """حلقة مغلقة: كل عامل يرسل الطلب التالي فور انتهاء السابق حتى انتهاء المدة"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        session.headers.update(FORWARDED)
+        local_latencies = []
+        local_errors = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                request = builder(rng, spread)
+                url = base_url + request.pop('path', path)
+                response = session.request(method, url, timeout=60, **request)
+                response.content
+                if response.status_code >= 500:
+                    local_errors += 1
+            except requests.RequestException:
+                local_errors += 1
+            local_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    samples = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) if len(samples) else (0.0, 0.0, 0.0)
+    return {
+        'requests': len(samples),
+        'errors': errors[0],
+        'rps': round(len(samples) / elapsed, 2),
+        'p50_ms': round(float(p50), 2),
+        'p95_ms': round(float(p95), 2),
+        'p99_ms': round(float(p99), 2),
+    }
+
+
+def compare(current, previous, threshold):
+    """طباعة الفروق مع نتائج سابقة، تعيد عدد التراجعات الأكبر من threshold بالمئة"""
+    regressions = 0
+    print(f"\nvs {previous['meta']['revision']} ({previous['meta']['created']})")
+    print(f"{'endpoint':<30} {'conc':>5} {'rps':>16} {'p95 ms':>18}")
+    for name, levels in current['results'].items():
+        for level, result in levels.items():
+            old = previous['results'].get(name, {}).get(level)
+            if not old:
+                continue
+            rps_delta = (result['rps'] - old['rps']) / old['rps'] * 100 if old['rps'] else 0.0
+            p95_delta = (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0.0
+            regressed = rps_delta < -threshold or p95_delta > threshold
+            regressions += regressed
+            print(f"{name:<30} {level:>5} {result['rps']:>8} ({rps_delta:+5.1f}%) "
+                  f"{result['p95_ms']:>9} ({p95_delta:+5.1f}%){'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=10, help='seconds per endpoint per concurrency level')
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--profile', default='fast', help='fake upstream profile: preset name or JSON file')
+    parser.add_argument('--endpoints', nargs='*', help='only url names starting with any of these prefixes')
+    parser.add_argument('--spread', type=float, default=0.05,
+                        help='degrees around the city centre to draw coordinates from (controls cache hit ratio)')
+    parser.add_argument('--safe-locations', type=int, default=2000, help='SafeLocation rows to seed')
+    parser.add_argument('--url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', help='suffix for the results file name')
+    parser.add_argument('--output', help='results file (default benchmarks/results/<sha>[-label].json)')
+    parser.add_argument('--compare', help='earlier results file to diff against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='regression threshold in percent')
+    args = parser.parse_args()
+
+    paths = endpoint_paths()
+    if args.endpoints:
+        paths = {name: path for name, path in paths.items() if name.startswith(tuple(args.endpoints))}
+
+    upstreams = None
+    app = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        upstreams = FakeUpstreams(args.profile).start()
+        app = AppServer(args.server, args.workers, upstreams.env(), args.safe_locations).start()
+        base_url = app.base_url
+
+    revision = git_revision()
+    report = {
+        'meta': {
+            'revision': revision,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'server': 'external' if args.url else args.server,
+            'workers': args.workers,
+            'profile': args.profile,
+            'duration': args.duration,
+            'spread': args.spread,
+        },
+        'results': {},
+    }
+    print(f"{'endpoint':<30} {'conc':>5} {'requests':>9} {'errors':>7} {'rps':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    try:
+        for name, path in paths.items():
+            method, builder = ENDPOINTS[name]
+            for concurrency in args.concurrency:
+                result = drive(base_url, path, method, builder, concurrency, args.duration, args.spread, args.seed)
+                report['results'].setdefault(name, {})[str(concurrency)] = result
+                print(f"{name:<30} {concurrency:>5} {result['requests']:>9} {result['errors']:>7} "
+                      f"{result['rps']:>9} {result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9}")
+    finally:
+        if upstreams is not None:
+            report['meta']['upstream_requests'] = upstreams.request_counts()
+        if app is not None:
+            app.stop()
+        if upstreams is not None:
+            upstreams.stop()
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{revision}{'-' + args.label if args.label else ''}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text())
+        if compare(report, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Serialization benchmark: DRF's stock JSONRenderer vs app.renderers.FastJSONRenderer
+(orjson), with and without ?fields= sparse fieldsets, on real-sized payloads.
+
+    python benchmarks/serialization.py [--repeat 200] [--route-points 2000]
+
+Payloads come from the benchmark stand-ins: a 7-day forecast.json?aqi=yes
+forecastday list (24 hourly entries per day), a current.json block and a
+TomTom route with --route-points points per leg.
+"""
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+
+from app.renderers import FastJSONRenderer  # noqa: E402
+from app.views import parse_route_data  # noqa: E402
+from fake_upstreams import weather_current, weather_forecast  # noqa: E402
+
+
+def route_payload(points):
+    lat1, lon1, lat2, lon2 = 30.05, 31.20, 30.45, 31.65
+    routes = []
+    for offset in (0.0, 0.01, -0.01):
+        routes.append({
+            'summary': {'lengthInMeters': 62000, 'travelTimeInSeconds': 3600},
+            'legs': [{'points': [
+                {'latitude': lat1 + (lat2 - lat1) * i / points + offset, 'longitude': lon1 + (lon2 - lon1) * i / points}
+                for i in range(points + 1)
+            ]}],
+        })
+    best = parse_route_data({'routes': routes})[0]
+    best.update({'safety_score': 72.5, 'average_aqi': 2.4, 'estimated_points': 0})
+    return best
+
+
+def payloads(route_points):
+    query = {'q': ['30.1,31.2'], 'days': ['7'], 'aqi': ['yes']}
+    return [
+        ('forecast 7d', weather_forecast(query)['forecast']['forecastday'], 'date,day'),
+        ('weather current', weather_current(query), 'current.temp_c,current.humidity,current.condition.text'),
+        (f'route {route_points}pt', route_payload(route_points), 'distance,duration,safety_score'),
+    ]
+
+
+def render_context(fields):
+    factory = APIRequestFactory()
+    path = f'/api/bench/?fields={fields}' if fields else '/api/bench/'
+    return {'request': Request(factory.get(path)), 'response': None}
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--route-points', type=int, default=2000)
+    args = parser.parse_args()
+
+    renderers = [
+        ('drf json', JSONRenderer(), None),
+        ('orjson', FastJSONRenderer(), None),
+    ]
+    print(f"{'payload':<18} {'renderer':<16} {'ms/render':>10} {'bytes':>10} {'speedup':>8}")
+    for name, data, fields in payloads(args.route_points):
+        baseline = None
+        cases = renderers + [('orjson +fields', FastJSONRenderer(), fields)]
+        for label, renderer, case_fields in cases:
+            context = render_context(case_fields)
+            body = renderer.render(data, 'application/json', context)
+            elapsed = best_of(args.repeat, lambda: renderer.render(data, 'application/json', context))
+            baseline = baseline or elapsed
+            print(f"{name:<18} {label:<16} {elapsed * 1000:>10.3f} {len(body):>10,} {baseline / elapsed:>7.1f}x")
+        print(f"{'':<18} fields={fields}")
+
+
+if __name__ == '__main__':
+    main()
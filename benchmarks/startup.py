@@ -0,0 +1,66 @@
+"""
+Startup benchmark: import time and resident memory of a fresh worker process.
+
+Each scenario runs in its own interpreter, so imports are always cold:
+
+    lazy   django.setup() + import app.urls (what a worker or manage.py pays now)
+    eager  the same, then load the Gemini SDK (what every process paid before)
+
+    python benchmarks/startup.py [--repeat 5]
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHILD = r"""
+import os, sys, json, time
+sys.path.insert(0, {root!r})
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-key')
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+start = time.perf_counter()
+import django
+django.setup()
+import app.urls
+if {eager!r}:
+    from app.gemini import get_genai
+    get_genai()
+print(json.dumps({{'seconds': time.perf_counter() - start, 'rss_mb': rss_mb(),
+                  'sdk_loaded': 'google.generativeai' in sys.modules}}))
+"""
+
+
+def run(eager):
+    code = CHILD.format(root=str(ROOT), eager=eager)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'scenario':>8} {'import ms':>10} {'rss MB':>8}  sdk loaded")
+    for name, eager in (('lazy', False), ('eager', True)):
+        samples = [run(eager) for _ in range(args.repeat)]
+        seconds = statistics.median(s['seconds'] for s in samples)
+        rss = statistics.median(s['rss_mb'] for s in samples)
+        print(f"{name:>8} {seconds * 1000:>10.0f} {rss:>8.1f}  {samples[0]['sdk_loaded']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+"""
+Gunicorn settings, picked up automatically from the working directory.
+
+The Gemini SDK is loaded lazily on the first AI advice request in each worker,
+so workers that never serve advice do not pay for it (~60MB RSS each). Set
+GEMINI_WARMUP=1 to import it in the background right after each worker boots
+instead, trading that memory in every worker for a faster first advice request.
+"""
+import os
+
+
+def post_worker_init(worker):
+    if os.getenv('GEMINI_WARMUP', '0').lower() not in ('1', 'true', 'yes'):
+        return
+    from app.gemini import warm_up
+    warm_up()
+    worker.log.info("Gemini warm-up started in background")
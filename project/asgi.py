@@ -3,6 +3,13 @@ ASGI config for project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Async mode: run with uvicorn workers, e.g.
+
+    gunicorn project.asgi:application -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000
+
+(or SERVER_MODE=asgi in nixpacks.toml). The /api/async/ views then wait on
+upstream providers without holding a worker; /api/ sync views still work.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -5,6 +5,7 @@ Compatible with Django 5.0 - Fixed for Railway
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 from dotenv import load_dotenv
 
@@ -59,7 +60,7 @@ INSTALLED_APPS = [
     'dj_rest_auth.registration',
     
     # Your apps here (uncomment and add your apps)
-    # 'your_app_name',
+    'app',
 ]
 
 SITE_ID = 1
@@ -73,14 +74,14 @@ AUTHENTICATION_BACKENDS = (
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
+        'app.authentication.TimedTokenAuthentication',  # TokenAuthentication timed as the "auth" phase
+        'app.authentication.TimedSessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'app.renderers.FastJSONRenderer',  # orjson, plus ?fields= sparse fieldsets on every endpoint
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
@@ -118,9 +119,11 @@ REST_AUTH = {
 
 # MIDDLEWARE - FIXED with allauth middleware
 MIDDLEWARE = [
+    'app.middleware.MetricsMiddleware',  # request latency / in-flight for /metrics
+    'app.middleware.ServerTimingMiddleware',  # Server-Timing header + slow request log
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'app.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise that also runs natively under ASGI
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -174,7 +177,7 @@ if os.environ.get('DATABASE_URL'):
             default=os.environ.get('DATABASE_URL'),
             conn_max_age=600,
             conn_health_checks=True,
-            ssl_require=True
+            ssl_require=not os.environ.get('DATABASE_URL').startswith('sqlite')  # e.g. benchmarks/load.py
         )
     }
 # Fallback: Use individual PostgreSQL variables
@@ -307,6 +310,10 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': False,
         },
+        # httpx logs every upstream request at INFO; app.http_client already logs slow calls
+        'httpx': {
+            'level': 'WARNING',
+        },
     },
 }
 
@@ -318,6 +325,184 @@ CACHES = {
     }
 }
 
+# Geo-cell cache for upstream weather/air quality data (see app/cache.py)
+GEO_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'PRECISION': int(os.getenv('GEO_CACHE_PRECISION', 6)),  # geohash length, 6 ~ 1.2km x 0.6km
+    'UPDATE_INTERVAL': 900,  # WeatherAPI refreshes current conditions every 15 minutes
+    'MIN_TTL': 60,
+    'MAX_TTL': 900,
+    'LOCK_TIMEOUT': 15,
+    'STALE_TTL': 300,  # expired entries are still served this long while they are refetched
+    # Popular cells are refetched shortly before they expire (per worker, in a background thread)
+    'REFRESH_ENABLED': os.getenv('GEO_CACHE_REFRESH', 'true').lower() == 'true',
+    'REFRESH_INTERVAL': 15,
+    'REFRESH_AHEAD': 60,  # refetch cells expiring within this many seconds
+    'REFRESH_MIN_HITS': 3,  # decayed request count for a cell to count as popular
+    'REFRESH_HALF_LIFE': 600,
+    'REFRESH_BUDGET_PER_MINUTE': int(os.getenv('GEO_CACHE_REFRESH_BUDGET', 30)),  # upstream calls per worker
+}
+
+# Time series of upstream readings per geo cell (see app/observations.py).
+# Fresh WeatherAPI responses are queued in memory and written with
+# bulk_create by a background thread, so requests never wait on the database.
+OBSERVATIONS = {
+    'ENABLED': os.getenv('OBSERVATIONS_ENABLED', 'true').lower() == 'true',
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': int(os.getenv('OBSERVATIONS_FLUSH_INTERVAL', 5)),  # seconds
+    'MAX_PENDING': 10000,  # per worker; oldest readings are dropped beyond this
+}
+
+# Air quality forecast engine (see app/forecast.py): blends WeatherAPI's 7-day
+# forecast with the stored observation history; results are cached per cell
+# per day. `manage.py precompute_forecasts` fills the same keys for all active
+# cells; it refuses to run when CACHE_ALIAS is process-local (e.g. LocMem).
+FORECAST = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 3600,
+    'HISTORY_DAYS': 14,
+    'UPSTREAM_WEIGHT': 0.7,  # WeatherAPI forecast vs statistical model, per day
+    'ACTIVE_DAYS': 2,  # cells with readings this recent are precomputed
+}
+
+# Conditional GET for the per-location read endpoints (see app/conditional.py):
+# ETag from the geo cell and upstream fetch time, max-age until the cached data
+# expires, and 304s for matching If-None-Match without running the view.
+CONDITIONAL_GET = {
+    'ENABLED': os.getenv('CONDITIONAL_GET', 'true').lower() == 'true',
+    'PUBLIC': True,  # responses do not depend on the user, so shared caches may store them
+}
+
+# Shared keep-alive HTTP session for upstream providers (see app/http_client.py)
+UPSTREAM_HTTP = {
+    'POOL_CONNECTIONS': int(os.getenv('UPSTREAM_POOL_CONNECTIONS', 10)),  # per-host pools kept per worker
+    'POOL_MAXSIZE': int(os.getenv('UPSTREAM_POOL_MAXSIZE', 20)),  # connections kept per host
+    'CONNECT_TIMEOUT': float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05)),
+    'READ_TIMEOUT': float(os.getenv('UPSTREAM_READ_TIMEOUT', 10)),
+    'SLOW_REQUEST_MS': 2000,
+    'ASYNC_MAX_CONNECTIONS': int(os.getenv('UPSTREAM_ASYNC_MAX_CONNECTIONS', 200)),  # in-flight calls per ASGI worker
+}
+
+# Per-request phase timings (upstream calls, Gemini, auth, render) sent as a
+# Server-Timing header; requests slower than SLOW_REQUEST_MS are logged as JSON
+SERVER_TIMING = {
+    'HEADER': os.getenv('SERVER_TIMING_HEADER', 'true').lower() == 'true',
+    'SLOW_REQUEST_MS': int(os.getenv('SLOW_REQUEST_MS', 1000)),
+}
+
+# Prometheus metrics served at /metrics, summed across workers through per-worker
+# snapshot files in MULTIPROC_DIR. The default is a temp directory named after the
+# gunicorn master (the workers' parent), so each deploy starts from zero.
+# METRICS_DIR='' disables aggregation; /metrics then reports only the worker that answered.
+METRICS = {
+    'MULTIPROC_DIR': os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"breathe-metrics-{os.getppid()}")),
+    'FLUSH_INTERVAL': 5,  # seconds between per-worker snapshot writes
+    'TOKEN': os.getenv('METRICS_TOKEN'),  # if set, scrapers send Authorization: Bearer <token>
+}
+
+# Upstream base URLs; override to point the app at local stand-ins
+# (see benchmarks/fake_upstreams.py). Unset values keep the public APIs.
+UPSTREAM_BASE_URLS = {
+    'weatherapi': os.getenv('WEATHER_API_BASE_URL'),  # default http://api.weatherapi.com/v1
+    'tomtom': os.getenv('TOMTOM_BASE_URL'),  # default https://api.tomtom.com
+    'nasa': os.getenv('NASA_CMR_BASE_URL'),  # default https://cmr.earthdata.nasa.gov
+}
+
+# Per-provider circuit breaker (weatherapi, tomtom, nasa); state is per worker
+# and reported by the health check
+CIRCUIT_BREAKER = {
+    'WINDOW': 20,  # most recent calls used for the rates below
+    'MIN_CALLS': 10,
+    'ERROR_RATE': 0.5,
+    'SLOW_CALL_MS': 5000,
+    'SLOW_RATE': 0.8,
+    'OPEN_SECONDS': int(os.getenv('CIRCUIT_BREAKER_OPEN_SECONDS', 30)),  # fallbacks only, then one probe call
+    'HALF_OPEN_CALLS': 1,
+    'RETRIES': int(os.getenv('UPSTREAM_RETRIES', 2)),  # connection errors, 5xx and 429 only
+    'BACKOFF_BASE': 0.2,
+    'BACKOFF_MAX': 2.0,
+}
+
+# Per-key upstream call budgets (see app/quota.py). Counters live in CACHE_ALIAS, so the
+# budget is only shared by all workers when that cache is shared (Redis/Memcached).
+# With a process-local cache each of LOCAL_WORKERS workers gets an equal slice of
+# every limit instead (gunicorn also reads WEB_CONCURRENCY for its worker count).
+# 0 = unlimited. Over-budget calls are served from cache or fallback data immediately.
+UPSTREAM_QUOTA = {
+    'ENABLED': os.getenv('UPSTREAM_QUOTA', 'true').lower() == 'true',
+    'CACHE_ALIAS': 'default',
+    'LOCAL_WORKERS': int(os.getenv('WEB_CONCURRENCY', 1)),
+    'LIMITS': {
+        'weatherapi': {
+            'PER_MINUTE': int(os.getenv('WEATHERAPI_QUOTA_PER_MINUTE', 600)),
+            'PER_DAY': int(os.getenv('WEATHERAPI_QUOTA_PER_DAY', 30000)),
+        },
+        'tomtom': {
+            'PER_MINUTE': int(os.getenv('TOMTOM_QUOTA_PER_MINUTE', 300)),
+            'PER_DAY': int(os.getenv('TOMTOM_QUOTA_PER_DAY', 2500)),
+        },
+        'gemini': {
+            'PER_MINUTE': int(os.getenv('GEMINI_QUOTA_PER_MINUTE', 15)),
+            'PER_DAY': int(os.getenv('GEMINI_QUOTA_PER_DAY', 1500)),
+        },
+    },
+    # share of each limit kept back from lower priorities (interactive requests can use all of it)
+    'RESERVE': {'interactive': 0.0, 'background': 0.2, 'batch': 0.5},
+}
+
+# Bounded worker pool for concurrent upstream lookups (see app/concurrency.py)
+UPSTREAM_MAX_WORKERS = int(os.getenv('UPSTREAM_MAX_WORKERS', 8))
+
+ROUTE_SCORING = {
+    'DEADLINE': float(os.getenv('ROUTE_SCORING_DEADLINE', 4.0)),  # seconds for all sample lookups
+    'SAMPLE_SPACING': 500,  # metres between samples along each route
+    'MAX_SAMPLES': 40,  # spacing grows on long routes to stay under this
+}
+
+# Batch /api/batch/safety-score/ limits
+BATCH_SCORING = {
+    'MAX_POINTS': 1000,
+    'MAX_UPSTREAM_CALLS': int(os.getenv('BATCH_MAX_UPSTREAM_CALLS', 100)),  # uncached cells fetched per batch
+    'DEADLINE': 20,  # seconds before pending cells are returned as estimates
+}
+
+# /api/comprehensive-safety/ runs its air quality and NASA lookups concurrently;
+# the async views (comprehensive safety and AI advice) use the same deadline
+COMPREHENSIVE_SAFETY = {
+    'DEADLINE': float(os.getenv('COMPREHENSIVE_SAFETY_DEADLINE', 8.0)),  # seconds before fallbacks are used
+}
+
+# Local MOD11A1 land surface temperature tiles (see app/lst.py), filled by
+# `manage.py ingest_lst <granules>` and memory-mapped read-only by every worker
+LST_TILES = {
+    'DIRECTORY': os.getenv('LST_TILE_DIR', os.path.join(BASE_DIR, 'data', 'lst')),
+    'RELOAD_INTERVAL': 60,  # seconds between checks for re-ingested tiles
+}
+
+# In-memory spatial index of SafeLocation rows (see app/spatial.py)
+SAFE_LOCATIONS = {
+    'BUCKET_DEGREES': 0.01,  # grid bucket size, ~1.1km
+    'K': 5,  # candidates that get an AQI lookup
+    'MAX_RADIUS': 10000,  # metres
+    # The index version lives in this cache. Use a shared cache so admin edits reach every
+    # worker at once; with LocMem each worker reloads its index every RELOAD_INTERVAL seconds.
+    'CACHE_ALIAS': 'default',
+    'RELOAD_INTERVAL': 300,
+}
+
+# Safety heatmap tiles /api/heatmap/<z>/<x>/<y>.png|.bin (see app/heatmap.py)
+HEATMAP = {
+    'SIZE': 16,  # samples per tile side, ?size= may pick another of SIZES
+    'SIZES': (8, 16, 32),
+    'MIN_ZOOM': 8,
+    'MAX_ZOOM': 18,
+    'MAX_UPSTREAM_CALLS': int(os.getenv('HEATMAP_MAX_UPSTREAM_CALLS', 32)),  # uncached cells fetched per tile
+    'DEADLINE': 5,
+    'MIN_TTL': 60,
+    'MAX_TTL': 900,
+    'PARTIAL_TTL': 30,  # tiles with cells still missing data are rebuilt sooner
+}
+
 # Email configuration
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -327,5 +512,20 @@ GOOGLE_GENERATIVE_AI_CONFIG = {
     'max_output_tokens': 2048,
 }
 
+# AI advice response cache, keyed by prompt and bucketed conditions (see app/views.py)
+ADVICE_CACHE = {
+    'MAX_ENTRIES': 512,  # least recently used entries are evicted first
+    'TTL': 3600,
+    'TEMP_BAND': 5,  # degrees C per bucket
+    'HUMIDITY_BAND': 20,  # percent per bucket
+}
+
+# Seconds a failed Gemini model is tried last before being retried first again
+GEMINI_MODEL_COOLDOWN = 300
+
+# Alternative Gemini endpoint (e.g. http://127.0.0.1:8900 for a local stand-in);
+# when set the SDK uses its REST transport against it
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')
+
 # App settings
 APPEND_SLASH = True
\ No newline at end of file
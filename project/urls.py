@@ -4,8 +4,13 @@ URL configuration for project project.
 
 from django.contrib import admin
 from django.urls import path, include
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from app.cache import get_cache_stats
+from app.circuit import get_breaker_states
+from app.observations import get_observation_stats
+from app.quota import get_quota_stats
+from app import metrics
 
 @csrf_exempt
 def health_check(request):
@@ -13,12 +18,23 @@ def health_check(request):
         "status": "healthy",
         "service": "Django API",
         "version": "1.0",
-        "debug": False
+        "debug": False,
+        "geo_cache": get_cache_stats(),
+        "circuit_breakers": get_breaker_states(),
+        "observations": get_observation_stats(),
+        "upstream_quota": get_quota_stats()
     })
 
+def metrics_view(request):
+    token = metrics.get_metrics_config().get('TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 urlpatterns = [
     path('', health_check),
     path('api/health/', health_check),
+    path('metrics', metrics_view),
     path('admin/', admin.site.urls),
     path('api/auth/', include('dj_rest_auth.urls')),
     path('api/auth/registration/', include('dj_rest_auth.registration.urls')),